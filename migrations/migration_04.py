@@ -0,0 +1,26 @@
+import sqlite3
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.executescript("""
+BEGIN;
+CREATE INDEX workout_user_at ON workout(user_id, at);
+CREATE INDEX workout_split_id ON workout(split_id);
+CREATE INDEX lift_set_workout_slug ON lift_set(workout_slug);
+CREATE INDEX lift_set_lift_slug ON lift_set(lift_slug);
+CREATE INDEX split_lift_lift_id ON split_lift(lift_id);
+COMMIT;
+""")
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+
+    import config
+
+    connection = sqlite3.connect(config.DB_FILE)
+    migrate(connection)
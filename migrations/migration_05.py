@@ -0,0 +1,64 @@
+import sqlite3
+
+
+def migrate(connection: sqlite3.Connection):
+    # Foreign keys must be off while the tables are rebuilt, otherwise
+    # dropping the old tables would cascade. This cannot be changed inside a
+    # transaction.
+    connection.execute("PRAGMA foreign_keys = 0")
+    connection.executescript("""
+BEGIN;
+CREATE TABLE workout2(
+    id INTEGER PRIMARY KEY,
+    at INTEGER NOT NULL,
+    slug TEXT UNIQUE NOT NULL,
+    split_id INTEGER NOT NULL REFERENCES split(id),
+    user_id INTEGER NOT NULL REFERENCES user(id)
+) STRICT;
+INSERT INTO workout2 (at, slug, split_id, user_id)
+SELECT at, slug, split_id, user_id FROM workout ORDER BY at;
+
+-- weight_unit: 0 = kg, 1 = lb
+CREATE TABLE lift_set2(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lift_id INTEGER NOT NULL REFERENCES lift(id) ON DELETE CASCADE,
+    workout_id INTEGER NOT NULL REFERENCES workout2(id) ON DELETE CASCADE,
+    reps INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    weight_unit INTEGER NOT NULL CHECK (weight_unit IN (0, 1))
+) STRICT;
+INSERT INTO lift_set2 (id, lift_id, workout_id, reps, weight, weight_unit)
+SELECT lift_set.id, lift.id, workout2.id, lift_set.reps, lift_set.weight,
+    CASE lift_set.weight_unit WHEN 'kg' THEN 0 ELSE 1 END
+FROM lift_set
+INNER JOIN lift ON lift.slug = lift_set.lift_slug
+INNER JOIN workout2 ON workout2.slug = lift_set.workout_slug;
+
+DROP TABLE lift_set;
+DROP TABLE workout;
+ALTER TABLE workout2 RENAME TO workout;
+ALTER TABLE lift_set2 RENAME TO lift_set;
+
+CREATE INDEX workout_user_at ON workout(user_id, at);
+CREATE INDEX workout_split_id ON workout(split_id);
+CREATE INDEX lift_set_workout_id ON lift_set(workout_id);
+CREATE INDEX lift_set_lift_id ON lift_set(lift_id);
+COMMIT;
+""")
+    connection.execute("PRAGMA foreign_keys = 1")
+    violations = connection.execute("PRAGMA foreign_key_check").fetchall()
+    if violations:
+        raise RuntimeError(f"Foreign key violations after migration: {violations}")
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+
+    import config
+
+    connection = sqlite3.connect(config.DB_FILE)
+    migrate(connection)
@@ -0,0 +1,36 @@
+import sqlite3
+
+
+def migrate(connection: sqlite3.Connection):
+    # Bumped whenever something cached about a user changes, so workers can
+    # tell their identity caches are stale, whichever process made the change.
+    connection.executescript("""
+BEGIN;
+CREATE TABLE user_epoch(
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    epoch INTEGER NOT NULL
+) STRICT;
+INSERT INTO user_epoch (id, epoch) VALUES (0, 0);
+CREATE TRIGGER user_epoch_update AFTER UPDATE OF email, auth_group ON user
+BEGIN
+    UPDATE user_epoch SET epoch = epoch + 1 WHERE id = 0;
+END;
+CREATE TRIGGER user_epoch_delete AFTER DELETE ON user
+BEGIN
+    UPDATE user_epoch SET epoch = epoch + 1 WHERE id = 0;
+END;
+COMMIT;
+""")
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+
+    import config
+
+    connection = sqlite3.connect(config.DB_FILE)
+    migrate(connection)
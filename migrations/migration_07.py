@@ -0,0 +1,30 @@
+import sqlite3
+
+
+def migrate(connection: sqlite3.Connection):
+    # Refresh tokens that may no longer be used, by their jti claim. Workers
+    # follow the ids to pick up tokens revoked since they last looked, so ids
+    # must never be reused. Rows are only needed until the token expires.
+    connection.executescript("""
+BEGIN;
+CREATE TABLE revoked_token(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT UNIQUE NOT NULL,
+    expires INTEGER NOT NULL
+) STRICT;
+CREATE INDEX revoked_token_expires ON revoked_token(expires);
+COMMIT;
+""")
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+
+    import config
+
+    connection = sqlite3.connect(config.DB_FILE)
+    migrate(connection)
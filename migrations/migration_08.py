@@ -0,0 +1,26 @@
+import sqlite3
+
+
+def migrate(connection: sqlite3.Connection):
+    # Workouts are paged through newest first by (at, slug). With slug in
+    # the index, a page starts with a seek to the cursor instead of
+    # skipping the pages before it.
+    connection.executescript("""
+BEGIN;
+DROP INDEX workout_user_at;
+CREATE INDEX workout_user_at_slug ON workout(user_id, at, slug);
+COMMIT;
+""")
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+
+    import config
+
+    connection = sqlite3.connect(config.DB_FILE)
+    migrate(connection)
@@ -0,0 +1,26 @@
+import sqlite3
+
+
+def migrate(connection: sqlite3.Connection):
+    # Sets are looked up by workout and lift together, both for one workout
+    # and for a lift's history across workouts. The wider index still serves
+    # lookups by workout alone.
+    connection.executescript("""
+BEGIN;
+DROP INDEX lift_set_workout_id;
+CREATE INDEX lift_set_workout_lift ON lift_set(workout_id, lift_id);
+COMMIT;
+""")
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+
+    import config
+
+    connection = sqlite3.connect(config.DB_FILE)
+    migrate(connection)
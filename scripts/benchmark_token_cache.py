@@ -0,0 +1,121 @@
+import importlib.util
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import timeit
+
+
+def _migrate(path: str, migrations: str):
+    connection = sqlite3.connect(path)
+    for name in sorted(os.listdir(migrations)):
+        if name.startswith("migration_") and name.endswith(".py"):
+            spec = importlib.util.spec_from_file_location(name[:-3], os.path.join(migrations, name))
+            assert spec is not None and spec.loader is not None
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.migrate(connection)
+    connection.close()
+
+
+def _measure(client, headers: dict[str, str], requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client.get("/api/workouts", headers=headers)
+        assert response.status_code == 200, response.text
+    return (time.perf_counter() - started) / requests
+
+
+def _summary(samples: list[float]) -> str:
+    """
+    Median and interquartile range of ``samples``, in microseconds.
+    """
+    low, _, high = statistics.quantiles(samples, n=4)
+    return f"{statistics.median(samples) * 1e6:8.1f} us (IQR {low * 1e6:.1f} to {high * 1e6:.1f})"
+
+
+def main(argv: list[str]):
+    """
+    Compare GET /api/workouts with and without the verified-token cache, on
+    a scratch database. Each round times both, alternating which goes first
+    so that drift (e.g. a warming cache or CPU frequency changes) does not
+    favour either; the saving is taken per round and summarised over all
+    rounds.
+
+    Usage: benchmark_token_cache.py [ROUNDS] [REQUESTS_PER_ROUND]
+    """
+    rounds = int(argv[1]) if len(argv) > 1 else 20
+    requests = int(argv[2]) if len(argv) > 2 else 200
+
+    import jwt
+    from fastapi.testclient import TestClient
+
+    import config
+    import dependencies
+    from main import app
+
+    with tempfile.TemporaryDirectory() as directory:
+        config.DB_FILE = os.path.join(directory, "girya.db")
+        _migrate(config.DB_FILE, os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations"))
+
+        connection = sqlite3.connect(config.DB_FILE)
+        connection.execute("INSERT INTO user (email, first_name, last_name, password, auth_group) "
+                           "VALUES ('bench@example.com', 'Bench', 'User', 'unused', 'common')")
+        connection.commit()
+        connection.close()
+
+        token = jwt.encode({
+            "iss": config.JWT_ISS,
+            "sub": "bench@example.com",
+            "aud": config.JWT_AUD,
+            "exp": int(time.time()) + 60 * 60,
+            "scope": config.PERMISSIONS_GROUPS["common"],
+        }, config.JWT_KEY, algorithm=config.JWT_ALGO)
+        headers = { "Authorization": f"Bearer {token}" }
+        max_size = dependencies.token_cache.max_size
+
+        def measure(cached: bool) -> float:
+            dependencies.token_cache.max_size = max_size if cached else 0
+            dependencies.token_cache.clear()
+            return _measure(client, headers, requests)
+
+        uncached: list[float] = []
+        cached: list[float] = []
+        with TestClient(app) as client:
+            _measure(client, headers, requests)  # warm up
+            for index in range(rounds):
+                if index % 2:
+                    cached.append(measure(True))
+                    uncached.append(measure(False))
+                else:
+                    uncached.append(measure(False))
+                    cached.append(measure(True))
+        dependencies.token_cache.max_size = max_size
+
+        # verify_token alone, which is all the cache changes
+        dependencies.token_cache.clear()
+        decode = min(timeit.repeat(
+            lambda: jwt.decode(token, config.JWT_KEY, audience=config.JWT_AUD, algorithms=config.JWT_ALGS),
+            number=requests, repeat=rounds)) / requests
+        lookup = min(timeit.repeat(lambda: dependencies.verify_token(token), number=requests, repeat=rounds)) / requests
+
+    print(f"GET /api/workouts, {rounds} rounds of {requests} requests, median per request")
+    print(f"  without token cache: {_summary(uncached)}")
+    print(f"  with token cache:    {_summary(cached)}")
+    print(f"  saving:              {_summary([u - c for u, c in zip(uncached, cached)])}")
+    print("verify_token alone, best of all rounds")
+    print(f"  jwt.decode:          {decode * 1e6:8.1f} us")
+    print(f"  cache hit:           {lookup * 1e6:8.1f} us")
+
+
+if __name__ == '__main__':
+    import sys
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+    # long enough that jwt does not warn on every decode, which would skew the
+    # uncached timings
+    os.environ.setdefault("GIRYA_JWT_KEY", "benchmark" * 8)
+
+    main(sys.argv)
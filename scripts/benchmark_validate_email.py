@@ -0,0 +1,47 @@
+import timeit
+
+
+INPUTS = {
+    "typical": "firstname.lastname@example.com",
+    "quoted": r'"very.(),:;<>[]\".VERY.\"very@\\ \"very\".unusual"@strange.example.com',
+    "long local part": "a" * 64 + "@example.com",
+    "too long local part": "a" * 5000 + "@example.com",
+    "escapes": "\\" * 60 + "a@example.com",
+    "unterminated quote": '"' + "a" * 60 + "@example.com",
+    "many labels": "a@" + ".".join(["a-b"] * 500) + ".com",
+    "dashes": "a@" + "a" + "-" * 5000,
+    "no @": "a" * 64,
+}
+
+
+def main(argv: list[str]):
+    """
+    Time validate_email on typical and adversarial addresses.
+
+    Usage: benchmark_validate_email.py [NUMBER]
+    """
+    number = int(argv[1]) if len(argv) > 1 else 10000
+
+    from auth.exceptions import EmailValidationError
+    from auth.services import validate_email
+
+    def validate(email: str):
+        try:
+            validate_email(email)
+        except EmailValidationError:
+            pass
+
+    for name, email in INPUTS.items():
+        seconds = min(timeit.repeat(lambda: validate(email), number=number, repeat=5)) / number
+        print(f"{name:>20} ({len(email):>5} chars): {seconds * 1e6:10.2f} us")
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    parent = os.path.dirname(os.path.dirname(__file__))
+    sys.path.append(os.path.join(parent, "src"))
+    os.environ.setdefault("GIRYA_JWT_KEY", "benchmark")
+
+    main(sys.argv)
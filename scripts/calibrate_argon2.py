@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import time
+
+
+def _measure(time_cost: int, memory_cost: int, parallelism: int, samples: int) -> float:
+    import argon2
+
+    hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.hash("calibration password")
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main(argv: list[str]):
+    """
+    Measure argon2 on this host and pick the highest cost that still hashes a
+    password within the target latency. Memory cost is raised first, as it
+    is what makes argon2 expensive to attack, then time cost.
+    """
+    parser = argparse.ArgumentParser(description="Calibrate argon2 cost parameters for this host.")
+    parser.add_argument("--target-ms", type=float, default=250, help="Target hashing latency in milliseconds.")
+    parser.add_argument("--max-memory-mib", type=int, default=256, help="Most memory a single hash may use.")
+    parser.add_argument("--parallelism", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Lanes per hash.")
+    parser.add_argument("--samples", type=int, default=5, help="Hashes timed per candidate.")
+    args = parser.parse_args(argv[1:])
+
+    target = args.target_ms / 1000
+    time_cost = 1
+    memory_cost = 8 * 1024
+    latency = _measure(time_cost, memory_cost, args.parallelism, args.samples)
+
+    while memory_cost * 2 <= args.max_memory_mib * 1024:
+        candidate = _measure(time_cost, memory_cost * 2, args.parallelism, args.samples)
+        if candidate > target:
+            break
+        memory_cost *= 2
+        latency = candidate
+
+    while True:
+        candidate = _measure(time_cost + 1, memory_cost, args.parallelism, args.samples)
+        if candidate > target:
+            break
+        time_cost += 1
+        latency = candidate
+
+    if latency > target:
+        print(f"# even the cheapest parameters take {latency * 1000:.0f} ms, over the target")
+    else:
+        print(f"# hashing takes {latency * 1000:.0f} ms for a target of {args.target_ms:.0f} ms")
+    print(f"GIRYA_ARGON2_TIME_COST={time_cost}")
+    print(f"GIRYA_ARGON2_MEMORY_COST={memory_cost}")
+    print(f"GIRYA_ARGON2_PARALLELISM={args.parallelism}")
+
+
+if __name__ == '__main__':
+    import sys
+
+    main(sys.argv)
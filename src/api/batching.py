@@ -0,0 +1,184 @@
+import concurrent.futures
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from fastapi import HTTPException
+
+import config
+import database
+import metrics
+from . import schemas, services
+
+
+flush_size = metrics.histogram("set_writer_flush_size", "Sets written per group commit.")
+flush_latency = metrics.histogram("set_writer_flush_seconds", "Time taken to write and commit a group of sets.")
+queue_wait = metrics.histogram("set_writer_queue_wait_seconds", "Time sets waited before being flushed.")
+pending = metrics.gauge("set_writer_pending", "Sets waiting to be flushed.")
+
+
+def _write(connection: sqlite3.Connection, set_inputs: list[schemas.SetInput], user_ids: list[int | None]
+           ) -> tuple[list[tuple[schemas.Lift, int] | HTTPException], list[schemas.Set]]:
+    """
+    Resolve and insert a group of sets in one transaction. The write lock is
+    taken before resolving, so a workout deleted meanwhile cannot fail the
+    insert, and a locked database never leaves part of the group written.
+
+    :returns: What :func:`services.resolve_sets` resolved each set to, and
+        the sets created, in order.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    resolved = services.resolve_sets(connection, set_inputs, user_ids)
+    created = services.insert_sets(connection, [
+        (result[0], result[1], set_input) for set_input, result in zip(set_inputs, resolved)
+        if isinstance(result, tuple)
+    ])
+    # a COMMIT that finds the database locked leaves the transaction open
+    database.retry_busy(connection.commit)
+    return resolved, created
+
+
+class _PendingSet:
+    def __init__(self, set_input: schemas.SetInput, user_id: int | None):
+        self.set_input = set_input
+        self.user_id = user_id
+        self.future: concurrent.futures.Future[schemas.Set] = concurrent.futures.Future()
+        self.submitted = time.perf_counter()
+
+
+class SetWriter:
+    """
+    Group commit for set inserts. Sets submitted by concurrent requests are
+    collected for up to ``max_delay`` seconds (or until ``max_batch`` sets
+    are waiting) and then written by a single thread in one transaction, so
+    the whole group pays for one commit.
+
+    :param connect: Opens the connection the writer thread uses.
+    :param max_batch: The most sets written in one transaction.
+    :param max_delay: The longest a set waits for others to join its group.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_batch: int, max_delay: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._connect = connect
+        self._queue: queue.Queue[_PendingSet | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="girya-set-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, set_input: schemas.SetInput, user_id: int | None = None) -> concurrent.futures.Future[schemas.Set]:
+        """
+        Queue a set to be written. The returned future resolves to the
+        created set, or raises the error that :func:`services.create_set`
+        would have raised.
+        """
+        pending_set = _PendingSet(set_input, user_id)
+        pending.inc()
+        self._queue.put(pending_set)
+        return pending_set.future
+
+    def close(self):
+        """
+        Write any sets still waiting and stop the writer thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first: _PendingSet) -> tuple[list[_PendingSet], bool]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _run(self):
+        database.route.set("set-writer")
+        connection: sqlite3.Connection | None = None
+        try:
+            stopping = False
+            while not stopping:
+                first = self._queue.get()
+                if first is None:
+                    break
+                batch, stopping = self._collect(first)
+                connection = self._flush(connection, batch)
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _flush(self, connection: sqlite3.Connection | None, batch: list[_PendingSet]) -> sqlite3.Connection | None:
+        started = time.perf_counter()
+        pending.dec(len(batch))
+        for item in batch:
+            queue_wait.observe(started - item.submitted)
+        # drop sets whose request has gone away
+        batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+        if not batch:
+            return connection
+
+        try:
+            if connection is None:
+                connection = self._connect()
+            resolved, created = database.retry_busy(_write, connection, [item.set_input for item in batch],
+                                                    [item.user_id for item in batch])
+        except BaseException as e:
+            if connection is not None:
+                connection.rollback()
+            for item in batch:
+                item.future.set_exception(e)
+            return connection
+
+        flush_size.observe(len(created))
+        flush_latency.observe(time.perf_counter() - started)
+        writable = [item for item, result in zip(batch, resolved) if isinstance(result, tuple)]
+        for item, lift_set in zip(writable, created):
+            item.future.set_result(lift_set)
+        for item, result in zip(batch, resolved):
+            if isinstance(result, HTTPException):
+                item.future.set_exception(result)
+
+        return connection
+
+
+_writer_lock = threading.Lock()
+_writer: SetWriter | None = None
+_writer_pid: int | None = None
+
+
+def get_set_writer() -> SetWriter:
+    """
+    Return this worker's set writer, starting it on first use.
+    """
+    global _writer
+    global _writer_pid
+
+    pid = os.getpid()
+    if _writer is not None and _writer_pid == pid:
+        return _writer
+
+    with _writer_lock:
+        if _writer is None or _writer_pid != pid:
+            _writer = SetWriter(database.connect, config.SET_GROUP_COMMIT_MAX_BATCH,
+                                config.SET_GROUP_COMMIT_MAX_DELAY)
+            _writer_pid = pid
+        return _writer
+
+
+def close_set_writer():
+    global _writer
+
+    with _writer_lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            _writer.close()
+        _writer = None
@@ -0,0 +1,34 @@
+"""
+Opaque cursors for keyset pagination. A cursor holds the sort key of the
+last item on a page; the next page starts right after it.
+"""
+import base64
+import json
+
+from fastapi import HTTPException, status
+
+
+# the range of an SQLite INTEGER, which integer parts of a key are bound as
+_INTEGER_MIN = -2 ** 63
+_INTEGER_MAX = 2 ** 63 - 1
+
+
+def encode_cursor(*key: int | str) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, shape: tuple[type, ...]) -> tuple:
+    """
+    :param shape: The type of each part of the sort key.
+    :raises HTTPException: With status 400 if the cursor was not made by
+        :func:`encode_cursor` for a key of that shape.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if (not isinstance(key, list) or len(key) != len(shape)
+                or not all(type(part) is part_type for part, part_type in zip(key, shape))
+                or not all(_INTEGER_MIN <= part <= _INTEGER_MAX for part in key if type(part) is int)):
+            raise ValueError()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+    return tuple(key)
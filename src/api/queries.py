@@ -0,0 +1,107 @@
+"""
+Every statement run by :mod:`api.services`. Statements have a fixed shape:
+lists are passed as a single JSON array parameter and read with
+``json_each``, and optional filters get a statement of their own.
+"""
+from database import statement
+
+
+# lifts
+INSERT_LIFT = statement("insert_lift", "INSERT INTO lift (name, slug) VALUES (:name, :slug)")
+DELETE_LIFT_BY_SLUG = statement("delete_lift_by_slug", "DELETE FROM lift WHERE slug = ?")
+SELECT_LIFT_BY_SLUG = statement("select_lift_by_slug", "SELECT id, name, slug FROM lift WHERE slug = ?")
+SELECT_LIFTS_BY_SLUGS = statement("select_lifts_by_slugs", """SELECT id, name, slug FROM lift
+WHERE slug IN (SELECT value FROM json_each(?))""")
+SELECT_LIFTS = statement("select_lifts", "SELECT id, name, slug FROM lift ORDER BY name ASC")
+UPDATE_LIFT_BY_SLUG = statement("update_lift_by_slug", """UPDATE lift SET name = :name, slug = :new_slug
+WHERE slug = :slug RETURNING lift.id""")
+
+# splits
+INSERT_SPLIT = statement("insert_split", "INSERT INTO split (name, slug) VALUES (:name, :slug)")
+INSERT_SPLIT_LIFT = statement("insert_split_lift", """INSERT INTO split_lift (split_id, lift_id)
+VALUES (:split_id, :lift_id)""")
+DELETE_SPLIT_LIFTS = statement("delete_split_lifts", "DELETE FROM split_lift WHERE split_id = ?")
+SELECT_SPLIT_LIFTS = statement("select_split_lifts", """SELECT lift.id, lift.name, lift.slug FROM lift
+INNER JOIN split_lift ON lift.id = split_lift.lift_id WHERE split_lift.split_id = :split_id
+ORDER BY lift.id ASC""")
+SELECT_SPLIT_BY_SLUG = statement("select_split_by_slug", "SELECT id, name, slug FROM split WHERE slug = :slug")
+SELECT_SPLIT_BY_ID = statement("select_split_by_id", "SELECT id, name, slug FROM split WHERE id = :id")
+SELECT_SPLITS = statement("select_splits", """SELECT split.id, split.name, split.slug, lift.id, lift.name, lift.slug
+FROM split
+LEFT JOIN split_lift ON split.id = split_lift.split_id
+LEFT JOIN lift ON split_lift.lift_id = lift.id""")
+UPDATE_SPLIT_BY_SLUG = statement("update_split_by_slug", """UPDATE split SET name = :name, slug = :new_slug
+WHERE slug = :slug RETURNING split.id""")
+DELETE_SPLIT_BY_SLUG = statement("delete_split_by_slug", "DELETE FROM split WHERE slug = ?")
+
+# workouts
+INSERT_WORKOUT = statement("insert_workout", """INSERT INTO workout (at, slug, split_id, user_id)
+VALUES (:at, :slug, :split_id, :user_id) RETURNING id""")
+# A page of workouts, newest first, before the (at, slug) cursor. The bounds on
+# at alone are what the index seeks to; the row value only breaks ties. The
+# first page's cursor is past any workout, so every page seeks the same way.
+SELECT_WORKOUTS = statement("select_workouts", """WITH page AS (
+    SELECT id, at, slug, split_id FROM workout
+    WHERE user_id = :user_id AND at >= :from_at AND at <= :before_at AND (at, slug) < (:before_at, :before_slug)
+    ORDER BY at DESC, slug DESC
+    LIMIT :limit
+)
+SELECT page.at, page.slug, page.split_id, split.slug, split.name, lift.slug, lift.name, lift.id
+FROM page
+INNER JOIN split ON page.split_id = split.id
+LEFT JOIN split_lift ON split.id = split_lift.split_id
+LEFT JOIN lift ON split_lift.lift_id = lift.id
+ORDER BY page.at DESC, page.slug DESC, lift.id ASC""")
+SELECT_WORKOUT_BY_SLUG = statement("select_workout_by_slug", """SELECT at, slug, split_id, user_id FROM workout
+WHERE slug = ?""")
+SELECT_WORKOUTS_BY_SLUGS = statement("select_workouts_by_slugs", """SELECT slug, id, user_id FROM workout
+WHERE slug IN (SELECT value FROM json_each(?))""")
+DELETE_WORKOUT_BY_SLUG = statement("delete_workout_by_slug", "DELETE FROM workout WHERE slug = :slug")
+DELETE_USER_WORKOUT_BY_SLUG = statement("delete_user_workout_by_slug", """DELETE FROM workout
+WHERE slug = :slug AND user_id = :user_id""")
+
+# sets
+_INSERT_SET = """INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+SELECT :lift_id, workout.id, :reps, :weight, :weight_unit FROM workout
+WHERE workout.slug = :workout_slug"""
+INSERT_SET = statement("insert_set", _INSERT_SET)
+INSERT_USER_SET = statement("insert_user_set", _INSERT_SET + " AND workout.user_id = :user_id")
+INSERT_SET_ROW = statement("insert_set_row", """INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+VALUES (:lift_id, :workout_id, :reps, :weight, :weight_unit) RETURNING id""")
+UPDATE_USER_SET_BY_ID = statement("update_user_set_by_id", """UPDATE lift_set
+SET lift_id = :lift_id, reps = :reps, weight = :weight, weight_unit = :weight_unit
+WHERE id = :set_id AND workout_id IN (SELECT id FROM workout WHERE user_id = :user_id)""")
+_SELECT_SET_BY_ID = """SELECT lift.id, lift.name, lift.slug, lift_set.reps, lift_set.weight, lift_set.weight_unit
+FROM lift_set
+INNER JOIN lift ON lift.id = lift_set.lift_id
+WHERE lift_set.id = :set_id"""
+SELECT_SET_BY_ID = statement("select_set_by_id", _SELECT_SET_BY_ID)
+SELECT_USER_SET_BY_ID = statement("select_user_set_by_id", _SELECT_SET_BY_ID + """
+AND lift_set.workout_id IN (SELECT id FROM workout WHERE user_id = :user_id)""")
+# The sets of a workout, found along with the workout so that one statement
+# also checks its owner: no rows means no such workout of the user, and a
+# workout without (matching) sets is a single row of NULLs.
+_SELECT_WORKOUT_SETS = """SELECT lift.slug, lift_set.reps, lift_set.weight,
+lift_set.weight_unit, lift_set.id, lift.name, lift.id
+FROM workout
+LEFT JOIN lift_set ON lift_set.workout_id = workout.id{lift_filter}
+LEFT JOIN lift ON lift.id = lift_set.lift_id
+WHERE workout.slug = :workout_slug AND (:user_id IS NULL OR workout.user_id = :user_id)
+ORDER BY lift_set.id ASC"""
+SELECT_WORKOUT_SETS = statement("select_workout_sets", _SELECT_WORKOUT_SETS.format(lift_filter=""))
+SELECT_WORKOUT_LIFT_SETS = statement("select_workout_lift_sets", _SELECT_WORKOUT_SETS.format(
+    lift_filter=" AND lift_set.lift_id = (SELECT id FROM lift WHERE slug = :lift_slug)"))
+# A page of a user's sets of one lift, newest workout first, before the
+# (at, slug, id) cursor. Workouts are walked newest first on their index and
+# each one's sets of the lift are a seek on lift_set(workout_id, lift_id).
+SELECT_LIFT_HISTORY = statement("select_lift_history", """SELECT workout.at, workout.slug, lift_set.id,
+lift_set.reps, lift_set.weight, lift_set.weight_unit
+FROM workout
+INNER JOIN lift_set ON lift_set.workout_id = workout.id
+WHERE workout.user_id = :user_id AND lift_set.lift_id = :lift_id AND workout.at <= :before_at
+AND (workout.at, workout.slug, lift_set.id) < (:before_at, :before_slug, :before_id)
+ORDER BY workout.at DESC, workout.slug DESC, lift_set.id DESC
+LIMIT :limit""")
+DELETE_SET_BY_ID = statement("delete_set_by_id", "DELETE FROM lift_set WHERE id = :set_id")
+DELETE_USER_SET_BY_ID = statement("delete_user_set_by_id", """DELETE FROM lift_set
+WHERE id = :set_id AND workout_id IN (SELECT id FROM workout WHERE user_id = :user_id)""")
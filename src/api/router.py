@@ -1,46 +1,50 @@
+import asyncio
 import datetime
 import sqlite3
 from typing import Annotated
+import zoneinfo
 
-from fastapi import APIRouter, Depends, Security, HTTPException, status
+from fastapi import APIRouter, Body, Depends, Query, Request, Response, Security, HTTPException, status
 
-from dependencies import db_connection, get_user
+import config
+import database
+from dependencies import db_connection, db_read_connection, get_user, write_connection
 
 import auth.schemas
-from . import schemas, services
+from . import batching, pagination, schemas, services
 
 
 router = APIRouter()
 
 
 @router.post("/lifts", status_code=201)
-def create_lift(
+async def create_lift(
     lift_input: schemas.PartialLift,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["write:lift"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:lift"])]
 ) -> schemas.Lift:
     try:
-        return services.create_lift(connection, lift_input)
+        return await database.run(services.create_lift, connection, lift_input)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail=f"Lift '{lift_input.slug}' already exists.")
 
 
 @router.get("/lifts")
-def list_lifts(
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["read:lift"])],
+async def list_lifts(
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:lift"])],
 ) -> schemas.LiftList:
-    return schemas.LiftList(lifts=services.list_lifts(connection))
+    return schemas.LiftList(lifts=await database.run(services.list_lifts, connection))
 
 
 @router.get("/lifts/{slug}")
-def get_lift(
+async def get_lift(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["read:lift"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:lift"])],
 ) -> schemas.Lift:
-    lift = services.get_lift_by_slug(connection, slug)
+    lift = await database.run(services.get_lift_by_slug, connection, slug)
     if lift is not None:
         return lift
     else:
@@ -49,14 +53,14 @@ def get_lift(
 
 
 @router.put("/lifts/{slug}")
-def put_lift(
+async def put_lift(
     slug: str,
     lift_input: schemas.PartialLift,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["write:lift"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:lift"])]
 ) -> schemas.Lift:
     try:
-        updated_lift = services.update_lift_by_slug(connection, slug, lift_input)
+        updated_lift = await database.run(services.update_lift_by_slug, connection, slug, lift_input)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail=f"Lift '{lift_input.slug}' already exists.")
@@ -68,35 +72,58 @@ def put_lift(
 
 
 @router.delete("/lifts/{slug}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_lift(
+async def delete_lift(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["delete:lift"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["delete:lift"])]
 ):
-    services.delete_lift_by_slug(connection, slug)
+    await database.run(services.delete_lift_by_slug, connection, slug)
+
+
+@router.get("/lifts/{slug}/history")
+async def get_lift_history(
+    slug: str,
+    response: Response,
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:set"])],
+    limit: Annotated[int, Query(ge=1, le=config.PAGE_MAX)] = config.PAGE_SIZE,
+    cursor: str | None = None,
+) -> list[schemas.WorkoutSet]:
+    """
+    List every set of a lift the user has done, newest workout first, a page
+    at a time. If there are more, the ``X-Next-Cursor`` header holds the
+    ``cursor`` to pass for the next page.
+    """
+    before = pagination.decode_cursor(cursor, (int, str, int)) if cursor is not None else None
+    sets = await database.run(services.list_lift_history, connection, slug, user.id, limit + 1, before)
+    if len(sets) > limit:
+        sets = sets[:limit]
+        last = sets[-1]
+        response.headers["X-Next-Cursor"] = pagination.encode_cursor(int(last.at.timestamp()), last.workout, last.id)
+    return sets
 
 
 @router.post("/splits", status_code=201)
-def create_split(
+async def create_split(
     split_input: schemas.SplitInput,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["write:split"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:split"])]
 ) -> schemas.Split:
     try:
-        return services.create_split(connection, split_input)
+        return await database.run(services.create_split, connection, split_input)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail=f"Split '{split_input.slug}' already exists.")
 
 
 @router.put("/splits/{slug}")
-def update_split(
+async def update_split(
     slug: str,
     split_input: schemas.SplitInput,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["write:split"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:split"])]
 ) -> schemas.Split:
-    result = services.update_split_by_slug(connection, slug, split_input)
+    result = await database.run(services.update_split_by_slug, connection, slug, split_input)
     if result is not None:
         return result
     else:
@@ -104,21 +131,21 @@ def update_split(
 
 
 @router.delete("/splits/{slug}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_split(
+async def delete_split(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["delete:split"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["delete:split"])]
 ):
-    services.delete_split_by_slug(connection, slug)
+    await database.run(services.delete_split_by_slug, connection, slug)
 
 
 @router.get("/splits/{slug}")
-def get_split(
+async def get_split(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["read:split"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:split"])]
 ) -> schemas.Split:
-    result = services.get_split_by_slug(connection, slug)
+    result = await database.run(services.get_split_by_slug, connection, slug)
     if result is not None:
         return result
     else:
@@ -126,32 +153,49 @@ def get_split(
 
 
 @router.get("/splits")
-def list_splits(
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    _: Annotated[auth.schemas.User, Security(get_user, scopes=["read:split"])]
+async def list_splits(
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    _: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:split"])]
 ) -> list[schemas.Split]:
-    return services.list_splits(connection)
+    return await database.run(services.list_splits, connection)
 
 
 @router.post("/workouts", response_model_exclude={"user_id"}, status_code=201)
-def post_workout(
+async def post_workout(
     workout_input: schemas.WorkoutInput,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["write:workout"])]
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:workout"])]
 ) -> schemas.Workout:
     try:
-        return services.create_workout(connection, workout_input, user.id)
+        return await database.run(services.create_workout, connection, workout_input, user.id)
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Workout with date '{workout_input.at}' already exists")
+
+
+@router.post("/workouts/full", response_model_exclude={"user_id"}, status_code=status.HTTP_201_CREATED)
+async def post_workout_with_sets(
+    workout_input: schemas.WorkoutWithSetsInput,
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:workout", "write:set"])]
+) -> schemas.WorkoutWithSets:
+    """
+    Create a workout and all of its sets in one transaction, e.g. to sync a
+    session logged offline. Nothing is created if any part fails; a 404 for
+    missing lifts lists each failing set by its index.
+    """
+    try:
+        return await database.run(services.create_workout_with_sets, connection, workout_input, user.id)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Workout with date '{workout_input.at}' already exists")
 
 
 @router.get("/workouts/{slug}", response_model_exclude={"user_id"})
-def get_workout(
+async def get_workout(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["read:workout"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:workout"])],
 ) -> schemas.Workout:
-    workout = services.get_workout_by_slug(connection, slug)
+    workout = await database.run(services.get_workout_by_slug, connection, slug)
     if workout is not None and workout.user_id == user.id:
         return workout
     else:
@@ -159,65 +203,174 @@ def get_workout(
 
 
 @router.get("/workouts/{slug}/sets")
-def get_workout_sets(
+async def get_workout_sets(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["read:set"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:set"])],
 ) -> list[schemas.Set]:
-    sets = services.list_sets_by_workout(connection, slug, user.id)
+    sets = await database.run(services.list_sets_by_workout, connection, slug, user.id)
     return sets
 
 
+def _time_range(at: datetime.datetime | None, start: datetime.datetime | None, end: datetime.datetime | None,
+                day: datetime.date | None,
+                tz: str) -> tuple[datetime.datetime | None, datetime.datetime | None]:
+    """
+    Combine the time filters of a workout listing into one range, from
+    ``start`` inclusive to ``end`` exclusive. ``start`` and ``end`` without a
+    time zone, and the bounds of ``day``, are taken to be in ``tz``.
+    """
+    try:
+        zone = zoneinfo.ZoneInfo(tz)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown time zone '{tz}'")
+
+    starts: list[datetime.datetime] = []
+    ends: list[datetime.datetime] = []
+    if at is not None:
+        # workouts are stored to the second; a time without a zone is taken
+        # to be local, as it always has been
+        at = at.replace(microsecond=0).astimezone()
+        starts.append(at)
+        ends.append(at + datetime.timedelta(seconds=1))
+    if start is not None:
+        starts.append(start if start.tzinfo is not None else start.replace(tzinfo=zone))
+    if end is not None:
+        ends.append(end if end.tzinfo is not None else end.replace(tzinfo=zone))
+    if day is not None:
+        # days are not always 24 hours long, so both bounds are midnights
+        starts.append(datetime.datetime.combine(day, datetime.time(), zone))
+        if day < datetime.date.max:
+            ends.append(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(), zone))
+        # otherwise there is no next midnight, so the day is left open-ended
+
+    return max(starts, default=None), min(ends, default=None)
+
+
 @router.get("/workouts", response_model_exclude={"user_id"})
-def list_workouts(
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["read:workout"])],
+async def list_workouts(
+    response: Response,
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:workout"])],
     at: datetime.datetime | None = None,
+    start: Annotated[datetime.datetime | None, Query(alias="from")] = None,
+    end: Annotated[datetime.datetime | None, Query(alias="to")] = None,
+    day: datetime.date | None = None,
+    tz: str = "UTC",
+    limit: Annotated[int, Query(ge=1, le=config.PAGE_MAX)] = config.PAGE_SIZE,
+    cursor: str | None = None,
+    all_: Annotated[bool, Query(alias="all")] = False,
 ) -> list[schemas.Workout]:
-    return services.list_workouts(connection, user.id, at)
+    """
+    List workouts newest first, a page at a time. If there are more, the
+    ``X-Next-Cursor`` header holds the ``cursor`` to pass for the next page.
+    With ``all=true``, every workout is listed at once instead; as that takes
+    longer for users with many workouts, it has a deadline of its own,
+    ``config.DB_DEADLINES["GET /api/workouts?all"]``.
+
+    Workouts can be limited to those at exactly ``at``, from ``from`` up to
+    but not including ``to``, or on the calendar ``day`` in the IANA time
+    zone ``tz``. ``tz`` also applies to ``from`` and ``to`` if they have no
+    offset.
+    """
+    time_range = _time_range(at, start, end, day, tz)
+    if all_:
+        database.route.set("GET /api/workouts?all")
+        return await database.run(services.list_workouts, connection, user.id, -1, None, *time_range)
+
+    before = pagination.decode_cursor(cursor, (int, str)) if cursor is not None else None
+    # one more than asked for tells whether there is a next page
+    workouts = await database.run(services.list_workouts, connection, user.id, limit + 1, before, *time_range)
+    if len(workouts) > limit:
+        workouts = workouts[:limit]
+        last = workouts[-1]
+        response.headers["X-Next-Cursor"] = pagination.encode_cursor(int(last.at.timestamp()), last.slug)
+    return workouts
 
 
 @router.delete("/workouts/{slug}", status_code=204)
-def delete_workout(
+async def delete_workout(
     slug: str,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["delete:workout"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["delete:workout"])],
 ):
-    services.delete_workout_by_slug(connection, slug, user.id)
+    await database.run(services.delete_workout_by_slug, connection, slug, user.id)
 
 
 @router.post("/sets", status_code=status.HTTP_201_CREATED)
-def create_set(
+async def create_set(
     set_input: schemas.SetInput,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["write:set"])],
+    request: Request,
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:set"])],
 ) -> schemas.Set:
+    """
+    With group commit, the set is written by the set writer. The request
+    holds no connection while it waits: in rollback journal mode, its read
+    lock would keep the writer from committing.
+    """
     try:
-        return services.create_set(connection, set_input, user.id)
+        if config.SET_GROUP_COMMIT:
+            return await asyncio.wrap_future(batching.get_set_writer().submit(set_input, user.id))
+
+        async with write_connection(request) as connection:
+            return await database.run(services.create_set, connection, set_input, user.id)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No lift '{set_input.lift}'")
 
 
+@router.post("/sets/batch", status_code=status.HTTP_201_CREATED)
+async def create_sets(
+    set_inputs: Annotated[list[schemas.SetInput], Body(min_length=1, max_length=config.SET_BATCH_MAX)],
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:set"])],
+) -> list[schemas.Set]:
+    """
+    Create many sets in one transaction, e.g. a whole workout logged at once.
+    Nothing is created if any set fails; the 404 response then lists each
+    failing set by its index.
+    """
+    return await database.run(services.create_sets, connection, set_inputs, user.id)
+
+
+@router.get("/sets")
+async def list_sets(
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:set"])],
+    workout: str | None = None,
+    lift: str | None = None,
+) -> list[schemas.WorkoutSet] | list[schemas.Set]:
+    """
+    List the user's sets of a workout, of a lift, or of a lift in a workout.
+    Sets of a lift across workouts come with their workout, newest first;
+    ``/lifts/{slug}/history`` lists them a page at a time.
+    """
+    if workout is not None:
+        return await database.run(services.list_sets_by_workout, connection, workout, user.id, lift)
+    if lift is not None:
+        return await database.run(services.list_lift_history, connection, lift, user.id)
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Filter by workout, lift or both.")
+
+
 @router.put("/sets/{set_id}")
-def update_set(
+async def update_set(
     set_id: int,
     set_update_input: schemas.SetUpdateInput,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["write:set"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["write:set"])],
 ) -> schemas.Set:
     try:
-        return services.update_set_by_id(connection, set_id, set_update_input, user.id)
+        return await database.run(services.update_set_by_id, connection, set_id, set_update_input, user.id)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No lift '{set_update_input.lift}'")
 
 
 @router.get("/sets/{set_id}")
-def get_set(
+async def get_set(
     set_id: int,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["read:set"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_read_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["read:set"])],
 ) -> schemas.Set:
-    lift_set = services.get_set_by_id(connection, set_id, user.id)
+    lift_set = await database.run(services.get_set_by_id, connection, set_id, user.id)
     if lift_set is not None:
         return lift_set
     else:
@@ -225,10 +378,10 @@ def get_set(
 
 
 @router.delete("/sets/{set_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_set(
+async def delete_set(
     set_id: int,
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-    user: Annotated[auth.schemas.User, Security(get_user, scopes=["delete:set"])],
+    connection: Annotated[sqlite3.Connection, Depends(db_connection, scope="function")],
+    user: Annotated[auth.schemas.Identity, Security(get_user, scopes=["delete:set"])],
 ):
-    services.delete_set_by_id(connection, set_id, user.id)
+    await database.run(services.delete_set_by_id, connection, set_id, user.id)
 
@@ -2,7 +2,9 @@ import datetime
 import enum
 from typing import Any
 
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, Field, model_validator
+
+import config
 
 
 class PartialLift(BaseModel):
@@ -84,3 +86,19 @@ class Set(BaseModel):
     weight_unit: WeightUnit
     id: int
 
+
+class WorkoutSet(Set):
+    """
+    A set along with the workout it was done in.
+    """
+    workout: str  # slug
+    at: datetime.datetime
+
+
+class WorkoutWithSetsInput(WorkoutInput):
+    sets: list[SetUpdateInput] = Field(max_length=config.SET_BATCH_MAX)
+
+
+class WorkoutWithSets(Workout):
+    sets: list[Set]
+
@@ -1,27 +1,32 @@
 import datetime
+import json
+import math
 import sqlite3
 from typing import cast
 
 from fastapi import HTTPException, status
 
-from . import schemas
+from . import queries, schemas
+
+
+# weight units are stored as small integers
+WEIGHT_UNITS = [schemas.WeightUnit.kg, schemas.WeightUnit.lb]
+WEIGHT_UNIT_CODES = {unit: code for code, unit in enumerate(WEIGHT_UNITS)}
 
 
 def create_lift(connection: sqlite3.Connection, lift: schemas.PartialLift) -> schemas.Lift:
-    cursor = connection.execute("INSERT INTO lift (name, slug) VALUES (:name, :slug)", lift.model_dump())
+    cursor = connection.execute(queries.INSERT_LIFT, lift.model_dump())
     return schemas.Lift(**lift.model_dump(exclude={"id"}), id=cast(int, cursor.lastrowid))
 
 
 def delete_lift_by_slug(connection: sqlite3.Connection, slug: str):
-    cursor = connection.execute("DELETE FROM lift WHERE slug = ?", (slug,))
-    connection.commit()
+    cursor = connection.execute(queries.DELETE_LIFT_BY_SLUG, (slug,))
     if cursor.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No lift '{slug}'")
 
 
 def create_split(connection: sqlite3.Connection, split: schemas.SplitInput) -> schemas.Split:
-    interpolations = "(" + ", ".join(["?" for _ in range(len(split.lifts))]) + ")"
-    cursor = connection.execute("SELECT id, name, slug FROM lift WHERE slug IN %s" % interpolations, split.lifts)
+    cursor = connection.execute(queries.SELECT_LIFTS_BY_SLUGS, (json.dumps(split.lifts),))
     results = cursor.fetchall()
     if len(results) != len(split.lifts):
         found = [item[2] for item in results]
@@ -30,19 +35,18 @@ def create_split(connection: sqlite3.Connection, split: schemas.SplitInput) -> s
 
     lifts = [schemas.Lift(id=item[0], name=item[1], slug=item[2]) for item in results]
 
-    cursor = connection.execute("INSERT INTO split (name, slug) VALUES (:name, :slug)", { "name": split.name, "slug": split.slug, })
+    cursor = connection.execute(queries.INSERT_SPLIT, { "name": split.name, "slug": split.slug, })
     split_id = cast(int, cursor.lastrowid)
     new_split = schemas.Split(name=split.name, slug=split.slug, id=split_id, lifts=lifts)
 
     # create associations
-    for lift in lifts:
-        connection.execute("INSERT INTO split_lift (split_id, lift_id) VALUES (:split_id, :lift_id)", { "split_id": split_id, "lift_id": lift.id })
+    connection.executemany(queries.INSERT_SPLIT_LIFT, [{ "split_id": split_id, "lift_id": lift.id } for lift in lifts])
 
     return new_split
 
 
 def get_lift_by_slug(connection: sqlite3.Connection, slug: str) -> schemas.Lift | None:
-    cursor = connection.execute("SELECT id, name, slug FROM lift WHERE slug = ?", (slug,))
+    cursor = connection.execute(queries.SELECT_LIFT_BY_SLUG, (slug,))
     lift_data = cursor.fetchone()
     if lift_data is None:
         return None
@@ -51,15 +55,13 @@ def get_lift_by_slug(connection: sqlite3.Connection, slug: str) -> schemas.Lift
 
 
 def list_lifts(connection: sqlite3.Connection) -> list[schemas.Lift]:
-    cursor = connection.execute("SELECT id, name, slug FROM lift ORDER BY name ASC")
+    cursor = connection.execute(queries.SELECT_LIFTS)
     return [schemas.Lift(id=row[0], name=row[1], slug=row[2]) for row in cursor.fetchall()]
 
 
 def build_split(connection: sqlite3.Connection, data: tuple):
     split = schemas.Split(id=data[0], name=data[1], slug=data[2], lifts=[])
-    cursor = connection.execute("""SELECT lift.id, lift.name, lift.slug FROM lift
-INNER JOIN split_lift ON lift.id = split_lift.lift_id WHERE split_lift.split_id = :split_id
-ORDER BY lift.id ASC""", { "split_id": split.id })
+    cursor = connection.execute(queries.SELECT_SPLIT_LIFTS, { "split_id": split.id })
     lifts = cursor.fetchall()
     for lift_data in lifts:
         lift = schemas.Lift(id=lift_data[0], name=lift_data[1], slug=lift_data[2])
@@ -69,7 +71,7 @@ ORDER BY lift.id ASC""", { "split_id": split.id })
 
 
 def get_split_by_slug(connection: sqlite3.Connection, slug: str) -> schemas.Split | None:
-    cursor = connection.execute("SELECT id, name, slug FROM split WHERE slug = :slug", { "slug": slug })
+    cursor = connection.execute(queries.SELECT_SPLIT_BY_SLUG, { "slug": slug })
     split_data = cursor.fetchone()
     if split_data is None:
         return None
@@ -78,7 +80,7 @@ def get_split_by_slug(connection: sqlite3.Connection, slug: str) -> schemas.Spli
 
 
 def get_split_by_id(connection: sqlite3.Connection, id: int) -> schemas.Split | None:
-    cursor = connection.execute("SELECT id, name, slug FROM split WHERE id = :id", { "id": id })
+    cursor = connection.execute(queries.SELECT_SPLIT_BY_ID, { "id": id })
     split_data = cursor.fetchone()
     if split_data is None:
         return None
@@ -87,10 +89,7 @@ def get_split_by_id(connection: sqlite3.Connection, id: int) -> schemas.Split |
 
 
 def list_splits(connection: sqlite3.Connection) -> list[schemas.Split]:
-    cursor = connection.execute("""SELECT split.id, split.name, split.slug, lift.id, lift.name, lift.slug FROM split
-LEFT JOIN split_lift ON split.id = split_lift.split_id
-LEFT JOIN lift ON split_lift.lift_id = lift.id
-""")
+    cursor = connection.execute(queries.SELECT_SPLITS)
     splits: dict[int, schemas.Split] = {}
     for row in cursor.fetchall():
         split_id = row[0]
@@ -115,7 +114,7 @@ LEFT JOIN lift ON split_lift.lift_id = lift.id
 
 
 def update_lift_by_slug(connection: sqlite3.Connection, slug: str, lift: schemas.PartialLift) -> schemas.Lift | None:
-    cursor = connection.execute("UPDATE lift SET name = :name, slug = :new_slug WHERE slug = :slug RETURNING lift.id", {
+    cursor = connection.execute(queries.UPDATE_LIFT_BY_SLUG, {
         "name": lift.name,
         "slug": slug,
         "new_slug": lift.slug,
@@ -128,7 +127,7 @@ def update_lift_by_slug(connection: sqlite3.Connection, slug: str, lift: schemas
 
 
 def update_split_by_slug(connection: sqlite3.Connection, slug: str, split: schemas.SplitInput) -> schemas.Split | None:
-    cursor = connection.execute("UPDATE split SET name = :name, slug = :new_slug WHERE slug = :slug RETURNING split.id", {
+    cursor = connection.execute(queries.UPDATE_SPLIT_BY_SLUG, {
         "name": split.name,
         "slug": slug,
         "new_slug": split.slug,
@@ -139,21 +138,14 @@ def update_split_by_slug(connection: sqlite3.Connection, slug: str, split: schem
 
     split_id = result[0]
 
-    # update lifts
-    interpolations = "(" + ", ".join(["?" for _ in range(len(split.lifts))]) + ")"
-    cursor = connection.execute("SELECT id, name, slug FROM lift WHERE slug in %s" % interpolations, split.lifts)
-    lifts = cursor.fetchall()
+    # replace lifts
+    cursor = connection.execute(queries.SELECT_LIFTS_BY_SLUGS, (json.dumps(split.lifts),))
+    lift_models = [schemas.Lift(id=lift[0], name=lift[1], slug=lift[2]) for lift in cursor.fetchall()]
 
-    connection.execute("DELETE FROM split_lift WHERE lift_id NOT IN %s" % interpolations, split.lifts)
-
-    lift_models = []
-    if len(split.lifts) > 0:
-        interpolations = ", ".join(["(?, ?)" for _ in range(len(split.lifts))])
-        values = []
-        for lift in lifts:
-            values.extend([split_id, lift[0]])
-            lift_models.append(schemas.Lift(id=lift[0], name=lift[1], slug=lift[2]))
-        connection.execute("INSERT INTO split_lift (split_id, lift_id) VALUES %s" % interpolations, values)
+    connection.execute(queries.DELETE_SPLIT_LIFTS, (split_id,))
+    connection.executemany(queries.INSERT_SPLIT_LIFT, [
+        { "split_id": split_id, "lift_id": lift.id } for lift in lift_models
+    ])
 
     return schemas.Split(
         id=split_id,
@@ -164,45 +156,59 @@ def update_split_by_slug(connection: sqlite3.Connection, slug: str, split: schem
 
 
 def delete_split_by_slug(connection: sqlite3.Connection, slug: str):
-    cursor = connection.execute("DELETE FROM split WHERE slug = ?", (slug,))
-    connection.commit()
+    cursor = connection.execute(queries.DELETE_SPLIT_BY_SLUG, (slug,))
     if cursor.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Split '{slug}' not found")
 
 
-def create_workout(connection: sqlite3.Connection, workout_input: schemas.WorkoutInput, user_id: int) -> schemas.Workout:
+def _insert_workout(connection: sqlite3.Connection, workout_input: schemas.WorkoutInput,
+                    user_id: int) -> tuple[schemas.Workout, int]:
     split = get_split_by_slug(connection, workout_input.split)
     if split is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No split '{workout_input.split}'")
 
     workout = schemas.Workout(**workout_input.model_dump(exclude={"split"}), user_id=user_id, split=split)
-    connection.execute("INSERT INTO workout (at, slug, split_id, user_id) VALUES (:at, :slug, :split_id, :user_id)", {
+    workout_id, = connection.execute(queries.INSERT_WORKOUT, {
         "at": workout.at,
         "slug": workout.slug,
         "split_id": workout.split.id,
         "user_id": workout.user_id,
-    })
-    return workout
-
+    }).fetchone()
+    return workout, workout_id
 
-def list_workouts(connection: sqlite3.Connection, user_id: int, search_date: datetime.date | None = None) -> list[schemas.Workout]:
-    query = """SELECT workout.at, workout.slug, workout.split_id, split.slug, split.name, lift.slug, lift.name, lift.id
-FROM workout
-INNER JOIN split ON workout.split_id = split.id
-LEFT JOIN split_lift ON split.id = split_lift.split_id
-LEFT JOIN lift  ON split_lift.lift_id = lift.id
-WHERE user_id = :user_id"""
-    data: dict[str, int | datetime.date] = { "user_id": user_id }
-    if search_date is not None:
-        query += " AND workout.at = :search_date"
-        data["search_date"] = search_date
-
-    cursor = connection.execute(query, data)
-    workout_data = cursor.fetchall()
 
+def create_workout(connection: sqlite3.Connection, workout_input: schemas.WorkoutInput, user_id: int) -> schemas.Workout:
+    return _insert_workout(connection, workout_input, user_id)[0]
+
+
+def create_workout_with_sets(connection: sqlite3.Connection, workout_input: schemas.WorkoutWithSetsInput,
+                             user_id: int) -> schemas.WorkoutWithSets:
+    """
+    Create a workout together with its sets. The sets' lifts are checked
+    before anything is inserted.
+
+    :raises HTTPException: With status 404 if the split or a lift is missing;
+        for missing lifts, the detail lists the index and error of each
+        failing set.
+    """
+    cursor = connection.execute(queries.SELECT_LIFTS_BY_SLUGS,
+                                (json.dumps(list({set_input.lift for set_input in workout_input.sets})),))
+    lifts = {row[2]: schemas.Lift(id=row[0], name=row[1], slug=row[2]) for row in cursor.fetchall()}
+    errors = [{ "index": index, "detail": f"No lift '{set_input.lift}'" }
+              for index, set_input in enumerate(workout_input.sets) if set_input.lift not in lifts]
+    if errors:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=errors)
+
+    workout, workout_id = _insert_workout(connection, schemas.WorkoutInput(at=workout_input.at,
+                                                                         split=workout_input.split), user_id)
+    sets = insert_sets(connection, [(lifts[set_input.lift], workout_id, set_input) for set_input in workout_input.sets])
+    return schemas.WorkoutWithSets(**workout.model_dump(), sets=sets)
+
+
+def _build_workouts(rows: list[tuple], user_id: int) -> list[schemas.Workout]:
     workouts = {}
-    for result in workout_data:
+    for result in rows:
         at, slug, split_id, split_slug, split_name, lift_slug, lift_name, lift_id = result
         if slug not in workouts:
             lifts = []
@@ -221,8 +227,41 @@ WHERE user_id = :user_id"""
     return list(workouts.values())
 
 
+# sorts after every workout, for the first page
+_FIRST_PAGE = (2 ** 62, "")
+
+
+def list_workouts(connection: sqlite3.Connection, user_id: int, limit: int = -1,
+                  before: tuple[int, str] | None = None, start: datetime.datetime | None = None,
+                  end: datetime.datetime | None = None) -> list[schemas.Workout]:
+    """
+    List a user's workouts newest first, a page at a time.
+
+    :param limit: The most workouts to list, or -1 for all of them.
+    :param before: The ``at`` timestamp and slug of the last workout on the
+        previous page, or ``None`` for the first page.
+    :param start: Only list workouts at or after this time.
+    :param end: Only list workouts before this time.
+    """
+    # workouts are stored to the second, so fractions round up for both bounds
+    from_at = math.ceil(start.timestamp()) if start is not None else -2 ** 62
+    before_at, before_slug = before if before is not None else _FIRST_PAGE
+    if end is not None:
+        # being before (end, "") is being before end
+        before_at, before_slug = min((before_at, before_slug), (math.ceil(end.timestamp()), ""))
+
+    cursor = connection.execute(queries.SELECT_WORKOUTS, {
+        "user_id": user_id,
+        "from_at": from_at,
+        "before_at": before_at,
+        "before_slug": before_slug,
+        "limit": limit,
+    })
+    return _build_workouts(cursor.fetchall(), user_id)
+
+
 def get_workout_by_slug(connection: sqlite3.Connection, slug: str):
-    cursor = connection.execute("SELECT at, slug, split_id, user_id FROM workout WHERE slug = ?", (slug,))
+    cursor = connection.execute(queries.SELECT_WORKOUT_BY_SLUG, (slug,))
     result = cursor.fetchone()
     if result is None:
         return None
@@ -242,41 +281,36 @@ def get_workout_by_slug(connection: sqlite3.Connection, slug: str):
 def delete_workout_by_slug(connection: sqlite3.Connection, slug: str, user_id: int | None = None):
     data: dict[str, str | int] = { "slug": slug }
     if user_id is not None:
-        query = "DELETE FROM workout WHERE slug = :slug AND user_id = :user_id"
+        query = queries.DELETE_USER_WORKOUT_BY_SLUG
         data["user_id"] = user_id
     else:
-        query = "DELETE FROM workout WHERE slug = :slug"
+        query = queries.DELETE_WORKOUT_BY_SLUG
 
     cursor = connection.execute(query, data)
-    connection.commit()
     if cursor.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Workout '{slug}' not found")
 
 
 def create_set(connection: sqlite3.Connection, set_input: schemas.SetInput, user_id: int | None = None) -> schemas.Set:
+    # An unknown lift is inserted as NULL, which raises an IntegrityError
+    # just like a foreign key violation would.
+    lift = get_lift_by_slug(connection, set_input.lift)
     data = {
-        "lift_slug": set_input.lift,
+        "lift_id": lift.id if lift is not None else None,
         "workout_slug": set_input.workout,
         "reps": set_input.reps,
         "weight": set_input.weight,
-        "weight_unit": set_input.weight_unit,
+        "weight_unit": WEIGHT_UNIT_CODES[set_input.weight_unit],
     }
+    query = queries.INSERT_SET
     if user_id is not None:
         data["user_id"] = user_id
-        query = """INSERT INTO lift_set (lift_slug, workout_slug, reps, weight, weight_unit)
-SELECT set_data.* FROM (VALUES (:lift_slug, :workout_slug, :reps, :weight, :weight_unit)) as set_data
-INNER JOIN workout ON workout.slug = :workout_slug
-WHERE workout.user_id = :user_id
-"""
-    else:
-        query = """INSERT INTO lift_set (lift_slug, workout_slug, reps, weight, weight_unit) VALUES
-(:lift_slug, :workout_slug, :reps, :weight, :weight_unit)"""
+        query = queries.INSERT_USER_SET
+
     cursor = connection.execute(query, data)
-    connection.commit()
     if cursor.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No workout '{set_input.workout}'")
 
-    lift = get_lift_by_slug(connection, set_input.lift)
     set_id = cast(int, cursor.lastrowid)
     return schemas.Set(
         lift=cast(schemas.Lift, lift),
@@ -287,26 +321,111 @@ WHERE workout.user_id = :user_id
     )
 
 
+def resolve_sets(connection: sqlite3.Connection, set_inputs: list[schemas.SetInput],
+                 user_ids: list[int | None]) -> list[tuple[schemas.Lift, int] | HTTPException]:
+    """
+    Look up the lift and workout of many sets at once, with one query for all
+    lifts and one for all workouts.
+
+    :param connection: The connection to query.
+    :param set_inputs: The sets to resolve.
+    :param user_ids: For each set, the user who must own its workout, or
+        ``None`` to skip the ownership check.
+    :returns: For each set, either its lift and workout id, or the error
+        that creating it on its own would have raised.
+    """
+    cursor = connection.execute(queries.SELECT_LIFTS_BY_SLUGS,
+                                (json.dumps(list({set_input.lift for set_input in set_inputs})),))
+    lifts = {row[2]: schemas.Lift(id=row[0], name=row[1], slug=row[2]) for row in cursor.fetchall()}
+
+    cursor = connection.execute(queries.SELECT_WORKOUTS_BY_SLUGS,
+                                (json.dumps(list({set_input.workout for set_input in set_inputs})),))
+    workouts = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    resolved: list[tuple[schemas.Lift, int] | HTTPException] = []
+    for set_input, user_id in zip(set_inputs, user_ids):
+        workout = workouts.get(set_input.workout)
+        lift = lifts.get(set_input.lift)
+        if workout is None or (user_id is not None and workout[1] != user_id):
+            resolved.append(HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                          detail=f"No workout '{set_input.workout}'"))
+        elif lift is None:
+            resolved.append(HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No lift '{set_input.lift}'"))
+        else:
+            resolved.append((lift, workout[0]))
+
+    return resolved
+
+
+def insert_sets(connection: sqlite3.Connection,
+                rows: list[tuple[schemas.Lift, int, schemas.SetUpdateInput]]) -> list[schemas.Set]:
+    """
+    Insert many sets, in the transaction the caller holds, reading back the
+    id each one received.
+
+    :param connection: The connection used to insert the sets.
+    :param rows: The lift, workout id and data of each set, as resolved by
+        :func:`resolve_sets`.
+    """
+    sets = []
+    # one statement per row, as executemany drops the rows RETURNING yields
+    for lift, workout_id, set_input in rows:
+        set_id, = connection.execute(queries.INSERT_SET_ROW, {
+            "lift_id": lift.id,
+            "workout_id": workout_id,
+            "reps": set_input.reps,
+            "weight": set_input.weight,
+            "weight_unit": WEIGHT_UNIT_CODES[set_input.weight_unit],
+        }).fetchone()
+        sets.append(schemas.Set(
+            lift=lift,
+            reps=set_input.reps,
+            weight=set_input.weight,
+            weight_unit=set_input.weight_unit,
+            id=set_id,
+        ))
+    return sets
+
+
+def create_sets(connection: sqlite3.Connection, set_inputs: list[schemas.SetInput],
+                user_id: int | None = None) -> list[schemas.Set]:
+    """
+    Create many sets at once: either all of them or, if any cannot be
+    created, none.
+
+    :param connection: The connection used to insert the sets.
+    :param set_inputs: The sets to create.
+    :param user_id: The user who must own the sets' workouts, or ``None`` to
+        skip the ownership check.
+    :raises HTTPException: With status 404 if a lift or workout is missing;
+        its detail lists the index and error of each failing set.
+    """
+    resolved = resolve_sets(connection, set_inputs, [user_id] * len(set_inputs))
+    errors = [{ "index": index, "detail": result.detail }
+              for index, result in enumerate(resolved) if isinstance(result, HTTPException)]
+    if errors:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=errors)
+
+    return insert_sets(connection, [
+        (lift, workout_id, set_input)
+        for (lift, workout_id), set_input in zip(cast(list[tuple[schemas.Lift, int]], resolved), set_inputs)
+    ])
+
+
 def update_set_by_id(connection: sqlite3.Connection, set_id: int, set_input: schemas.SetUpdateInput, user_id: int) -> schemas.Set:
-    cursor = connection.execute("""UPDATE lift_set SET lift_slug = :lift_slug, reps = :reps, weight = :weight, weight_unit = :weight_unit
-    WHERE id IN (
-        SELECT lift_set.id FROM lift_set
-        INNER JOIN workout ON lift_set.workout_slug = workout.slug
-        WHERE lift_set.id = :set_id AND workout.user_id = :user_id
-    )""", {
-        "lift_slug": set_input.lift,
+    # As in create_set, an unknown lift raises an IntegrityError.
+    lift = get_lift_by_slug(connection, set_input.lift)
+    cursor = connection.execute(queries.UPDATE_USER_SET_BY_ID, {
+        "lift_id": lift.id if lift is not None else None,
         "reps": set_input.reps,
         "weight": set_input.weight,
-        "weight_unit": set_input.weight_unit,
+        "weight_unit": WEIGHT_UNIT_CODES[set_input.weight_unit],
         "set_id": set_id,
         "user_id": user_id,
     })
-    connection.commit()
     if cursor.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No set '{set_id}'")
 
-    # If we've reached here, we can know that the lift exists. Otherwise, an integrity error would have occurred.
-    lift = get_lift_by_slug(connection, set_input.lift)
     return schemas.Set(
         lift=cast(schemas.Lift, lift),
         reps=set_input.reps,
@@ -318,61 +437,93 @@ def update_set_by_id(connection: sqlite3.Connection, set_id: int, set_input: sch
 
 def get_set_by_id(connection: sqlite3.Connection, set_id: int, user_id: int | None = None) -> schemas.Set | None:
     data = { "set_id": set_id }
+    query = queries.SELECT_SET_BY_ID
     if user_id is not None:
         data["user_id"] = user_id
-        query = """SELECT a.lift_slug, a.reps, a.weight, a.weight_unit FROM lift_set a
-INNER JOIN workout ON a.workout_slug = workout.slug
-WHERE a.id = :set_id AND workout.user_id = :user_id
-"""
-    else:
-        query = "SELECT lift_slug, reps, weight, weight_unit FROM lift_set WHERE id = :set_id"
+        query = queries.SELECT_USER_SET_BY_ID
 
     cursor = connection.execute(query, data)
     set_data = cursor.fetchone()
     if set_data is None:
         return None
 
-    lift = get_lift_by_slug(connection, set_data[0])
     return schemas.Set(
-        lift=cast(schemas.Lift, lift),
-        reps=set_data[1],
-        weight=set_data[2],
-        weight_unit=set_data[3],
+        lift=schemas.Lift(id=set_data[0], name=set_data[1], slug=set_data[2]),
+        reps=set_data[3],
+        weight=set_data[4],
+        weight_unit=WEIGHT_UNITS[set_data[5]],
         id=set_id,
     )
 
 
-def list_sets_by_workout(connection: sqlite3.Connection, workout_slug: str, user_id: int | None = None) -> list[schemas.Set]:
-    workout = get_workout_by_slug(connection, workout_slug)
-    if workout is None or (user_id is not None and workout.user_id != user_id):
+def list_sets_by_workout(connection: sqlite3.Connection, workout_slug: str, user_id: int | None = None,
+                         lift_slug: str | None = None) -> list[schemas.Set]:
+    """
+    :param lift_slug: Only list the sets of this lift.
+    :raises HTTPException: With status 404 if there is no such workout, or
+        it is not the user's.
+    """
+    parameters = { "workout_slug": workout_slug, "user_id": user_id }
+    if lift_slug is None:
+        cursor = connection.execute(queries.SELECT_WORKOUT_SETS, parameters)
+    else:
+        cursor = connection.execute(queries.SELECT_WORKOUT_LIFT_SETS, { **parameters, "lift_slug": lift_slug })
+    rows = cursor.fetchall()
+    if not rows:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No workout '{workout_slug}'")
 
-    cursor = connection.execute("""SELECT lift_slug, reps, weight, weight_unit, lift_set.id, lift.name, lift.id FROM lift_set 
-INNER JOIN lift ON lift_set.lift_slug = lift.slug
-WHERE workout_slug = ?""", (workout_slug,))
-    sets = [schemas.Set(
+    # a workout without sets is a row of NULLs
+    return [schemas.Set(
         lift=schemas.Lift(slug=row[0], name=row[5], id=row[6]),
         reps=row[1],
         weight=row[2],
-        weight_unit=row[3],
+        weight_unit=WEIGHT_UNITS[row[3]],
         id=row[4],
+    ) for row in rows if row[4] is not None]
+
+
+def list_lift_history(connection: sqlite3.Connection, lift_slug: str, user_id: int, limit: int = -1,
+                      before: tuple[int, str, int] | None = None) -> list[schemas.WorkoutSet]:
+    """
+    List every set of a lift a user has done, newest workout first, a page
+    at a time.
+
+    :param limit: The most sets to list, or -1 for all of them.
+    :param before: The ``at`` timestamp and slug of the workout and the id of
+        the last set on the previous page, or ``None`` for the first page.
+    :raises HTTPException: With status 404 if there is no such lift.
+    """
+    lift = get_lift_by_slug(connection, lift_slug)
+    if lift is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No lift '{lift_slug}'")
+
+    before_at, before_slug, before_id = before if before is not None else (*_FIRST_PAGE, 0)
+    cursor = connection.execute(queries.SELECT_LIFT_HISTORY, {
+        "user_id": user_id,
+        "lift_id": lift.id,
+        "before_at": before_at,
+        "before_slug": before_slug,
+        "before_id": before_id,
+        "limit": limit,
+    })
+    return [schemas.WorkoutSet(
+        lift=lift,
+        reps=row[3],
+        weight=row[4],
+        weight_unit=WEIGHT_UNITS[row[5]],
+        id=row[2],
+        workout=row[1],
+        at=row[0],
     ) for row in cursor.fetchall()]
-    return sets
 
 
 def delete_set_by_id(connection: sqlite3.Connection, set_id: int, user_id: int | None = None):
     data = { "set_id": set_id }
+    query = queries.DELETE_SET_BY_ID
     if user_id is not None:
         data["user_id"] = user_id
-        query = """DELETE FROM lift_set WHERE id in (
-    SELECT lift_set.id FROM lift_set INNER JOIN workout ON lift_set.workout_slug = workout.slug WHERE workout.user_id = :user_id AND
-    lift_set.id = :set_id
-)"""
-    else:
-        query = "DELETE FROM lift_set WHERE id = :set_id"
+        query = queries.DELETE_USER_SET_BY_ID
 
     cursor = connection.execute(query, data)
-    connection.commit()
     if cursor.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No set '{set_id}'")
-
@@ -0,0 +1,148 @@
+"""
+Admission control for the routes that hash passwords. Requests are shed
+with 429 before any hashing starts, so credential stuffing or a reconnect
+storm cannot exhaust the CPU.
+"""
+import collections
+import contextlib
+import math
+import threading
+import time
+from typing import Iterator
+
+from fastapi import HTTPException, Request, status
+
+import config
+import metrics
+
+
+rejections = metrics.counter("admission_rejections", "Requests shed before hashing, by limit.")
+tracked_keys = metrics.gauge("admission_tracked_keys", "Accounts or addresses with a token bucket.")
+tokens_left = metrics.histogram("admission_tokens_left", "Tokens left in a bucket after admitting a request.")
+in_flight = metrics.gauge("admission_in_flight", "Admitted requests currently hashing passwords.")
+
+
+class RateLimiter:
+    """
+    A token bucket per key. Each bucket holds up to ``burst`` tokens and
+    refills at ``rate`` tokens per second; a request takes one token. Only
+    the ``max_keys`` most recently seen keys are tracked, so a flood of
+    distinct keys cannot grow memory without bound.
+
+    :param name: Labels the limiter's metrics.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: collections.OrderedDict[str, tuple[float, float]] = collections.OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """
+        Take a token from ``key``'s bucket.
+
+        :returns: 0 if a token was taken, otherwise the number of seconds
+            until one will be available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            tracked_keys.set(len(self._buckets), limiter=self.name)
+
+        if wait == 0:
+            tokens_left.observe(tokens, limiter=self.name)
+        return wait
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            tracked_keys.set(0, limiter=self.name)
+
+
+class ConcurrencyLimit:
+    """
+    Caps the number of requests hashing passwords at once in this worker.
+    Requests over the cap are rejected rather than queued.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._active >= self.limit:
+                return False
+            self._active += 1
+            in_flight.set(self._active)
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            in_flight.set(self._active)
+
+
+accounts = RateLimiter("account", config.ADMISSION_ACCOUNT_RATE, config.ADMISSION_ACCOUNT_BURST,
+                       config.ADMISSION_MAX_KEYS)
+addresses = RateLimiter("address", config.ADMISSION_ADDRESS_RATE, config.ADMISSION_ADDRESS_BURST,
+                        config.ADMISSION_MAX_KEYS)
+hashing_slots = ConcurrencyLimit(config.ADMISSION_MAX_CONCURRENT)
+
+
+def _reject(limit: str, retry_after: float | None = None):
+    rejections.inc(limit=limit)
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many attempts, try again later.",
+        headers={ "Retry-After": str(max(1, math.ceil(retry_after or 1))) },
+    )
+
+
+@contextlib.contextmanager
+def admit(request: Request, account: str) -> Iterator[None]:
+    """
+    Admit a request that will hash a password, or reject it with 429.
+
+    :param request: The request, whose client address is throttled.
+    :param account: The account the request is for, e.g. the email logged
+        in with.
+    :raises HTTPException: With status 429 if the account or address is over
+        its rate, or too many requests are hashing already.
+    """
+    address = request.client.host if request.client is not None else "unknown"
+    wait = addresses.acquire(address)
+    if wait:
+        _reject("address", wait)
+    wait = accounts.acquire(account.lower())
+    if wait:
+        _reject("account", wait)
+    if not hashing_slots.try_acquire():
+        _reject("concurrency")
+
+    try:
+        yield
+    finally:
+        hashing_slots.release()
+
+
+def reset():
+    """
+    Forget all token buckets.
+    """
+    accounts.reset()
+    addresses.reset()
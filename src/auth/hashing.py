@@ -0,0 +1,174 @@
+"""
+Password hashing in a dedicated process pool. Argon2 is deliberately slow
+and memory-hungry, so running it in worker processes keeps a burst of logins
+from starving the threads and the GIL that serve the rest of the API.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from typing import Callable, NamedTuple, TypeVar
+
+import argon2
+from fastapi import HTTPException, status
+
+import config
+import metrics
+
+
+T = TypeVar("T")
+
+hashing_processes = metrics.gauge("hashing_processes", "Processes available to hash passwords.")
+hashing_queued = metrics.gauge("hashing_queued", "Password hashes waiting for a process.")
+hashing_pending = metrics.gauge("hashing_pending", "Password hashes queued or running.")
+hashing_rejections = metrics.counter("hashing_rejections", "Password hashes rejected because the queue was full.")
+hashing_latency = metrics.histogram("hashing_seconds", "Time taken to hash or verify a password, including queueing.")
+
+
+def password_hasher() -> argon2.PasswordHasher:
+    """
+    A hasher using the cost parameters in ``config``.
+    """
+    return argon2.PasswordHasher(
+        time_cost=config.ARGON2_TIME_COST,
+        memory_cost=config.ARGON2_MEMORY_COST,
+        parallelism=config.ARGON2_PARALLELISM,
+    )
+
+
+class Verification(NamedTuple):
+    matches: bool
+    # whether the hash was made with other parameters than the current ones
+    needs_rehash: bool
+
+
+_hasher = password_hasher()
+
+
+def _hash(password: str) -> str:
+    return _hasher.hash(password)
+
+
+def _verify(pw_hash: str, password: str) -> Verification:
+    try:
+        _hasher.verify(pw_hash, password)
+    except argon2.exceptions.VerificationError:
+        return Verification(False, False)
+    return Verification(True, _hasher.check_needs_rehash(pw_hash))
+
+
+class HashingPool:
+    """
+    Runs password hashing in a pool of processes. The number of hashes that
+    may wait for a process is bounded, so an overloaded pool turns requests
+    away instead of queueing them indefinitely.
+
+    :param processes: Number of processes hashing passwords.
+    :param max_queued: Number of hashes allowed to wait for a free process.
+    """
+
+    def __init__(self, processes: int, max_queued: int):
+        self.processes = processes
+        self.max_queued = max_queued
+        # spawned rather than forked, since the server has threads running
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._pending = 0
+        hashing_processes.set(processes)
+
+    def _update_gauges(self):
+        hashing_pending.set(self._pending)
+        hashing_queued.set(max(0, self._pending - self.processes))
+
+    def submit(self, fn: Callable[..., T], *args) -> concurrent.futures.Future[T]:
+        """
+        :raises HTTPException: With status 503 if too many hashes are already
+            waiting.
+        """
+        with self._lock:
+            if self._pending >= self.processes + self.max_queued:
+                hashing_rejections.inc()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, try again later.",
+                )
+            self._pending += 1
+            self._update_gauges()
+
+        submitted = time.perf_counter()
+
+        def done(_: concurrent.futures.Future):
+            hashing_latency.observe(time.perf_counter() - submitted, operation=fn.__name__.lstrip("_"))
+            with self._lock:
+                self._pending -= 1
+                self._update_gauges()
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            done(concurrent.futures.Future())
+            raise
+        future.add_done_callback(done)
+        return future
+
+    async def hash(self, password: str) -> str:
+        return await asyncio.wrap_future(self.submit(_hash, password))
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """
+        Hash several passwords across the processes. At most one hash per
+        process is pending at a time, so a large batch leaves the queue to
+        other requests.
+        """
+        slots = asyncio.Semaphore(self.processes)
+
+        async def hash_one(password: str) -> str:
+            async with slots:
+                return await self.hash(password)
+
+        return list(await asyncio.gather(*(hash_one(password) for password in passwords)))
+
+    async def verify(self, pw_hash: str, password: str) -> Verification:
+        """
+        Check ``password`` against ``pw_hash``, and whether the hash should be
+        replaced by one made with the current parameters.
+        """
+        return await asyncio.wrap_future(self.submit(_verify, pw_hash, password))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pool_lock = threading.Lock()
+_pool: HashingPool | None = None
+_pool_pid: int | None = None
+
+
+def get_pool() -> HashingPool:
+    """
+    Return this worker's hashing pool, starting it on first use.
+    """
+    global _pool
+    global _pool_pid
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = HashingPool(config.HASH_PROCESSES, config.HASH_MAX_QUEUED)
+            _pool_pid = pid
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown()
+        _pool = None
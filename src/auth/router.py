@@ -1,90 +1,199 @@
+import hashlib
 import sqlite3
 import time
 import typing
+import uuid
 
-import argon2
-from argon2 import PasswordHasher
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Security, status
 import jwt
 
-from config import JWT_KEY, JWT_ISS, JWT_AUD, JWT_ALGO, JWT_ALGS, PERMISSIONS_GROUPS
-from dependencies import db_connection
-from . import services
+import config
+from config import JWT_KEY, JWT_ISS, JWT_AUD, JWT_ALGO, JWT_ALGS
+import database
+from dependencies import db_connection, get_user, read_connection, write_connection
+from . import admission, hashing, scopes, services
 from . import schemas
+from .exceptions import EmailValidationError
 
 
 router = APIRouter()
 
 
+def _issue_tokens(identity: schemas.Identity, scope: int) -> schemas.Tokens:
+    """
+    Issue an access and a refresh token. Both carry the user's id and group
+    as the ``uid`` and ``grp`` claims, for stateless mode. The refresh token
+    has a ``jti``, by which it is revoked.
+
+    :param scope: The scopes granted, encoded by :mod:`auth.scopes`.
+    """
+    claims = {
+        "iss": JWT_ISS,
+        "sub": identity.email,
+        "aud": JWT_AUD,
+        "uid": identity.id,
+        "grp": identity.auth_group,
+    }
+    now = int(time.time())
+    access_token = jwt.encode({
+        **claims,
+        "exp": now + config.JWT_ACCESS_TTL,
+        "scp": scope,
+    }, JWT_KEY, algorithm=JWT_ALGO)
+    refresh_token = jwt.encode({
+        **claims,
+        "exp": now + config.JWT_REFRESH_TTL,
+        "scp": scope | scopes.REFRESH,
+        "jti": uuid.uuid4().hex,
+    }, JWT_KEY, algorithm=JWT_ALGO)
+    return schemas.Tokens(
+        access=access_token,
+        refresh=refresh_token,
+    )
+
+
 @router.post("/users", response_model_exclude_none=True)
-def create_user(
+async def create_user(
     user: schemas.UserInput,
-    connection: typing.Annotated[sqlite3.Connection, Depends(db_connection)]
+    request: Request,
 ) -> schemas.User:
+    services.validate_email(user.email)
+    with admission.admit(request, user.email):
+        pw_hash = await hashing.get_pool().hash(user.password)
+    # checked out only now, so the connection is not held while the hash
+    # waits for a process
     try:
-        return services.create_user(connection, user.email, user.password, user.first_name, user.last_name)
+        async with write_connection(request) as connection:
+            return await database.run(services.insert_user, connection, user.email, pw_hash, user.first_name,
+                                      user.last_name)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=409, detail="A user with that email already exists.")
 
 
+@router.post("/users/bulk")
+async def create_users(
+    bulk: schemas.BulkUserInput,
+    request: Request,
+    _: typing.Annotated[schemas.Identity, Security(get_user, scopes=["write:user"])]
+) -> list[schemas.BulkUserResult]:
+    """
+    Create many users at once, e.g. when onboarding a gym. Every row is
+    validated before any password is hashed, and the valid ones are inserted
+    together. A row failing does not fail the others. No connection is held
+    while the passwords are hashed.
+    """
+    results: list[schemas.BulkUserResult | None] = [None] * len(bulk.users)
+    valid: dict[str, int] = {}
+    for i, user in enumerate(bulk.users):
+        try:
+            services.validate_email(user.email)
+        except EmailValidationError as e:
+            results[i] = schemas.BulkUserResult(email=user.email, status="invalid", detail=str(e))
+            continue
+        if user.email in valid:
+            results[i] = schemas.BulkUserResult(email=user.email, status="conflict",
+                                                detail="The email appears more than once.")
+            continue
+        valid[user.email] = i
+
+    # no point hashing passwords for emails that are taken
+    async with read_connection(request) as connection:
+        existing = await database.run(services.find_existing_emails, connection, list(valid))
+    for email in existing:
+        results[valid.pop(email)] = schemas.BulkUserResult(email=email, status="conflict",
+                                                           detail="A user with that email already exists.")
+
+    to_create = [bulk.users[i] for i in valid.values()]
+    pw_hashes = await hashing.get_pool().hash_many([user.password for user in to_create])
+    async with write_connection(request) as connection:
+        created = await database.run(services.insert_users, connection, [
+            (user.email, pw_hash, user.first_name, user.last_name) for user, pw_hash in zip(to_create, pw_hashes)
+        ])
+    for email, i in valid.items():
+        if email in created:
+            results[i] = schemas.BulkUserResult(email=email, status="created", user=created[email])
+        else:
+            results[i] = schemas.BulkUserResult(email=email, status="conflict",
+                                                detail="A user with that email already exists.")
+
+    return typing.cast(list[schemas.BulkUserResult], results)
+
+
 @router.post("/login")
-def login(
+async def login(
     credentials: schemas.Credentials,
-    connection: typing.Annotated[sqlite3.Connection, Depends(db_connection)]
+    request: Request,
 ) -> schemas.Tokens:
-    user = services.find_user(connection, credentials.email)
-    if user is None:
-        raise HTTPException(status_code=401, detail="Could not log in.")
+    with admission.admit(request, credentials.email):
+        # The read is over before the password is verified, so no lock is
+        # held meanwhile. In rollback journal mode, a read lock would also
+        # keep the rehash below from ever committing.
+        async with read_connection(request) as connection:
+            user = await database.run(services.find_user, connection, credentials.email)
+        if user is None:
+            raise HTTPException(status_code=401, detail="Could not log in.")
+
+        verification = await hashing.get_pool().verify(user.password, credentials.password)
+        if not verification.matches:
+            raise HTTPException(status_code=401, detail="Could not log in.")
 
-    hasher = PasswordHasher()
+        if verification.needs_rehash:
+            # the cost parameters changed since the hash was made; this is the
+            # only time the plaintext password is at hand to upgrade it
+            pw_hash = await hashing.get_pool().hash(credentials.password)
+            async with write_connection(request) as writer:
+                await database.run(services.update_password_hash, writer, user.id, user.password, pw_hash)
+
+    return _issue_tokens(user, scopes.GROUPS[user.auth_group])
+
+
+def _decode_refresh_token(refresh: schemas.RefreshToken) -> dict:
     try:
-        hasher.verify(user.password, credentials.password)
-    except argon2.exceptions.VerifyMismatchError:
-        raise HTTPException(status_code=401, detail="Could not log in.")
+        decoded_token = jwt.decode(refresh.refresh, JWT_KEY, audience=JWT_AUD, algorithms=JWT_ALGS,
+                                   options={ "require": ["exp"] })
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token.")
 
-    access_token = jwt.encode({
-        "iss": JWT_ISS,
-        "sub": user.email,
-        "aud": JWT_AUD,
-        "exp": int(time.time()) + (60 * 5),
-        "scope": PERMISSIONS_GROUPS[user.auth_group]
-    }, JWT_KEY, algorithm=JWT_ALGO)
-    refresh_token = jwt.encode({
-        "iss": JWT_ISS,
-        "sub": user.email,
-        "aud": JWT_AUD,
-        "exp": int(time.time()) + (60 * 60),
-        "scope": ("refresh " + PERMISSIONS_GROUPS[user.auth_group]).strip()
-    }, JWT_KEY, algorithm=JWT_ALGO)
-    return schemas.Tokens(
-        access=access_token,
-        refresh=refresh_token,
-    )
+    if not scopes.from_claims(decoded_token) & scopes.REFRESH:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token does not have 'refresh' scope")
+    if "jti" not in decoded_token:
+        # issued before refresh tokens had a jti; its digest identifies it
+        # just as well, so it is rotated and revoked like the others
+        decoded_token["jti"] = hashlib.sha256(refresh.refresh.encode()).hexdigest()
+    return decoded_token
 
 
 @router.post("/refresh")
-def refresh(
+async def refresh(
     refresh: schemas.RefreshToken,
+    connection: typing.Annotated[sqlite3.Connection, Depends(db_connection, scope="function")]
 ) -> schemas.Tokens:
-    try:
-        decoded_token = jwt.decode(refresh.refresh, JWT_KEY, audience=JWT_AUD, algorithms=JWT_ALGS)
-    except jwt.InvalidTokenError:
+    decoded_token = _decode_refresh_token(refresh)
+
+    # Refresh tokens are single use: of two requests presenting the same
+    # token, only the one that revokes it gets new tokens.
+    if not await database.run(services.revoke_token, connection, decoded_token["jti"], decoded_token["exp"]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token.")
+    # revocations are only needed until their token expires
+    await database.run(services.purge_revoked_tokens, connection, int(time.time()))
 
-    new_token = decoded_token.copy()
-    scopes = new_token["scope"].split(" ")
-    if "refresh" not in scopes:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token does not have 'refresh' scope")
-    scopes = [scope for scope in scopes if scope != "refresh"]
-    token_scope = " ".join(scopes)
-    new_token["scope"] = token_scope
-    new_token["exp"] = int(time.time()) + (60 * 5)
-
-    access_token  = jwt.encode(new_token, JWT_KEY, algorithm=JWT_ALGO)
-    new_token["exp"] = int(time.time()) + (60 * 60)
-    new_token["scope"] = ("refresh " + token_scope).strip()
-    refresh_token = jwt.encode(new_token, JWT_KEY, algorithm=JWT_ALGO)
-    return schemas.Tokens(
-        access=access_token,
-        refresh=refresh_token,
-    )
+    # look the user up again, so the uid and grp claims of the new tokens are
+    # current and deleted users cannot refresh
+    identity = await database.run(services.find_identity, connection, decoded_token["sub"])
+    if identity is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token.")
+
+    return _issue_tokens(identity, scopes.from_claims(decoded_token) & ~scopes.REFRESH)
+
+
+@router.post("/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke(
+    refresh: schemas.RefreshToken,
+    connection: typing.Annotated[sqlite3.Connection, Depends(db_connection, scope="function")]
+):
+    """
+    Revoke a refresh token, e.g. when logging a device out. Revoking a token
+    twice is not an error.
+    """
+    decoded_token = _decode_refresh_token(refresh)
+    await database.run(services.revoke_token, connection, decoded_token["jti"], decoded_token["exp"])
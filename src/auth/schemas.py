@@ -1,5 +1,9 @@
+import typing
+
 from pydantic import BaseModel, Field
 
+import config
+
 
 class UserInput(BaseModel):
     email: str
@@ -8,18 +12,39 @@ class UserInput(BaseModel):
     password: str
 
 
-class User(BaseModel):
+class BulkUserInput(BaseModel):
+    users: list[UserInput] = Field(min_length=1, max_length=config.BULK_USERS_MAX)
+
+
+class Identity(BaseModel):
+    """
+    Who a request is made by: just what authorization needs.
+    """
     email: str
-    first_name: str
-    last_name: str
     id: int
     auth_group: str
 
 
+class User(Identity):
+    first_name: str
+    last_name: str
+
+
 class UserRecord(User):
     password: str
 
 
+class BulkUserResult(BaseModel):
+    """
+    The outcome for one row of a bulk user creation, in the order the rows
+    were given.
+    """
+    email: str
+    status: typing.Literal["created", "invalid", "conflict"]
+    user: User | None = None
+    detail: str | None = None
+
+
 class Credentials(BaseModel):
     email: str
     password: str
@@ -0,0 +1,72 @@
+"""
+Scopes encoded as bitmasks. Tokens carry their scopes as an integer ``scp``
+claim rather than a space-separated ``scope`` string, which keeps them small
+and makes checking a route's scopes a single mask operation.
+"""
+import functools
+from typing import Any, Iterable
+
+from config import PERMISSIONS_GROUPS
+
+
+# Bit i of an encoded scope stands for SCOPES[i]. Tokens in circulation rely
+# on these positions, so scopes are only ever appended.
+SCOPES = (
+    "read:lift",
+    "write:lift",
+    "delete:lift",
+    "read:split",
+    "write:split",
+    "delete:split",
+    "read:workout",
+    "write:workout",
+    "delete:workout",
+    "read:set",
+    "write:set",
+    "delete:set",
+    "read:metrics",
+    "write:user",
+    "refresh",
+)
+_BITS = { scope: 1 << i for i, scope in enumerate(SCOPES) }
+
+REFRESH = _BITS["refresh"]
+
+
+def encode(scopes: Iterable[str]) -> int:
+    """
+    :raises ValueError: If a scope is not in ``SCOPES``.
+    """
+    mask = 0
+    for scope in scopes:
+        try:
+            mask |= _BITS[scope]
+        except KeyError:
+            raise ValueError(f"Unknown scope '{scope}'.")
+    return mask
+
+
+def decode(mask: int) -> frozenset[str]:
+    return frozenset(scope for scope, bit in _BITS.items() if mask & bit)
+
+
+@functools.lru_cache(maxsize=None)
+def required(scopes: tuple[str, ...]) -> int:
+    """
+    Like :func:`encode`, but cached, for the scopes routes declare.
+    """
+    return encode(scopes)
+
+
+def from_claims(claims: dict[str, Any]) -> int:
+    """
+    The scopes a token grants. Tokens issued before ``scp`` existed have a
+    ``scope`` string instead; scopes it names that are unknown are dropped.
+    """
+    if "scp" in claims:
+        return int(claims["scp"])
+    return encode(scope for scope in claims.get("scope", "").split(" ") if scope in _BITS)
+
+
+# compiled once, so a misspelt scope in the configuration fails at startup
+GROUPS = { group: encode(scope.split(" ")) for group, scope in PERMISSIONS_GROUPS.items() }
@@ -1,13 +1,34 @@
 from __future__ import annotations
+import json
 import re
 import typing
 
-from argon2 import PasswordHasher
 from fastapi import HTTPException
 
 from config import DEFAULT_AUTH_GROUP
+from . import hashing
 from .exceptions import EmailValidationError
-from .schemas import User, UserRecord
+from .schemas import Identity, User, UserRecord
+
+
+# characters allowed anywhere in the local part, and those only allowed in quotes
+_ATOM = r"a-zA-Z0-9!#$%&'*+\-/=?^_`{|}~"
+_SPECIAL = r"()<>,:;\[\]\t "
+# a backslash escapes the next quote or atom character; anything else in
+# between leaves the escape pending
+_ESCAPE = rf'\\[^{_ATOM}"@{_SPECIAL}]*[{_ATOM}"]'
+_QUOTED = rf'"(?:[^\\"]|\\[^{_ATOM}"]*[{_ATOM}"])*"'
+_LABEL = r"[a-zA-Z0-9](?:[a-zA-Z0-9\-]*[a-zA-Z0-9])?"
+_EMAIL = re.compile(
+    # at most 64 characters before the first @
+    r"(?![^@]{65})"
+    rf'(?:[^\\"@{_SPECIAL}]|{_ESCAPE}|{_QUOTED})*'
+    rf'(?:\\[^{_ATOM}"@{_SPECIAL}]*)?'
+    r"@"
+    # A trailing newline is tolerated, as it always has been; the last label
+    # is then not checked for a trailing '-'.
+    rf"(?:{_LABEL}\.)*(?:{_LABEL}|[a-zA-Z0-9][a-zA-Z0-9\-]*\n)"
+)
 
 
 def validate_email(email: str):
@@ -18,66 +39,10 @@ def validate_email(email: str):
     :param email: The e-mail address.
     :raises EmailValidationError: If the e-mail address is invalid.
     """
-    local_part_len = len(email.split("@")[0])
-    if local_part_len > 64:
-        raise EmailValidationError("Local part of e-mail exceeds 64 characters.")
-
-    is_quoted = False
-    is_local_part = True
-    is_escaped = False
-    last_was_dot = False
-    domain = ""
-
-    for character in email:
-        if is_local_part:
-            if character == '"':
-                if is_quoted and not is_escaped:
-                    is_quoted = False
-                elif is_escaped:
-                    is_escaped = False
-                else:
-                    is_quoted = True
-            elif character == '\\':
-                if is_escaped:
-                    is_escaped = False
-
-                is_escaped = True
-                last_was_dot = False
-                continue
-            elif re.match(r'^[a-zA-Z0-9!#\$%\&\'\*\+\-/\=\?\^_\`\{\|\}\~]$', character):
-                last_was_dot = False
-                is_escaped = False
-                continue
-            elif re.match(r'[\(\),:;<>\[\]]', character):
-                if not is_quoted:
-                    raise EmailValidationError("Character '%s' only allowed in quotes." % character)
-            elif character == '@':
-                if not is_quoted:
-                    is_local_part = False
-                    last_was_dot = False
-                    continue
-            elif re.match(r'^[\t ]$', character):
-                if not is_quoted:
-                    raise EmailValidationError("Whitespace only allowed in quotes." % character)
-            elif character == '.':
-                if last_was_dot and not is_quoted:
-                    raise EmailValidationError("Two dots may only occur next to each other within quotes.")
-        else:
-            if character == '@':
-                raise EmailValidationError("@ not allowed in the domain")
-            else:
-                domain += character
-
-    domain_parts = domain.split(".")
-    for domain_part in domain_parts:
-        if len(domain_part) == 0:
-            raise EmailValidationError("Domain should not have empty domain segments")
-        elif domain_part.startswith('-') or domain_part.endswith('-'):
-            raise EmailValidationError("Domain part should not start or end with '-'")
-
-    validation = re.match(r'^[a-zA-Z0-9\-]+(\.[a-zA-Z0-9\-]+)*$', domain)
-    if not validation:
-        raise EmailValidationError("Invalid domain '%s'" % domain)
+    if _EMAIL.fullmatch(email) is None:
+        if len(email.split("@")[0]) > 64:
+            raise EmailValidationError("Local part of e-mail exceeds 64 characters.")
+        raise EmailValidationError("Invalid e-mail address '%s'" % email)
 
 
 def create_user(connection: sqlite3.Connection, email: str, password: str, first_name: str,
@@ -92,8 +57,22 @@ def create_user(connection: sqlite3.Connection, email: str, password: str, first
     :param last_name: The user's last name.
     """
     validate_email(email)
-    hasher = PasswordHasher()
-    pw_hash = hasher.hash(password)
+    pw_hash = hashing.password_hasher().hash(password)
+    return insert_user(connection, email, pw_hash, first_name, last_name)
+
+
+def insert_user(connection: sqlite3.Connection, email: str, pw_hash: str, first_name: str,
+                last_name: str) -> User:
+    """
+    Insert a user whose email has already been validated and whose password
+    has already been hashed.
+
+    :param connection: The connection used to insert the user.
+    :param email: The user's email address.
+    :param pw_hash: The hash of the user's password.
+    :param first_name: The user's first name.
+    :param last_name: The user's last name.
+    """
     cursor = connection.execute("INSERT INTO user (email, first_name, last_name, password, auth_group) VALUES "
         "(:email, :first_name, :last_name, :password, :auth_group)",
         { "email": email, "first_name": first_name, "last_name": last_name, "password": pw_hash,
@@ -106,6 +85,44 @@ def create_user(connection: sqlite3.Connection, email: str, password: str, first
         raise HTTPException(status_code=500, detail="An error occurred creating a user.")
 
 
+def find_existing_emails(connection: sqlite3.Connection, emails: list[str]) -> set[str]:
+    """
+    Those of ``emails`` that a user already has.
+    """
+    result = connection.execute("SELECT email FROM user WHERE email IN (SELECT value FROM json_each(:emails))",
+                                { "emails": json.dumps(emails) })
+    return { email for email, in result }
+
+
+def insert_users(connection: sqlite3.Connection, users: list[tuple[str, str, str, str]]) -> dict[str, User]:
+    """
+    Insert users whose emails have already been validated and whose passwords
+    have already been hashed, in one statement. Rows whose email is taken,
+    e.g. by a user created meanwhile, are skipped.
+
+    :param users: The email, password hash, first name and last name of each
+        user.
+    :returns: The users that were inserted, by email.
+    """
+    connection.executemany("INSERT INTO user (email, first_name, last_name, password, auth_group) VALUES "
+        "(:email, :first_name, :last_name, :password, :auth_group) ON CONFLICT (email) DO NOTHING",
+        ({ "email": email, "first_name": first_name, "last_name": last_name, "password": pw_hash,
+          "auth_group": DEFAULT_AUTH_GROUP } for email, pw_hash, first_name, last_name in users)
+    )
+
+    # a skipped row's email belongs to a user with another password hash;
+    # hashes are salted, so they cannot collide
+    hashes = { email: pw_hash for email, pw_hash, _, _ in users }
+    result = connection.execute("SELECT id, email, first_name, last_name, password, auth_group FROM user "
+                                "WHERE email IN (SELECT value FROM json_each(:emails))",
+                                { "emails": json.dumps(list(hashes)) })
+    return {
+        email: User(email=email, first_name=first_name, last_name=last_name, auth_group=auth_group, id=user_id)
+        for user_id, email, first_name, last_name, pw_hash, auth_group in result
+        if hashes[email] == pw_hash
+    }
+
+
 def find_user(connection: sqlite3.Connection, email: str) -> UserRecord | None:
     result = connection.execute("SELECT email, first_name, last_name, password, auth_group, id FROM user WHERE email = :email",
                                 { "email": email })
@@ -118,6 +135,69 @@ def find_user(connection: sqlite3.Connection, email: str) -> UserRecord | None:
                       auth_group=auth_group, id=user_id)
 
 
+
+def update_password_hash(connection: sqlite3.Connection, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """
+    Replace a user's password hash, e.g. with one made with new parameters.
+    Nothing changes if the hash is no longer ``old_hash``, so a password
+    changed in the meantime is never overwritten.
+
+    :returns: Whether the hash was replaced.
+    """
+    cursor = connection.execute("UPDATE user SET password = :new_hash WHERE id = :id AND password = :old_hash",
+                                { "id": user_id, "old_hash": old_hash, "new_hash": new_hash })
+    return cursor.rowcount > 0
+
+
+def find_identity(connection: sqlite3.Connection, email: str) -> Identity | None:
+    """
+    Like :func:`find_user`, but only reads what authorization needs.
+    """
+    result = connection.execute("SELECT id, auth_group FROM user WHERE email = :email", { "email": email })
+    identity = result.fetchone()
+    if identity is None:
+        return None
+
+    return Identity(email=email, id=identity[0], auth_group=identity[1])
+
+
+def get_user_epoch(connection: sqlite3.Connection) -> int:
+    """
+    A counter that changes whenever a user's email or group changes, or a
+    user is deleted, including by other processes. Caches of identities
+    compare it to know when to drop their entries.
+    """
+    return connection.execute("SELECT epoch FROM user_epoch WHERE id = 0").fetchone()[0]
+
+
+def revoke_token(connection: sqlite3.Connection, jti: str, expires: int) -> bool:
+    """
+    Revoke a refresh token. This is the authoritative check when a token is
+    rotated: of two requests presenting the same token, only one revokes it.
+
+    :param jti: The token's ``jti`` claim.
+    :param expires: When the token expires, as a UNIX timestamp; the row can
+        be purged after that.
+    :returns: Whether the token was revoked by this call, i.e. was not revoked
+        already.
+    """
+    cursor = connection.execute("INSERT INTO revoked_token (jti, expires) VALUES (:jti, :expires) "
+                                "ON CONFLICT DO NOTHING",
+                                { "jti": jti, "expires": expires })
+    return cursor.rowcount > 0
+
+
+def purge_revoked_tokens(connection: sqlite3.Connection, now: int) -> int:
+    """
+    Forget revoked refresh tokens that have expired, as they are rejected
+    regardless.
+
+    :returns: The number of tokens forgotten.
+    """
+    cursor = connection.execute("DELETE FROM revoked_token WHERE expires <= :now", { "now": now })
+    return cursor.rowcount
+
+
 if typing.TYPE_CHECKING:
     import sqlite3
 
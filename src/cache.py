@@ -0,0 +1,83 @@
+"""
+Bounded in-process caches. Like metrics, every worker keeps its own.
+"""
+import collections
+import threading
+import time
+from typing import Generic, Hashable, TypeVar
+
+import metrics
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+hits = metrics.counter("cache_hits", "Cache lookups that found a live entry.")
+misses = metrics.counter("cache_misses", "Cache lookups that found nothing, or an expired entry.")
+evictions = metrics.counter("cache_evictions", "Entries evicted to make room for new ones.")
+size = metrics.gauge("cache_size", "Entries currently cached.")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A thread-safe LRU cache whose entries also expire after a while.
+
+    :param name: Labels the cache's metrics.
+    :param max_size: The most entries kept; the least recently used entry
+        is evicted to make room for a new one.
+    :param ttl: How long, in seconds, an entry lives unless given its own
+        expiry.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict[K, tuple[float, V]] = collections.OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                hits.inc(cache=self.name)
+                return entry[1]
+
+            if entry is not None:
+                del self._entries[key]
+                size.set(len(self._entries), cache=self.name)
+
+        misses.inc(cache=self.name)
+        return None
+
+    def set(self, key: K, value: V, expires: float | None = None):
+        """
+        :param expires: When the entry expires, as a :func:`time.monotonic`
+            timestamp. Defaults to ``ttl`` seconds from now.
+        """
+        if expires is None:
+            expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evictions.inc(cache=self.name)
+            size.set(len(self._entries), cache=self.name)
+
+    def invalidate(self, key: K):
+        with self._lock:
+            self._entries.pop(key, None)
+            size.set(len(self._entries), cache=self.name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            size.set(0, cache=self.name)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
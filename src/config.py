@@ -1,6 +1,6 @@
 import os
 
-from definitions import Environment
+from definitions import Environment, JournalMode
 
 
 ENVIRONMENT = Environment(os.environ.get("environment", "dev"))
@@ -12,6 +12,48 @@ else:
 
 
 DB_FILE = "/var/lib/girya/girya.db"
+DB_JOURNAL_MODE = JournalMode(os.environ.get("GIRYA_DB_JOURNAL_MODE", "delete"))
+DB_POOL_SIZE = int(os.environ.get("GIRYA_DB_POOL_SIZE", 8))
+DB_POOL_TIMEOUT = float(os.environ.get("GIRYA_DB_POOL_TIMEOUT", 5))
+
+# lock contention between connections and workers
+DB_BUSY_TIMEOUT = float(os.environ.get("GIRYA_DB_BUSY_TIMEOUT", 2))
+DB_BUSY_RETRIES = int(os.environ.get("GIRYA_DB_BUSY_RETRIES", 3))
+DB_BUSY_BACKOFF = float(os.environ.get("GIRYA_DB_BUSY_BACKOFF", 0.05))
+DB_BUSY_BACKOFF_MAX = float(os.environ.get("GIRYA_DB_BUSY_BACKOFF_MAX", 1))
+
+# in WAL mode, readers get their own pool and never block the single writer
+DB_READ_POOL_SIZE = int(os.environ.get("GIRYA_DB_READ_POOL_SIZE", DB_POOL_SIZE))
+DB_WRITE_POOL_SIZE = 1 if DB_JOURNAL_MODE == JournalMode.wal else DB_POOL_SIZE
+DB_CACHE_SIZE_KIB = int(os.environ.get("GIRYA_DB_CACHE_SIZE_KIB", 16384))
+DB_MMAP_SIZE = int(os.environ.get("GIRYA_DB_MMAP_SIZE", 256 * 1024 * 1024))
+
+# time, in seconds, each database call of a request may spend running
+# statements before they are aborted; DB_DEADLINES overrides it for
+# individual routes
+DB_DEADLINE = float(os.environ.get("GIRYA_DB_DEADLINE", 2))
+DB_DEADLINES: dict[str, float] = {
+    "GET /api/workouts": float(os.environ.get("GIRYA_DB_DEADLINE_LIST_WORKOUTS", 5)),
+    # the unpaginated listing (all=true) reads every workout of the user
+    "GET /api/workouts?all": float(os.environ.get("GIRYA_DB_DEADLINE_LIST_ALL_WORKOUTS", 30)),
+}
+DB_DEADLINE_CHECK_STEPS = 1000
+
+# statement cache slots on top of the registered statements, for ad-hoc SQL
+DB_STATEMENT_CACHE_SPARE = int(os.environ.get("GIRYA_DB_STATEMENT_CACHE_SPARE", 32))
+
+DB_EXECUTOR_THREADS = int(os.environ.get("GIRYA_DB_EXECUTOR_THREADS", DB_POOL_SIZE))
+DB_EXECUTOR_MAX_QUEUED = int(os.environ.get("GIRYA_DB_EXECUTOR_MAX_QUEUED", 64))
+
+# group commit for POST /api/sets
+SET_GROUP_COMMIT = os.environ.get("GIRYA_SET_GROUP_COMMIT", "0") == "1"
+SET_GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GIRYA_SET_GROUP_COMMIT_MAX_BATCH", 64))
+SET_GROUP_COMMIT_MAX_DELAY = float(os.environ.get("GIRYA_SET_GROUP_COMMIT_MAX_DELAY_MS", 5)) / 1000
+# items per page of paginated listings, by default and at most
+PAGE_SIZE = int(os.environ.get("GIRYA_PAGE_SIZE", 50))
+PAGE_MAX = int(os.environ.get("GIRYA_PAGE_MAX", 500))
+# most sets created by one POST /api/sets/batch
+SET_BATCH_MAX = int(os.environ.get("GIRYA_SET_BATCH_MAX", 500))
 
 JWT_KEY = os.environ["GIRYA_JWT_KEY"]
 JWT_ISS = "girya"
@@ -19,8 +61,47 @@ JWT_AUD = "girya"
 JWT_ALGO = "HS512"
 JWT_ALGS = ["HS512"]
 
+# in stateless mode, get_user trusts the uid and grp claims of access tokens
+# instead of looking the user up; short-lived access tokens bound how long a
+# change to the user goes unnoticed
+AUTH_STATELESS = os.environ.get("GIRYA_AUTH_STATELESS", "0") == "1"
+JWT_ACCESS_TTL = int(os.environ.get("GIRYA_JWT_ACCESS_TTL", 60 if AUTH_STATELESS else 60 * 5))
+JWT_REFRESH_TTL = int(os.environ.get("GIRYA_JWT_REFRESH_TTL", 60 * 60))
+
+# users looked up by get_user, keyed by the token subject
+USER_CACHE_SIZE = int(os.environ.get("GIRYA_USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.environ.get("GIRYA_USER_CACHE_TTL", 60))
+# how often, in seconds, a worker checks whether cached users changed
+USER_CACHE_EPOCH_INTERVAL = float(os.environ.get("GIRYA_USER_CACHE_EPOCH_INTERVAL", 1))
+
+# argon2 cost; run scripts/calibrate_argon2.py to pick values for the host.
+# Stored hashes made with other values are upgraded when their users log in.
+ARGON2_TIME_COST = int(os.environ.get("GIRYA_ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.environ.get("GIRYA_ARGON2_MEMORY_COST", 64 * 1024))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get("GIRYA_ARGON2_PARALLELISM", 4))
+
+# password hashing runs in its own processes
+HASH_PROCESSES = int(os.environ.get("GIRYA_HASH_PROCESSES", min(4, os.cpu_count() or 1)))
+HASH_MAX_QUEUED = int(os.environ.get("GIRYA_HASH_MAX_QUEUED", 32))
+
+# admission control for /auth/login and /auth/users: token buckets per
+# account and per client address (rates are per second), and a cap on
+# requests hashing at once
+ADMISSION_ACCOUNT_RATE = float(os.environ.get("GIRYA_ADMISSION_ACCOUNT_RATE", 5 / 60))
+ADMISSION_ACCOUNT_BURST = float(os.environ.get("GIRYA_ADMISSION_ACCOUNT_BURST", 5))
+ADMISSION_ADDRESS_RATE = float(os.environ.get("GIRYA_ADMISSION_ADDRESS_RATE", 1))
+ADMISSION_ADDRESS_BURST = float(os.environ.get("GIRYA_ADMISSION_ADDRESS_BURST", 20))
+ADMISSION_MAX_KEYS = int(os.environ.get("GIRYA_ADMISSION_MAX_KEYS", 10000))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("GIRYA_ADMISSION_MAX_CONCURRENT", HASH_PROCESSES + HASH_MAX_QUEUED))
+
+# most users created by one POST /auth/users/bulk
+BULK_USERS_MAX = int(os.environ.get("GIRYA_BULK_USERS_MAX", 1000))
+
+# verified access tokens, keyed by their digest
+TOKEN_CACHE_SIZE = int(os.environ.get("GIRYA_TOKEN_CACHE_SIZE", 4096))
+
 DEFAULT_AUTH_GROUP = "common"
 PERMISSIONS_GROUPS = {
-    "admin": "read:lift write:lift delete:lift read:split write:split delete:split read:workout write:workout delete:workout read:set write:set delete:set",
+    "admin": "read:lift write:lift delete:lift read:split write:split delete:split read:workout write:workout delete:workout read:set write:set delete:set read:metrics write:user",
     "common": "read:lift read:split read:workout write:workout delete:workout read:set write:set delete:set",
 }
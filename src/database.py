@@ -0,0 +1,611 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, TypeVar
+
+import config
+from definitions import JournalMode
+import metrics
+
+
+pool_size = metrics.gauge("db_pool_size", "Connections opened by the pool.")
+pool_in_use = metrics.gauge("db_pool_in_use", "Connections currently checked out of the pool.")
+pool_checkouts = metrics.counter("db_pool_checkouts", "Connections checked out of the pool.")
+pool_timeouts = metrics.counter("db_pool_timeouts", "Checkouts that gave up waiting for a free connection.")
+pool_wait = metrics.histogram("db_pool_wait_seconds", "Time spent waiting to check out a connection.")
+transactions = metrics.counter("db_transactions", "Request transactions by outcome.")
+executor_threads = metrics.gauge("db_executor_threads", "Threads available to run database calls.")
+executor_queued = metrics.gauge("db_executor_queued", "Database calls waiting for a thread.")
+executor_active = metrics.gauge("db_executor_active", "Database calls currently running.")
+executor_rejections = metrics.counter("db_executor_rejections", "Database calls rejected because the queue was full.")
+executor_queue_wait = metrics.histogram("db_executor_queue_wait_seconds", "Time database calls spent queued.")
+
+busy_retries = metrics.counter("db_busy_retries", "Database calls retried because the database was locked.")
+busy_failures = metrics.counter("db_busy_failures", "Database calls that gave up because the database stayed locked.")
+lock_wait = metrics.histogram("db_lock_wait_seconds",
+                              "Time database calls that outlasted busy_timeout on a locked database spent "
+                              "waiting, busy_timeout included; waits busy_timeout absorbed are not counted.")
+deadline_exceeded = metrics.counter("db_deadline_exceeded", "Database calls aborted because the request's deadline passed.")
+statement_cache = metrics.counter("db_statement_cache", "Statement cache lookups by statement and outcome.")
+
+T = TypeVar("T")
+
+# "METHOD /path" of the route being served, used to label metrics
+route: contextvars.ContextVar[str] = contextvars.ContextVar("route", default="unknown")
+# the unit of work of the request being served
+current_unit: contextvars.ContextVar["UnitOfWork | None"] = contextvars.ContextVar("unit_of_work", default=None)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Statement(str):
+    """
+    SQL text registered under a name with :func:`statement`. It is used
+    exactly like the plain string, the name only labels metrics.
+    """
+    name: str
+
+
+_statements: dict[str, Statement] = {}
+
+
+def statement(name: str, sql: str) -> Statement:
+    """
+    Register a named SQL statement. Every connection's statement cache is
+    sized to hold all registered statements, so they are only prepared once
+    per connection. The SQL must not change from call to call; anything
+    variable belongs in a parameter.
+
+    :raises ValueError: If another statement is already registered under
+        ``name``.
+    """
+    registered = _statements.get(name)
+    if registered is not None:
+        if registered != sql:
+            raise ValueError(f"Statement '{name}' is already registered")
+        return registered
+
+    result = Statement(sql)
+    result.name = name
+    _statements[name] = result
+    return result
+
+
+def statement_cache_size() -> int:
+    return len(_statements) + config.DB_STATEMENT_CACHE_SPARE
+
+
+class Connection(sqlite3.Connection):
+    """
+    Mirrors sqlite3's per-connection statement cache, which is not exposed,
+    to count how often a statement had to be prepared. Like the real cache
+    it is keyed by SQL text and evicts the least recently used statement.
+    """
+
+    def __init__(self, *args, cached_statements: int = 128, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self._cached_statements = cached_statements
+        self._cached: dict[str, None] = {}
+
+    def _lookup(self, sql: str):
+        name = sql.name if isinstance(sql, Statement) else "unregistered"
+        if sql in self._cached:
+            # dicts keep insertion order, so re-inserting marks it most recent
+            del self._cached[sql]
+            statement_cache.inc(statement=name, outcome="hit")
+        else:
+            if len(self._cached) >= self._cached_statements:
+                del self._cached[next(iter(self._cached))]
+            statement_cache.inc(statement=name, outcome="miss")
+        self._cached[sql] = None
+
+    def execute(self, sql: str, *args) -> sqlite3.Cursor:
+        self._lookup(sql)
+        return super().execute(sql, *args)
+
+    def executemany(self, sql: str, *args) -> sqlite3.Cursor:
+        self._lookup(sql)
+        return super().executemany(sql, *args)
+
+
+def _pragmas(read_only: bool) -> list[str]:
+    pragmas = ["foreign_keys = 1"]
+    if config.DB_JOURNAL_MODE == JournalMode.wal:
+        pragmas.extend([
+            "journal_mode = WAL",
+            "synchronous = NORMAL",
+            f"cache_size = -{config.DB_CACHE_SIZE_KIB}",
+            f"mmap_size = {config.DB_MMAP_SIZE}",
+        ])
+        if read_only:
+            pragmas.append("query_only = 1")
+
+    return pragmas
+
+
+def connect(database: str | None = None, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Open a connection configured the way the application expects. The
+    connection stays in autocommit mode until the first write, at which point
+    sqlite3 takes the write lock up front with ``BEGIN IMMEDIATE``. Taking it
+    up front means a transaction never has to upgrade a read lock, which is
+    where concurrent writers deadlock. Waiting for a lock is bounded by
+    ``config.DB_BUSY_TIMEOUT``.
+
+    :param database: The database file. Defaults to ``config.DB_FILE``.
+    :param read_only: Open a connection for the read pool. In WAL mode, such
+        connections refuse writes.
+    """
+    connection = sqlite3.connect(database or config.DB_FILE, isolation_level="IMMEDIATE", check_same_thread=False,
+                                 timeout=config.DB_BUSY_TIMEOUT, factory=Connection,
+                                 cached_statements=statement_cache_size())
+    connection.executescript("".join(f"PRAGMA {pragma};" for pragma in _pragmas(read_only)))
+    return connection
+
+
+class UnitOfWork:
+    """
+    The transaction boundary of a single request. A read-only unit opens a
+    deferred transaction so every query sees the same snapshot; a writable
+    unit leaves it to the first write to start the transaction. Either way,
+    the unit is committed (or rolled back) exactly once.
+
+    :param connection: The connection the request runs on.
+    :param read_only: Whether the request is expected to only read.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, read_only: bool = False):
+        self.connection = connection
+        self.read_only = read_only
+
+    @property
+    def kind(self) -> str:
+        return "read" if self.read_only else "write"
+
+    def begin(self):
+        if self.read_only and not self.connection.in_transaction:
+            self.connection.execute("BEGIN DEFERRED")
+
+    def commit(self):
+        if self.connection.in_transaction:
+            # a COMMIT that finds the database locked leaves the transaction
+            # open, so it is always safe to retry
+            retry_busy(self.connection.commit)
+            transactions.inc(outcome="commit", kind=self.kind)
+
+    def rollback(self):
+        if self.connection.in_transaction:
+            self.connection.rollback()
+            transactions.inc(outcome="rollback", kind=self.kind)
+
+
+def is_busy(error: sqlite3.Error) -> bool:
+    """
+    Whether an error means the database was locked by another connection.
+    """
+    code = getattr(error, "sqlite_errorcode", None)
+    return code is not None and code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def _can_retry(connection: sqlite3.Connection | None) -> bool:
+    if connection is None or not connection.in_transaction:
+        return True
+
+    # a read-only unit of work has nothing to lose by running again
+    unit = current_unit.get()
+    return unit is not None and unit.connection is connection and unit.read_only
+
+
+def retry_busy(fn: Callable[..., T], *args) -> T:
+    """
+    Call ``fn(*args)``, retrying with jittered exponential backoff while the
+    database is locked by another connection (including other workers).
+
+    If the first argument is a connection, the call is only retried when
+    it could not have written anything yet, i.e. when no write transaction
+    is open. Because writes take their lock up front, that covers the case
+    where the lock could not be taken at all.
+
+    A call that was retried, or gave up, has its time from the first attempt
+    observed by ``db_lock_wait_seconds``, which includes SQLite's own
+    ``busy_timeout`` waits. A call that only waited within ``busy_timeout``
+    cannot be told apart from a slow one, as Python has no hook into the busy
+    handler, so it is not observed.
+
+    :raises sqlite3.OperationalError: If the database stays locked after
+        ``config.DB_BUSY_RETRIES`` retries.
+    """
+    connection = args[0] if args and isinstance(args[0], sqlite3.Connection) else None
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            result = fn(*args)
+        except sqlite3.OperationalError as e:
+            if not is_busy(e):
+                raise
+
+            if attempt >= config.DB_BUSY_RETRIES or not _can_retry(connection):
+                busy_failures.inc(route=route.get())
+                lock_wait.observe(time.perf_counter() - started, route=route.get())
+                raise
+
+            busy_retries.inc(route=route.get())
+            time.sleep(random.uniform(0, min(config.DB_BUSY_BACKOFF_MAX, config.DB_BUSY_BACKOFF * 2 ** attempt)))
+            attempt += 1
+        else:
+            if attempt > 0:
+                lock_wait.observe(time.perf_counter() - started, route=route.get())
+            return result
+
+
+def is_interrupted(error: sqlite3.Error) -> bool:
+    """
+    Whether an error means a statement was aborted, e.g. by :func:`set_deadline`.
+    """
+    return getattr(error, "sqlite_errorcode", None) == sqlite3.SQLITE_INTERRUPT
+
+
+def route_deadline(route_name: str) -> float:
+    """
+    The time, in seconds, each database call of the route may spend running
+    statements.
+    """
+    return config.DB_DEADLINES.get(route_name, config.DB_DEADLINE)
+
+
+def set_deadline(connection: sqlite3.Connection, seconds: float | None):
+    """
+    Abort any statement still running on ``connection`` once ``seconds`` have
+    passed, which fails it with an "interrupted" :class:`sqlite3.OperationalError`.
+    SQLite checks the deadline every ``config.DB_DEADLINE_CHECK_STEPS``
+    virtual machine instructions, so even a single long query is bounded.
+
+    :param seconds: The time left, or ``None`` to remove the deadline.
+    """
+    if seconds is None:
+        connection.set_progress_handler(None, 0)
+        return
+
+    expires = time.monotonic() + seconds
+
+    def expired() -> bool:
+        return time.monotonic() > expires
+
+    connection.set_progress_handler(expired, config.DB_DEADLINE_CHECK_STEPS)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of long-lived connections. Connections are opened lazily
+    up to ``size`` and handed out most-recently-used first so that a small
+    working set stays warm.
+
+    :param factory: Callable that opens a new, fully configured connection.
+    :param size: Maximum number of connections the pool will open.
+    :param timeout: Seconds to wait for a free connection before giving up.
+    :param name: Label used for this pool's metrics.
+    """
+
+    def __init__(self, factory: Callable[[], sqlite3.Connection], size: int, timeout: float,
+                 name: str = "default"):
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self._factory = factory
+        # most recently released last
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # notified whenever a connection is released or room frees up to open one
+        self._available = threading.Condition(self._lock)
+        self._opened = 0
+        self._closed = False
+
+    def _claim(self) -> sqlite3.Connection | bool:
+        """
+        Take an idle connection or, if there is room, reserve a slot to open
+        one. Must be called with the lock held.
+
+        :returns: The idle connection, ``True`` if a slot was reserved, or
+            ``False`` if the pool is exhausted.
+        """
+        if self._idle:
+            return self._idle.pop()
+        if self._closed or self._opened >= self.size:
+            return False
+        self._opened += 1
+        return True
+
+    def _open(self) -> sqlite3.Connection:
+        try:
+            connection = self._factory()
+        except BaseException:
+            with self._lock:
+                self._opened -= 1
+                self._available.notify()
+            raise
+
+        pool_size.inc(pool=self.name)
+        return connection
+
+    def _checked_out(self, claimed: sqlite3.Connection | bool, started: float) -> sqlite3.Connection:
+        connection = self._open() if claimed is True else claimed
+        pool_wait.observe(time.perf_counter() - started, pool=self.name)
+        pool_checkouts.inc(pool=self.name)
+        pool_in_use.inc(pool=self.name)
+        return connection
+
+    def try_acquire(self) -> sqlite3.Connection | None:
+        """
+        Check out a connection without waiting. Returns ``None`` if the pool
+        is exhausted.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            claimed = self._claim()
+        if claimed is False:
+            return None
+
+        return self._checked_out(claimed, started)
+
+    def acquire(self, timeout: float | None = None) -> sqlite3.Connection:
+        """
+        Check out a connection, waiting for one to be released if the pool
+        is exhausted.
+
+        :param timeout: Overrides the pool's default wait timeout.
+        :raises PoolTimeout: If no connection became available in time.
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            while (claimed := self._claim()) is False:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    pool_timeouts.inc(pool=self.name)
+                    raise PoolTimeout(f"No connection available in pool '{self.name}'")
+                self._available.wait(remaining)
+
+        return self._checked_out(claimed, started)
+
+    def release(self, connection: sqlite3.Connection, discard: bool = False):
+        """
+        Return a connection to the pool. Any open transaction is rolled back
+        so the next user starts from a clean state. Either way, a waiting
+        checkout is woken: it gets this connection or opens a new one.
+
+        :param discard: Close the connection instead of reusing it.
+        """
+        pool_in_use.dec(pool=self.name)
+        if not discard:
+            try:
+                set_deadline(connection, None)
+                connection.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._lock:
+            if self._closed:
+                discard = True
+            if discard:
+                self._opened -= 1
+            else:
+                self._idle.append(connection)
+            self._available.notify()
+
+        if discard:
+            pool_size.dec(pool=self.name)
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._opened -= len(idle)
+            self._available.notify_all()
+
+        for connection in idle:
+            pool_size.dec(pool=self.name)
+            connection.close()
+
+
+class Executor:
+    """
+    A dedicated thread pool for blocking database calls, kept apart from the
+    threads that serve the rest of the application. The number of calls that
+    may wait for a thread is bounded.
+
+    :param threads: Number of threads running database calls.
+    :param max_queued: Number of calls allowed to wait for a free thread.
+    """
+
+    def __init__(self, threads: int, max_queued: int):
+        self.threads = threads
+        self.max_queued = max_queued
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="girya-db")
+        self._slots = threading.BoundedSemaphore(threads + max_queued)
+        executor_threads.set(threads)
+
+    def submit(self, fn: Callable[..., T], *args, bounded: bool = True) -> concurrent.futures.Future[T]:
+        """
+        Schedule ``fn(*args)`` on a database thread, in a copy of the
+        caller's context.
+
+        :param bounded: Whether the call counts against the queue limit. Calls
+            that release resources, such as commits, should not be rejected.
+        :raises QueueFull: If too many calls are already waiting.
+        """
+        if bounded and not self._slots.acquire(blocking=False):
+            executor_rejections.inc()
+            raise QueueFull("Too many database calls are waiting")
+
+        context = contextvars.copy_context()
+        submitted = time.perf_counter()
+        executor_queued.inc()
+
+        def call():
+            executor_queued.dec()
+            executor_queue_wait.observe(time.perf_counter() - submitted)
+            executor_active.inc()
+            try:
+                return context.run(fn, *args)
+            finally:
+                executor_active.dec()
+
+        def done(future: concurrent.futures.Future):
+            if future.cancelled():
+                executor_queued.dec()
+            if bounded:
+                self._slots.release()
+
+        future = self._executor.submit(call)
+        future.add_done_callback(done)
+        return future
+
+    async def run(self, fn: Callable[..., T], *args, bounded: bool = True) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args, bounded=bounded))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_executor_lock = threading.Lock()
+_executor: Executor | None = None
+_executor_pid: int | None = None
+
+
+def get_executor() -> Executor:
+    global _executor
+    global _executor_pid
+
+    pid = os.getpid()
+    if _executor is not None and _executor_pid == pid:
+        return _executor
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = Executor(config.DB_EXECUTOR_THREADS, config.DB_EXECUTOR_MAX_QUEUED)
+            _executor_pid = pid
+        return _executor
+
+
+def _call_with_deadline(fn: Callable[..., T], *args) -> T:
+    connection = args[0] if args and isinstance(args[0], sqlite3.Connection) else None
+    if connection is None:
+        return retry_busy(fn, *args)
+
+    set_deadline(connection, route_deadline(route.get()))
+    try:
+        return retry_busy(fn, *args)
+    finally:
+        set_deadline(connection, None)
+
+
+async def run(fn: Callable[..., T], *args) -> T:
+    """
+    Run a blocking database call on this worker's database executor,
+    retrying it if the database is locked (see :func:`retry_busy`).
+
+    If the first argument is a connection, the call's statements are
+    aborted once the route's deadline (see :func:`route_deadline`) has
+    passed. The deadline starts when the call starts running, so time the
+    request spends elsewhere, e.g. hashing a password or queued for a
+    database thread, does not count against it.
+
+    :raises QueueFull: If the executor's queue is full.
+    :raises DeadlineExceeded: If a statement was aborted because the
+        call's deadline passed.
+    """
+    try:
+        return await get_executor().run(_call_with_deadline, fn, *args)
+    except sqlite3.OperationalError as e:
+        if not is_interrupted(e):
+            raise
+        deadline_exceeded.inc(route=route.get())
+        raise DeadlineExceeded(route.get()) from e
+
+
+def shutdown_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+_pool_lock = threading.Lock()
+_pools: dict[str, ConnectionPool] = {}
+_pool_pid: int | None = None
+
+
+def _create_pool(name: str) -> ConnectionPool:
+    if name == "read":
+        return ConnectionPool(lambda: connect(read_only=True), config.DB_READ_POOL_SIZE, config.DB_POOL_TIMEOUT,
+                              name="read")
+    else:
+        return ConnectionPool(connect, config.DB_WRITE_POOL_SIZE, config.DB_POOL_TIMEOUT, name="write")
+
+
+def _get_pool(name: str) -> ConnectionPool:
+    global _pools
+    global _pool_pid
+
+    if config.DB_JOURNAL_MODE != JournalMode.wal:
+        # a rollback journal allows no concurrent readers, so both kinds of
+        # connection come from the same pool
+        name = "write"
+
+    pid = os.getpid()
+    pool = _pools.get(name)
+    if pool is not None and _pool_pid == pid:
+        return pool
+
+    with _pool_lock:
+        if _pool_pid != pid:
+            _pools = {}
+            _pool_pid = pid
+        if name not in _pools:
+            _pools[name] = _create_pool(name)
+        return _pools[name]
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Return this worker's pool of writable connections, creating it on first
+    use. Pools are never shared across processes.
+    """
+    return _get_pool("write")
+
+
+def get_read_pool() -> ConnectionPool:
+    """
+    Return this worker's pool of connections for read-only requests. Outside
+    of WAL mode, this is the same pool as :func:`get_pool`.
+    """
+    return _get_pool("read")
+
+
+def close_pool():
+    global _pools
+
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools = {}
@@ -5,3 +5,7 @@ class Environment(enum.StrEnum):
     dev = "dev"
     production = "production"
 
+
+class JournalMode(enum.StrEnum):
+    delete = "delete"
+    wal = "wal"
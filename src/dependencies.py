@@ -1,18 +1,26 @@
+import contextlib
+import contextvars
 import datetime
+import hashlib
 import sqlite3
-import threading
-from typing import Annotated
+import time
+from typing import Annotated, Any, NamedTuple
 
+import anyio
 from fastapi import Depends, HTTPException, status
 from fastapi.security import (
     OAuth2PasswordBearer,
     SecurityScopes,
 )
 import jwt
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
 import auth.schemas
+import auth.scopes
+import cache
 import config
+import database
 
 
 def setup():
@@ -20,43 +28,128 @@ def setup():
     sqlite3.register_converter("datetime", lambda dtstr: datetime.datetime.fromtimestamp(int(dtstr), tz=datetime.timezone.utc))
 
 
-_conn_lock = threading.Lock()
-_connections: dict[int, tuple[int, sqlite3.Connection]] = {}
+_connection: contextvars.ContextVar[sqlite3.Connection | None] = contextvars.ContextVar("db_connection", default=None)
+_read_connection: contextvars.ContextVar[sqlite3.Connection | None] = contextvars.ContextVar("db_read_connection",
+                                                                                           default=None)
 
 
-def db_connection(request: Request):
-    global _conn_lock
-    global _connections
+def current_connection() -> sqlite3.Connection | None:
+    """
+    The connection checked out for the current request, if any. Prefers the
+    writable connection when a request holds both.
+    """
+    return _connection.get() or _read_connection.get()
 
-    req_id = id(request)
-    with _conn_lock:
-        entry = _connections.get(req_id)
-        if entry is None:
-            usages = 1
-            connection = sqlite3.connect(config.DB_FILE, autocommit=False, check_same_thread=False)
-            connection.commit()
-            connection.executescript("COMMIT; PRAGMA foreign_keys = 1; BEGIN;")
-        else:
-            usages = entry[0] + 1
-            connection = entry[1]
-        
-        _connections[req_id] = (usages, connection)
 
+@contextlib.asynccontextmanager
+async def _checkout(request: Request, pool: database.ConnectionPool,
+                    var: contextvars.ContextVar[sqlite3.Connection | None], read_only: bool):
+    route = request.scope.get("route")
+    route_name = f"{request.method} {route.path if route is not None else request.url.path}"
+    database.route.set(route_name)
+
+    connection = pool.try_acquire()
+    if connection is None:
+        # Wait outside of the database executor: its threads are needed by
+        # the requests currently holding connections to finish and release them.
+        try:
+            connection = await run_in_threadpool(pool.acquire)
+        except database.PoolTimeout:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database is busy, try again later.",
+            )
+
+    async def settle(fn):
+        # Shielded: were the request cancelled while the call waits for a
+        # database thread, the call would be dropped, leaving the connection
+        # checked out and a write connection holding its lock.
+        with anyio.CancelScope(shield=True):
+            await database.get_executor().run(fn, bounded=False)
+
+    unit_of_work = database.UnitOfWork(connection, read_only=read_only)
+    database.current_unit.set(unit_of_work)
+    var.set(connection)
     try:
+        # a deferred BEGIN does not touch the database file, so it is cheap
+        # enough to run on the event loop
+        unit_of_work.begin()
         yield connection
+    except BaseException:
+        def _abort():
+            try:
+                unit_of_work.rollback()
+            finally:
+                pool.release(connection)
+
+        await settle(_abort)
+        raise
+    else:
+        def _finalize():
+            try:
+                unit_of_work.commit()
+            finally:
+                pool.release(connection)
+
+        try:
+            await settle(_finalize)
+        except sqlite3.OperationalError as e:
+            if not database.is_busy(e):
+                raise
+            # nothing was saved, which the client must hear about
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database is busy, try again later.",
+            )
     finally:
-        # only finalize connection if all usages of dependency have exited
-        # references a custom attribute used to manually close a connection
-        # for very specific purposes
-        with _conn_lock:
-            entry = _connections[req_id]
-            usages = entry[0] - 1
-            if usages == 0:
-                connection.commit()
-                connection.close()
-                del _connections[req_id]
-            else:
-                _connections[req_id] = (usages, connection)
+        var.set(None)
+        database.current_unit.set(None)
+
+
+def write_connection(request: Request) -> contextlib.AbstractAsyncContextManager[sqlite3.Connection]:
+    """
+    Check out a writable connection for part of a request, for routes that
+    only sometimes write. The writes are committed when the block exits.
+    """
+    return _checkout(request, database.get_pool(), _connection, read_only=False)
+
+
+def read_connection(request: Request) -> contextlib.AbstractAsyncContextManager[sqlite3.Connection]:
+    """
+    Check out a connection for reads made in part of a request, e.g. before
+    slow work that the request should not hold a connection across.
+    """
+    return _checkout(request, database.get_read_pool(), _read_connection, read_only=True)
+
+
+async def db_connection(request: Request):
+    """
+    A writable connection for the request. Routes declare it with
+    ``scope="function"``, so the unit of work is committed before the
+    response is sent and a failed commit fails the request.
+    """
+    connection = _connection.get()
+    if connection is not None:
+        # already checked out earlier in this request
+        yield connection
+        return
+
+    async with write_connection(request) as connection:
+        yield connection
+
+
+async def db_read_connection(request: Request):
+    """
+    A connection for requests that only read. Reuses the request's writable
+    connection if it already has one, so reads observe its own writes.
+    """
+    connection = current_connection()
+    if connection is not None:
+        yield connection
+        return
+
+    async with read_connection(request) as connection:
+        yield connection
 
 
 # security
@@ -64,15 +157,74 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="auth/login"
 )
 
-def get_user(
-    security_scopes: SecurityScopes,
-    token: Annotated[str, Depends(oauth2_scheme)],
-    connection: Annotated[sqlite3.Connection, Depends(db_connection)],
-) -> auth.schemas.User:
+user_cache: cache.TTLCache[str, auth.schemas.Identity] = cache.TTLCache("user", config.USER_CACHE_SIZE,
+                                                                          config.USER_CACHE_TTL)
+_user_epoch: int | None = None
+_user_epoch_checked = 0.0
+
+
+def _user_epoch_due() -> bool:
+    return time.monotonic() - _user_epoch_checked >= config.USER_CACHE_EPOCH_INTERVAL
+
+
+async def _check_user_epoch(connection: sqlite3.Connection):
+    """
+    Drop cached users if any user changed since the last check. Checks at
+    most every ``config.USER_CACHE_EPOCH_INTERVAL`` seconds, so a change made
+    elsewhere (e.g. by ``scripts/promote_to_admin.py``) takes about that long
+    to be noticed.
+    """
     import auth.services  # imported here to avoid circular import
+    global _user_epoch
+    global _user_epoch_checked
+
+    if not _user_epoch_due():
+        return
+
+    _user_epoch_checked = time.monotonic()
+    epoch = await database.run(auth.services.get_user_epoch, connection)
+    if epoch != _user_epoch:
+        user_cache.clear()
+        _user_epoch = epoch
+
+
+def clear_user_cache():
+    global _user_epoch
+    global _user_epoch_checked
+
+    user_cache.clear()
+    _user_epoch = None
+    _user_epoch_checked = 0.0
+
+
+class VerifiedToken(NamedTuple):
+    claims: dict[str, Any]
+    # encoded by auth.scopes
+    scopes: int
+
+
+token_cache: cache.TTLCache[bytes, VerifiedToken] = cache.TTLCache("token", config.TOKEN_CACHE_SIZE,
+                                                                  config.JWT_ACCESS_TTL)
+
+
+def verify_token(token: str) -> VerifiedToken:
+    """
+    Decode and verify an access token. Clients reuse a token for many
+    requests, so verified tokens are cached by their digest until they
+    expire. Refresh tokens are rejected: they can be revoked, which only
+    :func:`auth.router.refresh` checks.
+
+    :raises HTTPException: If the token is invalid, expired or a refresh
+        token.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    verified = token_cache.get(key)
+    if verified is not None:
+        return verified
+
     try:
         payload = jwt.decode(token, config.JWT_KEY, audience=config.JWT_AUD, algorithms=config.JWT_ALGS)
-        if "sub" not in payload:
+        if "sub" not in payload or auth.scopes.from_claims(payload) & auth.scopes.REFRESH:
             raise jwt.InvalidTokenError()
     except (jwt.InvalidTokenError, jwt.ExpiredSignatureError):
         raise HTTPException(
@@ -80,19 +232,54 @@ def get_user(
             detail="Could not validate credentials."
         )
 
-    scopes = [scope for scope in payload.get("scope", "").split(" ") if scope]
-    for scope in security_scopes.scopes:
-        if scope not in scopes:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Insufficient permissions.",
-            )
+    verified = VerifiedToken(payload, auth.scopes.from_claims(payload))
+    if "exp" in payload:
+        # the cache keeps monotonic time, which the token's expiry is converted to
+        token_cache.set(key, verified, expires=time.monotonic() + payload["exp"] - time.time())
+    return verified
 
-    user = auth.services.find_user(connection, payload["sub"])
+
+async def _find_user(connection: sqlite3.Connection, email: str) -> auth.schemas.Identity:
+    import auth.services  # imported here to avoid circular import
+    await _check_user_epoch(connection)
+    user = await database.run(auth.services.find_identity, connection, email)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found.",
         )
-
+    user_cache.set(email, user)
     return user
+
+
+async def get_user(
+    security_scopes: SecurityScopes,
+    token: Annotated[str, Depends(oauth2_scheme)],
+    request: Request,
+) -> auth.schemas.Identity:
+    """
+    The user making the request. A connection is only needed to look up a
+    user who is neither described by the token's claims (in stateless mode)
+    nor cached; the request's own connection is used if it has one.
+    """
+    payload, scopes = verify_token(token)
+    required = auth.scopes.required(tuple(security_scopes.scopes))
+    if required & ~scopes:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Insufficient permissions.",
+        )
+
+    if config.AUTH_STATELESS and "uid" in payload and "grp" in payload:
+        return auth.schemas.Identity(email=payload["sub"], id=payload["uid"], auth_group=payload["grp"])
+
+    # once the epoch is due, cached users may be stale
+    user = None if _user_epoch_due() else user_cache.get(payload["sub"])
+    if user is not None:
+        return user
+
+    connection = current_connection()
+    if connection is not None:
+        return await _find_user(connection, payload["sub"])
+    async with read_connection(request) as connection:
+        return await _find_user(connection, payload["sub"])
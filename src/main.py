@@ -1,14 +1,32 @@
-from fastapi import FastAPI
+import contextlib
+from typing import Annotated
+
+from fastapi import FastAPI, Request, Security, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from auth.router import router as AuthRouter
 from api.router import router as GiryaAPIRouter
+import api.batching
+import auth.hashing
+import auth.schemas
+import database
 import dependencies
+import metrics
 
 import config
 
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(_: FastAPI):
+    yield
+    api.batching.close_set_writer()
+    database.close_pool()
+    database.shutdown_executor()
+    auth.hashing.shutdown_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,10 +34,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # browsers hide response headers from scripts unless listed
+    expose_headers=["X-Next-Cursor"],
 )
 
 dependencies.setup()
 
+
+@app.exception_handler(database.QueueFull)
+async def database_queue_full(_: Request, __: database.QueueFull):
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={"detail": "Server is busy, try again later."})
+
+
+@app.exception_handler(database.DeadlineExceeded)
+async def database_deadline_exceeded(_: Request, __: database.DeadlineExceeded):
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                        content={"detail": "Request took too long, try again later."})
+
 app.include_router(AuthRouter, prefix="/auth")
 app.include_router(GiryaAPIRouter, prefix="/api")
 
+
+@app.get("/metrics")
+async def read_metrics(
+    _: Annotated[auth.schemas.Identity, Security(dependencies.get_user, scopes=["read:metrics"])],
+) -> dict[str, dict]:
+    return metrics.snapshot()
@@ -0,0 +1,135 @@
+"""
+In-process metrics. Every worker keeps its own registry; values are
+reset when the worker restarts.
+"""
+import threading
+
+
+_lock = threading.Lock()
+_registry: dict[str, "Metric"] = {}
+
+
+def _label_key(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metric:
+    kind = "metric"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self) -> list[dict]:
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    Tracks the count, sum and maximum of observed values, which is enough
+    to derive means and spot outliers without keeping every observation.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._stats: dict[tuple[tuple[str, str], ...], list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                self._stats[key] = [1, value, value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                stats[2] = max(stats[2], value)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            stats = self._stats.get(_label_key(labels))
+            return stats[0] if stats else 0
+
+    def samples(self) -> list[dict]:
+        with self._lock:
+            return [
+                {"labels": dict(key), "count": count, "sum": total, "max": maximum}
+                for key, (count, total, maximum) in self._stats.items()
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _register(cls: type[Metric], name: str, description: str):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, description)
+            _registry[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric '{name}' is already registered as a {metric.kind}")
+        return metric
+
+
+def counter(name: str, description: str) -> Counter:
+    return _register(Counter, name, description)
+
+
+def gauge(name: str, description: str) -> Gauge:
+    return _register(Gauge, name, description)
+
+
+def histogram(name: str, description: str) -> Histogram:
+    return _register(Histogram, name, description)
+
+
+def snapshot() -> dict[str, dict]:
+    with _lock:
+        metrics = list(_registry.values())
+
+    return {
+        metric.name: {
+            "type": metric.kind,
+            "description": metric.description,
+            "samples": metric.samples(),
+        } for metric in metrics
+    }
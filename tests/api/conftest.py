@@ -53,9 +53,10 @@ def workout(db_connection: sqlite3.Connection, split: schemas.Split, simple_user
 def lift_sets(db_connection: sqlite3.Connection, lifts: list[schemas.Lift], split: schemas.Split, workout: schemas.Workout) -> list[schemas.Set]:
     sets = []
     for lift in lifts:
-        cursor = db_connection.execute("""INSERT INTO lift_set (lift_slug, workout_slug, reps, weight, weight_unit) VALUES (
-:lift_slug, :workout_slug, :reps, :weight, :weight_unit)""", { "lift_slug": lift.slug, "workout_slug": workout.slug, "reps": 8, "weight": 160,
-                                                              "weight_unit": schemas.WeightUnit.lb })
+        cursor = db_connection.execute("""INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+SELECT :lift_id, workout.id, :reps, :weight, :weight_unit FROM workout WHERE workout.slug = :workout_slug""", {
+            "lift_id": lift.id, "workout_slug": workout.slug, "reps": 8, "weight": 160,
+            "weight_unit": services.WEIGHT_UNIT_CODES[schemas.WeightUnit.lb] })
         sets.append(schemas.Set(
             lift=lift,
             reps=8,
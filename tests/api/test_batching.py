@@ -0,0 +1,158 @@
+from __future__ import annotations
+import sqlite3
+import typing
+
+from fastapi import HTTPException
+import pytest
+
+import auth.schemas
+import config
+from api import batching, schemas, services
+
+
+@pytest.fixture
+def set_writer(db_connection: sqlite3.Connection, monkeypatch: pytest.MonkeyPatch):
+    def connect() -> sqlite3.Connection:
+        # the writer begins its own transactions, so the fixtures' rows are
+        # committed first
+        db_connection.commit()
+        return db_connection
+
+    writer = batching.SetWriter(connect, max_batch=4, max_delay=0.05)
+    monkeypatch.setattr(batching, "_writer", writer)
+    monkeypatch.setattr(batching, "_writer_pid", batching.os.getpid())
+    yield writer
+    writer.close()
+
+
+def _set_input(lift: schemas.Lift, workout: schemas.Workout, reps: int) -> schemas.SetInput:
+    return schemas.SetInput(lift=lift.slug, workout=workout.slug, reps=reps, weight=100,
+                            weight_unit=schemas.WeightUnit.kg)
+
+
+@pytest.mark.unit
+def test_set_writer_groups_sets(db_connection: sqlite3.Connection, set_writer: batching.SetWriter,
+                                lifts: list[schemas.Lift], workout: schemas.Workout,
+                                simple_user: auth.schemas.User):
+    flushes = batching.flush_size.get()
+    futures = [set_writer.submit(_set_input(lifts[index % 3], workout, index), simple_user.id) for index in range(6)]
+    created = [future.result(5) for future in futures]
+
+    # max_batch is 4, so six sets take two transactions
+    assert batching.flush_size.get() == flushes + 2
+    assert len({lift_set.id for lift_set in created}) == 6
+    for index, lift_set in enumerate(created):
+        assert lift_set.reps == index
+        assert services.get_set_by_id(db_connection, lift_set.id, simple_user.id) == lift_set
+
+
+@pytest.mark.unit
+def test_set_writer_isolates_failures(set_writer: batching.SetWriter, lifts: list[schemas.Lift],
+                                      workout: schemas.Workout, simple_user: auth.schemas.User):
+    good = set_writer.submit(_set_input(lifts[0], workout, 5), simple_user.id)
+    wrong_user = set_writer.submit(_set_input(lifts[0], workout, 5), simple_user.id + 1)
+    bad_lift = set_writer.submit(schemas.SetInput(lift="no-lift-slug", workout=workout.slug, reps=5, weight=100,
+                                                  weight_unit=schemas.WeightUnit.kg), simple_user.id)
+
+    assert good.result(5).reps == 5
+    for future in [wrong_user, bad_lift]:
+        with pytest.raises(HTTPException) as error:
+            future.result(5)
+        assert error.value.status_code == 404
+
+
+@pytest.mark.usefixtures("set_writer")
+@pytest.mark.integration
+def test_create_set_group_commit(test_client: TestClient, monkeypatch: pytest.MonkeyPatch,
+                                 lifts: list[schemas.Lift], workout: schemas.Workout, simple_access_token: str,
+                                 admin_access_token: str):
+    monkeypatch.setattr(config, "SET_GROUP_COMMIT", True)
+    response = test_client.post("/api/sets", json={
+        "lift": lifts[0].slug,
+        "workout": workout.slug,
+        "reps": 8,
+        "weight": 160,
+        "weight_unit": schemas.WeightUnit.lb,
+    }, headers={ "Authorization": f"Bearer {simple_access_token}" })
+    assert response.status_code == 201
+    assert response.json()["lift"]["slug"] == lifts[0].slug
+
+    response = test_client.post("/api/sets", json={
+        "lift": lifts[0].slug,
+        "workout": workout.slug,
+        "reps": 8,
+        "weight": 160,
+        "weight_unit": schemas.WeightUnit.lb,
+    }, headers={ "Authorization": f"Bearer {admin_access_token}" })
+    assert response.status_code == 404
+
+
+@pytest.mark.unit
+def test_set_writer_resolves_in_write_transaction(db_connection: sqlite3.Connection, lifts: list[schemas.Lift],
+                                                  workout: schemas.Workout, simple_user: auth.schemas.User):
+    db_connection.commit()
+    statements: list[str] = []
+    db_connection.set_trace_callback(statements.append)
+    try:
+        resolved, created = batching._write(db_connection, [_set_input(lifts[0], workout, 5)], [simple_user.id])
+    finally:
+        db_connection.set_trace_callback(None)
+
+    # the workout cannot be deleted between being resolved and referenced
+    assert statements[0] == "BEGIN IMMEDIATE"
+    assert resolved[0][0] == lifts[0]
+    assert [lift_set.reps for lift_set in created] == [5]
+    assert not db_connection.in_transaction
+
+
+@pytest.mark.usefixtures("set_writer")
+@pytest.mark.integration
+def test_create_set_group_commit_integrity_error(test_client: TestClient, monkeypatch: pytest.MonkeyPatch,
+                                                 lifts: list[schemas.Lift], workout: schemas.Workout,
+                                                 simple_access_token: str):
+    def constraint_failed(*_):
+        raise sqlite3.IntegrityError("FOREIGN KEY constraint failed")
+
+    monkeypatch.setattr(config, "SET_GROUP_COMMIT", True)
+    monkeypatch.setattr(batching, "_write", constraint_failed)
+    response = test_client.post("/api/sets", json={
+        "lift": lifts[0].slug,
+        "workout": workout.slug,
+        "reps": 8,
+        "weight": 160,
+        "weight_unit": schemas.WeightUnit.lb,
+    }, headers={ "Authorization": f"Bearer {simple_access_token}" })
+    assert response.status_code == 404
+
+
+@pytest.mark.integration
+def test_create_set_group_commit_rollback_journal(test_client: TestClient, monkeypatch: pytest.MonkeyPatch,
+                                                  real_database: str, simple_access_token: str):
+    connection = sqlite3.connect(real_database)
+    connection.execute("INSERT INTO lift (name, slug) VALUES ('Lift', 'lift')")
+    connection.execute("INSERT INTO split (name, slug) VALUES ('Split', 'split')")
+    connection.execute("""INSERT INTO workout (at, slug, split_id, user_id)
+SELECT 0, 'workout', split.id, user.id FROM split, user WHERE user.email = 'test@example.com'""")
+    connection.commit()
+    monkeypatch.setattr(config, "SET_GROUP_COMMIT", True)
+    monkeypatch.setattr(batching, "_writer", None)
+
+    # in rollback journal mode, the writer can only commit if the request
+    # holds no read lock while it waits
+    try:
+        response = test_client.post("/api/sets", json={
+            "lift": "lift",
+            "workout": "workout",
+            "reps": 8,
+            "weight": 160,
+            "weight_unit": schemas.WeightUnit.lb,
+        }, headers={ "Authorization": f"Bearer {simple_access_token}" })
+    finally:
+        batching.close_set_writer()
+
+    assert response.status_code == 201
+    assert connection.execute("SELECT reps FROM lift_set").fetchall() == [(8,)]
+
+
+if typing.TYPE_CHECKING:
+    from fastapi.testclient import TestClient
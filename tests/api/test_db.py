@@ -1,4 +1,5 @@
 from __future__ import annotations
+import sqlite3
 import typing
 
 import pytest
@@ -9,10 +10,9 @@ from api.schemas import Lift, Workout, Set, WeightUnit
 @pytest.fixture
 def sets(db_connection: sqlite3.Connection, lifts: list[Lift], workout: Workout) -> list[Set]:
     result = db_connection.execute(f"""
-INSERT INTO lift_set (lift_slug, workout_slug, reps, weight, weight_unit) VALUES
-    ("{lifts[0].slug}", "{workout.slug}", 8, 160, "lb"),
-    ("{lifts[0].slug}", "{workout.slug}", 7, 160, "lb"),
-    ("{lifts[0].slug}", "{workout.slug}", 6, 160, "lb") RETURNING id;
+INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+SELECT {lifts[0].id}, workout.id, set_data.column1, 160, 1 FROM workout, (VALUES (8), (7), (6)) AS set_data
+WHERE workout.slug = "{workout.slug}" RETURNING id;
 """)
     ids = result.fetchall()
     return [
@@ -25,11 +25,20 @@ INSERT INTO lift_set (lift_slug, workout_slug, reps, weight, weight_unit) VALUES
 @pytest.mark.unit
 def test_delete_workout_cascade_to_set(db_connection: sqlite3.Connection, sets: list[Set], workout: Workout):
     db_connection.execute("DELETE FROM workout WHERE slug = :slug", { "slug": workout.slug })
-    result = db_connection.execute("SELECT id FROM lift_set WHERE workout_slug = :slug", { "slug": workout.slug })
+    result = db_connection.execute("SELECT id FROM lift_set WHERE workout_id NOT IN (SELECT id FROM workout)")
     sets = result.fetchall()
     assert len(sets) == 0
 
 
-if typing.TYPE_CHECKING:
-    import sqlite3
 
+@pytest.mark.integration
+def test_delete_split_in_use(real_database: str):
+    # migrated, unlike the test schema
+    connection = sqlite3.connect(real_database)
+    connection.execute("PRAGMA foreign_keys = 1")
+    split_id, = connection.execute("INSERT INTO split (name, slug) VALUES ('Push', 'push') RETURNING id").fetchone()
+    connection.execute("INSERT INTO workout (at, slug, split_id, user_id) "
+                       "SELECT 0, 'workout-' || id, :split_id, id FROM user", { "split_id": split_id })
+    with pytest.raises(sqlite3.IntegrityError):
+        connection.execute("DELETE FROM split WHERE id = :id", { "id": split_id })
+    assert connection.execute("SELECT count(*) FROM workout").fetchone() == (2,)
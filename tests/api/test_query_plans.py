@@ -0,0 +1,92 @@
+from __future__ import annotations
+import datetime
+import inspect
+import sqlite3
+import typing
+
+import pytest
+
+import auth.schemas
+import database
+from api import schemas, services
+
+
+def _service_functions() -> set[str]:
+    return {
+        name for name, value in inspect.getmembers(services, inspect.isfunction)
+        if value.__module__ == services.__name__ and not name.startswith("_")
+    }
+
+
+@pytest.mark.unit
+def test_services_avoid_full_scans(db_connection: sqlite3.Connection, lifts: list[schemas.Lift],
+                                   split: schemas.Split, workout: schemas.Workout, lift_sets: list[schemas.Set],
+                                   simple_user: auth.schemas.User, full_scans: typing.Callable):
+    set_input = schemas.SetInput(lift=lifts[0].slug, workout=workout.slug, reps=5, weight=100,
+                                 weight_unit=schemas.WeightUnit.kg)
+    set_update = schemas.SetUpdateInput(lift=lifts[1].slug, reps=5, weight=100, weight_unit=schemas.WeightUnit.kg)
+    split_input = schemas.SplitInput(name="Other", slug="other", lifts=[lifts[0].slug, lifts[1].slug])
+    workout_input = schemas.WorkoutInput(at=workout.at.replace(year=2026), split=split.slug)
+
+    def _workout_id() -> int:
+        return db_connection.cursor().execute("SELECT id FROM workout WHERE slug = ?", (workout.slug,)).fetchone()[0]
+
+    calls: list[tuple[str, typing.Callable]] = [
+        ("create_lift", lambda: services.create_lift(db_connection, schemas.PartialLift(name="New", slug="new"))),
+        ("get_lift_by_slug", lambda: services.get_lift_by_slug(db_connection, lifts[0].slug)),
+        ("list_lifts", lambda: services.list_lifts(db_connection)),
+        ("update_lift_by_slug", lambda: services.update_lift_by_slug(
+            db_connection, "new", schemas.PartialLift(name="Newer", slug="newer"))),
+        ("create_split", lambda: services.create_split(db_connection, split_input)),
+        ("build_split", lambda: services.build_split(db_connection, (split.id, split.name, split.slug))),
+        ("get_split_by_slug", lambda: services.get_split_by_slug(db_connection, split.slug)),
+        ("get_split_by_id", lambda: services.get_split_by_id(db_connection, split.id)),
+        ("list_splits", lambda: services.list_splits(db_connection)),
+        ("update_split_by_slug", lambda: services.update_split_by_slug(db_connection, "other", split_input)),
+        ("create_workout", lambda: services.create_workout(db_connection, workout_input, simple_user.id)),
+        ("create_workout_with_sets", lambda: services.create_workout_with_sets(db_connection, schemas.WorkoutWithSetsInput(
+            at=workout.at.replace(year=2027), split=split.slug, sets=[set_update, set_update]), simple_user.id)),
+        ("get_workout_by_slug", lambda: services.get_workout_by_slug(db_connection, workout.slug)),
+        ("list_workouts", lambda: services.list_workouts(
+            db_connection, simple_user.id, 10, (int(workout.at.timestamp()), workout.slug), workout.at,
+            workout.at + datetime.timedelta(days=1))),
+        ("create_set", lambda: services.create_set(db_connection, set_input, simple_user.id)),
+        ("create_sets", lambda: services.create_sets(db_connection, [set_input, set_input], simple_user.id)),
+        ("resolve_sets", lambda: services.resolve_sets(db_connection, [set_input], [simple_user.id])),
+        ("insert_sets", lambda: services.insert_sets(db_connection, [(lifts[0], _workout_id(), set_update)])),
+        ("get_set_by_id", lambda: services.get_set_by_id(db_connection, lift_sets[0].id, simple_user.id)),
+        ("list_sets_by_workout", lambda: services.list_sets_by_workout(
+            db_connection, workout.slug, simple_user.id, lifts[0].slug)),
+        ("list_lift_history", lambda: services.list_lift_history(
+            db_connection, lifts[0].slug, simple_user.id, 10, (int(workout.at.timestamp()), workout.slug, 0))),
+        ("update_set_by_id", lambda: services.update_set_by_id(db_connection, lift_sets[0].id, set_update,
+                                                               simple_user.id)),
+        ("delete_set_by_id", lambda: services.delete_set_by_id(db_connection, lift_sets[0].id, simple_user.id)),
+        ("delete_workout_by_slug", lambda: services.delete_workout_by_slug(db_connection, workout.slug,
+                                                                           simple_user.id)),
+        ("delete_split_by_slug", lambda: services.delete_split_by_slug(db_connection, "other")),
+        ("delete_lift_by_slug", lambda: services.delete_lift_by_slug(db_connection, "newer")),
+    ]
+    # every service function must be covered here
+    assert {name for name, _ in calls} == _service_functions()
+
+    full_scans()
+    for name, call in calls:
+        unregistered = database.statement_cache.get(statement="unregistered", outcome="miss")
+        call()
+        assert full_scans() == {}, name
+        # every statement is registered in api.queries, so it fits the statement cache
+        assert database.statement_cache.get(statement="unregistered", outcome="miss") == unregistered, name
+
+
+@pytest.mark.unit
+def test_foreign_keys_are_indexed(db_connection: sqlite3.Connection):
+    # ON DELETE CASCADE and foreign key checks look up children by the
+    # referencing column, which should never require a full scan
+    tables = [row[0] for row in db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    for table in tables:
+        for foreign_key in db_connection.execute(f"PRAGMA foreign_key_list({table})").fetchall():
+            column = foreign_key[3]
+            plan = db_connection.execute(f"EXPLAIN QUERY PLAN SELECT 1 FROM {table} WHERE {column} = ?",
+                                         (0,)).fetchall()
+            assert not any(row[3].startswith("SCAN") for row in plan), f"{table}.{column}"
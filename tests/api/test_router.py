@@ -1,10 +1,13 @@
 from __future__ import annotations
 import datetime
+import sqlite3
 import typing
 
 import pytest
 
-from api import schemas
+from api import pagination, schemas
+import config
+import database
 
 
 @pytest.mark.integration
@@ -235,6 +238,42 @@ def test_create_workout(test_client: TestClient, simple_access_token: str):
     assert workout["at"]
 
 
+@pytest.mark.usefixtures("split")
+@pytest.mark.integration
+def test_create_workout_with_sets(test_client: TestClient, lifts: list[schemas.Lift], simple_access_token: str):
+    response = test_client.post("/api/workouts/full", json={
+        "at": "2025-01-01T00:00:00",
+        "split": "split",
+        "sets": [{ "lift": lift.slug, "reps": 5, "weight": 100, "weight_unit": "kg" } for lift in lifts],
+    }, headers={
+        "Authorization": f"Bearer {simple_access_token}",
+    })
+    assert response.status_code == 201
+
+    workout = response.json()
+    assert "user_id" not in workout
+    assert [lift_set["lift"]["slug"] for lift_set in workout["sets"]] == [lift.slug for lift in lifts]
+
+    response = test_client.get(f"/api/workouts/{workout['slug']}/sets", headers={
+        "Authorization": f"Bearer {simple_access_token}",
+    })
+    assert response.json() == workout["sets"]
+
+
+@pytest.mark.usefixtures("split")
+@pytest.mark.integration
+def test_create_workout_with_too_many_sets(test_client: TestClient, lifts: list[schemas.Lift],
+                                           simple_access_token: str):
+    response = test_client.post("/api/workouts/full", json={
+        "at": "2025-01-01T00:00:00",
+        "split": "split",
+        "sets": [{ "lift": lifts[0].slug, "reps": 5, "weight": 100, "weight_unit": "kg" }] * (config.SET_BATCH_MAX + 1),
+    }, headers={
+        "Authorization": f"Bearer {simple_access_token}",
+    })
+    assert response.status_code == 422
+
+
 @pytest.mark.usefixtures("split")
 @pytest.mark.integration
 def test_create_workout_unauthorized(test_client: TestClient):
@@ -302,6 +341,109 @@ def test_list_workouts(test_client: TestClient, simple_access_token: str, workou
     assert len(workouts) == 0
 
 
+@pytest.mark.integration
+def test_list_workouts_paginated(test_client: TestClient, db_connection: sqlite3.Connection,
+                                 simple_access_token: str, split: schemas.Split, simple_user: auth.schemas.User):
+    at = datetime.datetime(year=2025, month=1, day=1, tzinfo=datetime.timezone.utc)
+    for index in range(5):
+        db_connection.execute("INSERT INTO workout (at, slug, split_id, user_id) VALUES (?, ?, ?, ?)",
+                              (at + datetime.timedelta(days=index), f"workout-{index}", split.id, simple_user.id))
+    headers = { "Authorization": f"Bearer {simple_access_token}" }
+
+    slugs = []
+    params: dict[str, str | int] = { "limit": 2 }
+    while True:
+        response = test_client.get("/api/workouts", params=params, headers=headers)
+        assert response.status_code == 200
+        slugs.extend(workout["slug"] for workout in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert slugs == [f"workout-{index}" for index in reversed(range(5))]
+
+    response = test_client.get("/api/workouts", params={ "limit": 2, "all": True }, headers=headers)
+    assert len(response.json()) == 5
+    assert "X-Next-Cursor" not in response.headers
+
+    response = test_client.get("/api/workouts", params={ "cursor": "not a cursor" }, headers=headers)
+    assert response.status_code == 400
+    # well formed, but SQLite cannot hold the key
+    response = test_client.get("/api/workouts", params={ "cursor": pagination.encode_cursor(2 ** 70, "workout-0") },
+                               headers=headers)
+    assert response.status_code == 400
+    response = test_client.get("/api/workouts", params={ "limit": 0 }, headers=headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.integration
+def test_list_workouts_time_range(test_client: TestClient, db_connection: sqlite3.Connection,
+                                  simple_access_token: str, split: schemas.Split, simple_user: auth.schemas.User):
+    # 23:30 UTC on Jan 1 is already Jan 2 in Amsterdam
+    times = {
+        "morning": datetime.datetime(2025, 1, 1, 8, 0, tzinfo=datetime.timezone.utc),
+        "late": datetime.datetime(2025, 1, 1, 23, 30, tzinfo=datetime.timezone.utc),
+        "next": datetime.datetime(2025, 1, 2, 12, 0, tzinfo=datetime.timezone.utc),
+    }
+    for slug, at in times.items():
+        db_connection.execute("INSERT INTO workout (at, slug, split_id, user_id) VALUES (?, ?, ?, ?)",
+                              (at, slug, split.id, simple_user.id))
+    headers = { "Authorization": f"Bearer {simple_access_token}" }
+
+    def slugs(**params) -> list[str]:
+        response = test_client.get("/api/workouts", params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        return [workout["slug"] for workout in response.json()]
+
+    assert slugs(day="2025-01-01") == ["late", "morning"]
+    assert slugs(day="2025-01-01", tz="Europe/Amsterdam") == ["morning"]
+    assert slugs(day="2025-01-02", tz="Europe/Amsterdam") == ["next", "late"]
+    assert slugs(**{ "from": "2025-01-01T08:00:00Z", "to": "2025-01-02T12:00:00Z" }) == ["late", "morning"]
+    # without an offset, from and to are in tz
+    assert slugs(**{ "from": "2025-01-02T00:00:00", "tz": "Europe/Amsterdam" }) == ["next", "late"]
+    assert slugs(**{ "from": "2025-01-01T09:00:00Z", "all": True }) == ["next", "late"]
+    assert slugs(at="2025-01-01T23:30:00Z") == ["late"]
+    # the first and last days there are
+    assert slugs(day="0001-01-01", tz="Pacific/Kiritimati") == []
+    assert slugs(day="9999-12-31", tz="Pacific/Kiritimati") == []
+
+    response = test_client.get("/api/workouts", params={ "day": "2025-01-01", "tz": "Nowhere/Special" },
+                               headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.usefixtures("workout")
+@pytest.mark.integration
+def test_list_workouts_deadline(monkeypatch: pytest.MonkeyPatch, test_client: TestClient, simple_access_token: str):
+    monkeypatch.setattr(config, "DB_DEADLINE_CHECK_STEPS", 1)
+    monkeypatch.setattr(config, "DB_DEADLINE", 0)
+    monkeypatch.setattr(config, "DB_DEADLINES", {})
+    aborted = database.deadline_exceeded.get(route="unknown")
+    response = test_client.get("/api/workouts", headers={
+        "Authorization": f"Bearer {simple_access_token}",
+    })
+
+    assert response.status_code == 504
+    assert database.deadline_exceeded.get(route="unknown") == aborted + 1
+
+
+@pytest.mark.usefixtures("workout")
+@pytest.mark.integration
+def test_list_all_workouts_deadline(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                    simple_access_token: str):
+    headers = { "Authorization": f"Bearer {simple_access_token}" }
+    # caches the user, whose lookup would miss the deadline below
+    assert test_client.get("/api/workouts", headers=headers).status_code == 200
+    monkeypatch.setattr(config, "DB_DEADLINE_CHECK_STEPS", 1)
+    monkeypatch.setattr(config, "DB_DEADLINE", 0)
+    monkeypatch.setattr(config, "DB_DEADLINES", { "GET /api/workouts?all": 10 })
+
+    # the full listing is not held to the paginated one's budget
+    assert test_client.get("/api/workouts", headers=headers).status_code == 504
+    response = test_client.get("/api/workouts", params={ "all": True }, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
 @pytest.mark.usefixtures("workout", "lift_sets")
 @pytest.mark.integration
 def test_list_workout_sets(test_client: TestClient, simple_access_token: str):
@@ -324,6 +466,68 @@ def test_list_workout_sets_not_found(test_client: TestClient, admin_access_token
     assert response.status_code == 404
 
 
+@pytest.mark.usefixtures("workout", "lift_sets")
+@pytest.mark.integration
+def test_list_sets(test_client: TestClient, simple_access_token: str, admin_access_token: str):
+    headers = { "Authorization": f"Bearer {simple_access_token}" }
+    response = test_client.get("/api/sets", params={ "workout": "workout-slug" }, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    assert "workout" not in response.json()[0]
+
+    response = test_client.get("/api/sets", params={ "workout": "workout-slug", "lift": "some-lift-1" },
+                               headers=headers)
+    assert response.status_code == 200
+    assert [lift_set["lift"]["slug"] for lift_set in response.json()] == ["some-lift-1"]
+
+    response = test_client.get("/api/sets", params={ "lift": "some-lift-1" }, headers=headers)
+    assert response.status_code == 200
+    assert [(lift_set["lift"]["slug"], lift_set["workout"]) for lift_set in response.json()] == [
+        ("some-lift-1", "workout-slug")]
+
+    response = test_client.get("/api/sets", params={ "workout": "workout-slug" }, headers={
+        "Authorization": f"Bearer {admin_access_token}",
+    })
+    assert response.status_code == 404
+    response = test_client.get("/api/sets", params={ "lift": "no-such-lift" }, headers=headers)
+    assert response.status_code == 404
+    response = test_client.get("/api/sets", headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.integration
+def test_get_lift_history(test_client: TestClient, db_connection: sqlite3.Connection, simple_access_token: str,
+                          split: schemas.Split, lifts: list[schemas.Lift], simple_user: auth.schemas.User):
+    at = datetime.datetime(year=2025, month=1, day=1, tzinfo=datetime.timezone.utc)
+    for index in range(3):
+        db_connection.execute("INSERT INTO workout (at, slug, split_id, user_id) VALUES (?, ?, ?, ?)",
+                              (at + datetime.timedelta(days=index), f"workout-{index}", split.id, simple_user.id))
+        for _ in range(2):
+            db_connection.execute("""INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+SELECT ?, id, 5, 100, 0 FROM workout WHERE slug = ?""", (lifts[0].id, f"workout-{index}"))
+    headers = { "Authorization": f"Bearer {simple_access_token}" }
+
+    workouts = []
+    params: dict[str, str | int] = { "limit": 4 }
+    while True:
+        response = test_client.get(f"/api/lifts/{lifts[0].slug}/history", params=params, headers=headers)
+        assert response.status_code == 200
+        workouts.extend(lift_set["workout"] for lift_set in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert workouts == ["workout-2", "workout-2", "workout-1", "workout-1", "workout-0", "workout-0"]
+
+    # a cursor from the workouts listing has the wrong shape
+    response = test_client.get(f"/api/lifts/{lifts[0].slug}/history", headers=headers, params={
+        "cursor": pagination.encode_cursor(0, "workout-0"),
+    })
+    assert response.status_code == 400
+
+    response = test_client.get("/api/lifts/no-such-lift/history", headers=headers)
+    assert response.status_code == 404
+
+
 @pytest.mark.usefixtures("split", "workout")
 @pytest.mark.integration
 def test_delete_workout(test_client: TestClient, simple_access_token: str):
@@ -379,6 +583,30 @@ def test_create_set_workout_not_found(test_client: TestClient, lifts: list[schem
     assert response.status_code == 404
 
 
+@pytest.mark.integration
+def test_create_sets(test_client: TestClient, lifts: list[schemas.Lift], workout: schemas.Workout,
+                     simple_access_token: str):
+    set_inputs = [{
+        "lift": lift.slug,
+        "workout": workout.slug,
+        "reps": 8,
+        "weight": 160,
+        "weight_unit": schemas.WeightUnit.lb,
+    } for lift in lifts]
+    headers = { "Authorization": f"Bearer {simple_access_token}" }
+    response = test_client.post("/api/sets/batch", json=set_inputs, headers=headers)
+    assert response.status_code == 201
+    assert [lift_set["lift"]["slug"] for lift_set in response.json()] == [lift.slug for lift in lifts]
+
+    response = test_client.post("/api/sets/batch", json=[*set_inputs, { **set_inputs[0], "workout": "missing" }],
+                                headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == [{ "index": len(lifts), "detail": "No workout 'missing'" }]
+
+    response = test_client.post("/api/sets/batch", json=[], headers=headers)
+    assert response.status_code == 422
+
+
 @pytest.mark.integration
 def test_update_set(test_client: TestClient, lifts: list[schemas.Lift], lift_sets: list[schemas.Set], workout: schemas.Workout,
                     simple_access_token: str):
@@ -470,3 +698,5 @@ def test_delete_not_found(test_client: TestClient, lift_sets: list[schemas.Set],
 if typing.TYPE_CHECKING:
     from fastapi.testclient import TestClient
 
+    import auth.schemas
+
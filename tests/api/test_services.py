@@ -124,6 +124,18 @@ def test_update_lift_by_slug(db_connection: sqlite3.Connection, lifts: list[sche
     assert fetched.name == "New Lift"
 
 
+@pytest.mark.unit
+def test_update_lift_by_slug_with_sets(db_connection: sqlite3.Connection, lifts: list[schemas.Lift],
+                                      lift_sets: list[schemas.Set], simple_user: auth.schemas.User):
+    renamed = schemas.PartialLift(name="Renamed", slug="renamed")
+    services.update_lift_by_slug(db_connection, lifts[0].slug, renamed)
+
+    lift_set = services.get_set_by_id(db_connection, lift_sets[0].id, simple_user.id)
+    assert lift_set
+    assert lift_set.lift.slug == "renamed"
+    assert lift_set.lift.name == "Renamed"
+
+
 @pytest.mark.unit
 def test_update_split_by_slug(db_connection: sqlite3.Connection, lifts: list[schemas.Lift], split: schemas.Split):
     new_lift = lifts[0].model_copy()
@@ -172,6 +184,33 @@ def test_create_workout_missing_split(db_connection: sqlite3.Connection, simple_
         services.create_workout(db_connection, workout_input, simple_user.id)
 
 
+@pytest.mark.usefixtures("split")
+@pytest.mark.unit
+def test_create_workout_with_sets(db_connection: sqlite3.Connection, lifts: list[schemas.Lift],
+                                  simple_user: auth.schemas.User):
+    set_inputs = [
+        schemas.SetUpdateInput(lift=lift.slug, reps=5, weight=100, weight_unit=schemas.WeightUnit.kg) for lift in lifts
+    ]
+    workout_input = schemas.WorkoutWithSetsInput(
+        at=datetime.datetime(year=2025, month=1, day=1, tzinfo=datetime.timezone.utc),
+        split="split",
+        sets=set_inputs,
+    )
+    workout = services.create_workout_with_sets(db_connection, workout_input, simple_user.id)
+    assert workout.split.slug == "split"
+    assert [lift_set.lift for lift_set in workout.sets] == lifts
+    assert services.list_sets_by_workout(db_connection, workout.slug, simple_user.id) == workout.sets
+
+    workout_input.at = workout_input.at.replace(year=2026)
+    workout_input.sets.append(schemas.SetUpdateInput(lift="no-lift-slug", reps=5, weight=100,
+                                                     weight_unit=schemas.WeightUnit.kg))
+    with pytest.raises(HTTPException) as e:
+        services.create_workout_with_sets(db_connection, workout_input, simple_user.id)
+    assert e.value.detail == [{ "index": len(lifts), "detail": "No lift 'no-lift-slug'" }]
+    # the workout is not created without its sets
+    assert len(services.list_workouts(db_connection, simple_user.id)) == 1
+
+
 @pytest.mark.usefixtures("workout")
 @pytest.mark.unit
 def test_get_workout(db_connection: sqlite3.Connection, simple_user: auth.schemas.User):
@@ -195,11 +234,49 @@ def test_list_workouts(db_connection: sqlite3.Connection, simple_user: auth.sche
     assert len(workouts) == 1
     assert len(workouts[0].split.lifts) == 3
 
-    workouts = services.list_workouts(db_connection, simple_user.id, workout.at)
+    workouts = services.list_workouts(db_connection, simple_user.id, start=workout.at,
+                                      end=workout.at + datetime.timedelta(seconds=1))
     assert len(workouts) == 1
 
-    workouts = services.list_workouts(db_connection, simple_user.id, workout.at + datetime.timedelta(days=1))
+    workouts = services.list_workouts(db_connection, simple_user.id, start=workout.at + datetime.timedelta(days=1))
     assert len(workouts) == 0
+    workouts = services.list_workouts(db_connection, simple_user.id, end=workout.at)
+    assert len(workouts) == 0
+    # bounds are rounded up to whole seconds, as workouts are stored
+    workouts = services.list_workouts(db_connection, simple_user.id,
+                                      start=workout.at - datetime.timedelta(microseconds=1),
+                                      end=workout.at + datetime.timedelta(microseconds=1))
+    assert len(workouts) == 1
+
+
+@pytest.mark.unit
+def test_list_workouts_paged(db_connection: sqlite3.Connection, simple_user: auth.schemas.User,
+                            split: schemas.Split):
+    at = datetime.datetime(year=2025, month=1, day=1, tzinfo=datetime.timezone.utc)
+    # two workouts share each time, so the slug breaks ties
+    for index in range(6):
+        db_connection.execute("INSERT INTO workout (at, slug, split_id, user_id) VALUES (?, ?, ?, ?)",
+                              (at + datetime.timedelta(days=index // 2), f"workout-{index}", split.id,
+                               simple_user.id))
+
+    slugs = []
+    before = None
+    while True:
+        page = services.list_workouts(db_connection, simple_user.id, 4, before)
+        slugs.extend(workout.slug for workout in page)
+        assert all(len(workout.split.lifts) == 3 for workout in page)
+        if len(page) < 4:
+            break
+        before = (int(page[-1].at.timestamp()), page[-1].slug)
+    assert slugs == [f"workout-{index}" for index in reversed(range(6))]
+
+    page = services.list_workouts(db_connection, simple_user.id, 4, start=at, end=at + datetime.timedelta(days=2))
+    assert [workout.slug for workout in page] == ["workout-3", "workout-2", "workout-1", "workout-0"]
+    # the end bound and the cursor combine
+    page = services.list_workouts(db_connection, simple_user.id, 4, (int(at.timestamp()) + 86400, "workout-3"),
+                                  end=at + datetime.timedelta(days=1))
+    assert [workout.slug for workout in page] == ["workout-1", "workout-0"]
+    assert services.list_workouts(db_connection, simple_user.id + 1, 4) == []
 
 
 @pytest.mark.unit
@@ -240,6 +317,88 @@ def test_create_set(db_connection: sqlite3.Connection, lifts: list[schemas.Lift]
         services.create_set(db_connection, new_set_input)
 
 
+@pytest.mark.unit
+def test_resolve_sets(db_connection: sqlite3.Connection, lifts: list[schemas.Lift], workout: schemas.Workout,
+                      simple_user: auth.schemas.User):
+    set_inputs = [
+        schemas.SetInput(lift=lifts[0].slug, workout=workout.slug, reps=8, weight=160, weight_unit=schemas.WeightUnit.lb),
+        schemas.SetInput(lift=lifts[1].slug, workout=workout.slug, reps=8, weight=160, weight_unit=schemas.WeightUnit.lb),
+        schemas.SetInput(lift="no-lift-slug", workout=workout.slug, reps=8, weight=160, weight_unit=schemas.WeightUnit.lb),
+        schemas.SetInput(lift=lifts[0].slug, workout="no-workout", reps=8, weight=160, weight_unit=schemas.WeightUnit.lb),
+        schemas.SetInput(lift=lifts[0].slug, workout=workout.slug, reps=8, weight=160, weight_unit=schemas.WeightUnit.lb),
+    ]
+    resolved = services.resolve_sets(db_connection, set_inputs, [simple_user.id, None, None, None, simple_user.id + 1])
+
+    assert isinstance(resolved[0], tuple) and resolved[0][0] == lifts[0]
+    assert isinstance(resolved[1], tuple) and resolved[1][0] == lifts[1]
+    assert resolved[0][1] == resolved[1][1]
+    for error in resolved[2:]:
+        assert isinstance(error, HTTPException)
+        assert error.status_code == 404
+
+
+@pytest.mark.unit
+def test_create_sets(db_connection: sqlite3.Connection, lifts: list[schemas.Lift], workout: schemas.Workout,
+                     simple_user: auth.schemas.User):
+    set_inputs = [
+        schemas.SetInput(lift=lift.slug, workout=workout.slug, reps=5, weight=100, weight_unit=schemas.WeightUnit.kg)
+        for lift in lifts
+    ]
+    created = services.create_sets(db_connection, set_inputs, simple_user.id)
+    assert [lift_set.lift for lift_set in created] == lifts
+    assert services.list_sets_by_workout(db_connection, workout.slug, simple_user.id) == created
+
+    failing = [*set_inputs, schemas.SetInput(lift="no-lift-slug", workout=workout.slug, reps=5, weight=100,
+                                             weight_unit=schemas.WeightUnit.kg)]
+    with pytest.raises(HTTPException) as e:
+        services.create_sets(db_connection, failing, simple_user.id)
+    assert e.value.status_code == 404
+    assert e.value.detail == [{ "index": len(lifts), "detail": "No lift 'no-lift-slug'" }]
+    # nothing was created
+    assert services.list_sets_by_workout(db_connection, workout.slug, simple_user.id) == created
+
+    with pytest.raises(HTTPException) as e:
+        services.create_sets(db_connection, set_inputs, simple_user.id + 1)
+    assert [error["index"] for error in e.value.detail] == list(range(len(lifts)))
+
+
+@pytest.mark.unit
+def test_insert_sets(db_connection: sqlite3.Connection, lifts: list[schemas.Lift], lift_sets: list[schemas.Set],
+                     workout: schemas.Workout, simple_user: auth.schemas.User):
+    workout_id = db_connection.execute("SELECT id FROM workout WHERE slug = ?", (workout.slug,)).fetchone()[0]
+    set_inputs = [
+        schemas.SetUpdateInput(lift=lift.slug, reps=5 + index, weight=100, weight_unit=schemas.WeightUnit.kg)
+        for index, lift in enumerate(lifts)
+    ]
+    created = services.insert_sets(db_connection, [(lift, workout_id, set_input)
+                                                   for lift, set_input in zip(lifts, set_inputs)])
+
+    assert len(created) == len(lifts)
+    for lift_set, lift, set_input in zip(created, lifts, set_inputs):
+        fetched = services.get_set_by_id(db_connection, lift_set.id, simple_user.id)
+        assert fetched == lift_set
+        assert fetched.lift == lift
+        assert fetched.reps == set_input.reps
+
+    assert services.insert_sets(db_connection, []) == []
+
+
+@pytest.mark.unit
+def test_insert_sets_ids_not_consecutive(db_connection: sqlite3.Connection, lifts: list[schemas.Lift],
+                                         workout: schemas.Workout, simple_user: auth.schemas.User):
+    # another row inserted meanwhile takes an id between the sets'
+    db_connection.execute("""CREATE TEMP TRIGGER interleave AFTER INSERT ON lift_set WHEN NEW.reps > 0 BEGIN
+INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+VALUES (NEW.lift_id, NEW.workout_id, 0, 0, NEW.weight_unit); END""")
+    workout_id = db_connection.execute("SELECT id FROM workout WHERE slug = ?", (workout.slug,)).fetchone()[0]
+    set_input = schemas.SetUpdateInput(lift=lifts[0].slug, reps=5, weight=100, weight_unit=schemas.WeightUnit.kg)
+    created = services.insert_sets(db_connection, [(lifts[0], workout_id, set_input)] * 2)
+
+    assert created[1].id > created[0].id + 1
+    for lift_set in created:
+        assert services.get_set_by_id(db_connection, lift_set.id, simple_user.id) == lift_set
+
+
 @pytest.mark.unit
 def test_update_set(db_connection: sqlite3.Connection, lift_sets: list[schemas.Set], lifts: list[schemas.Lift],
                     simple_user: auth.schemas.User):
@@ -298,6 +457,48 @@ def test_list_sets(db_connection: sqlite3.Connection, simple_user: auth.schemas.
     with pytest.raises(HTTPException):
         services.list_sets_by_workout(db_connection, "workout-slug", simple_user.id + 1)
 
+    sets = services.list_sets_by_workout(db_connection, "workout-slug", simple_user.id, "some-lift-2")
+    assert [lift_set.lift.slug for lift_set in sets] == ["some-lift-2"]
+    assert services.list_sets_by_workout(db_connection, "workout-slug", simple_user.id, "no-such-lift") == []
+
+    db_connection.execute("DELETE FROM lift_set")
+    assert services.list_sets_by_workout(db_connection, "workout-slug", simple_user.id) == []
+    with pytest.raises(HTTPException):
+        services.list_sets_by_workout(db_connection, "no-such-workout", simple_user.id)
+
+
+@pytest.mark.unit
+def test_list_lift_history(db_connection: sqlite3.Connection, simple_user: auth.schemas.User,
+                           admin_user: auth.schemas.User, lifts: list[schemas.Lift], split: schemas.Split):
+    at = datetime.datetime(year=2025, month=1, day=1, tzinfo=datetime.timezone.utc)
+    # three sets of the first lift in each workout, so a page can end mid-workout
+    for index, user in enumerate([simple_user, simple_user, simple_user, admin_user]):
+        db_connection.execute("INSERT INTO workout (at, slug, split_id, user_id) VALUES (?, ?, ?, ?)",
+                              (at + datetime.timedelta(days=index), f"workout-{index}", split.id, user.id))
+        for lift in [lifts[0], lifts[0], lifts[1], lifts[0]]:
+            db_connection.execute("""INSERT INTO lift_set (lift_id, workout_id, reps, weight, weight_unit)
+SELECT ?, id, 5, 100, 0 FROM workout WHERE slug = ?""", (lift.id, f"workout-{index}"))
+
+    history = services.list_lift_history(db_connection, lifts[0].slug, simple_user.id)
+    assert [lift_set.workout for lift_set in history] == ["workout-2"] * 3 + ["workout-1"] * 3 + ["workout-0"] * 3
+    assert all(lift_set.lift == lifts[0] for lift_set in history)
+    assert history[0].at == at + datetime.timedelta(days=2)
+
+    paged = []
+    before = None
+    while True:
+        page = services.list_lift_history(db_connection, lifts[0].slug, simple_user.id, 4, before)
+        paged.extend(page)
+        if len(page) < 4:
+            break
+        before = (int(page[-1].at.timestamp()), page[-1].workout, page[-1].id)
+    assert paged == history
+
+    assert len(services.list_lift_history(db_connection, lifts[1].slug, simple_user.id)) == 3
+    assert services.list_lift_history(db_connection, lifts[2].slug, simple_user.id) == []
+    with pytest.raises(HTTPException):
+        services.list_lift_history(db_connection, "no-such-lift", simple_user.id)
+
 
 @pytest.mark.unit
 def test_delete_set(db_connection: sqlite3.Connection, lift_sets: list[schemas.Set]):
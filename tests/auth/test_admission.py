@@ -0,0 +1,77 @@
+from __future__ import annotations
+import typing
+
+import pytest
+
+from auth import admission
+
+
+@pytest.mark.unit
+def test_rate_limiter_burst_and_refill(monkeypatch: pytest.MonkeyPatch):
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    limiter = admission.RateLimiter("test", rate=1, burst=2, max_keys=10)
+
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(1)
+    # other keys have their own bucket
+    assert limiter.acquire("b") == 0
+
+    now[0] += 0.5
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    now[0] += 1
+    assert limiter.acquire("a") == 0
+
+
+@pytest.mark.unit
+def test_rate_limiter_bounds_keys():
+    limiter = admission.RateLimiter("test", rate=1, burst=1, max_keys=2)
+    for key in ["a", "b", "c"]:
+        limiter.acquire(key)
+    assert admission.tracked_keys.get(limiter="test") == 2
+    # "a" was forgotten, so it starts with a full bucket again
+    assert limiter.acquire("a") == 0
+
+
+@pytest.mark.unit
+def test_concurrency_limit():
+    limit = admission.ConcurrencyLimit(1)
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+    limit.release()
+    assert limit.try_acquire()
+
+
+@pytest.mark.integration
+def test_login_throttled_per_account(monkeypatch: pytest.MonkeyPatch, test_client: TestClient):
+    monkeypatch.setattr(admission.accounts, "burst", 2)
+    rejections = admission.rejections.get(limit="account")
+    statuses = [test_client.post("/auth/login", json={
+        "email": "test@example.com",
+        "password": "password",
+    }).status_code for _ in range(3)]
+    assert statuses == [401, 401, 429]
+    assert admission.rejections.get(limit="account") == rejections + 1
+
+    # a different account is not affected
+    response = test_client.post("/auth/login", json={
+        "email": "other@example.com",
+        "password": "password",
+    })
+    assert response.status_code == 401
+
+
+@pytest.mark.integration
+def test_login_sheds_over_concurrency(monkeypatch: pytest.MonkeyPatch, test_client: TestClient):
+    monkeypatch.setattr(admission.hashing_slots, "limit", 0)
+    response = test_client.post("/auth/login", json={
+        "email": "test@example.com",
+        "password": "password",
+    })
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+if typing.TYPE_CHECKING:
+    from fastapi.testclient import TestClient
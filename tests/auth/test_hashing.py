@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import argon2
+from fastapi import HTTPException
+import pytest
+
+from auth import hashing
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = hashing.HashingPool(processes=1, max_queued=0)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.unit
+def test_hash_and_verify(pool: hashing.HashingPool):
+    async def run() -> tuple[hashing.Verification, hashing.Verification]:
+        pw_hash = await pool.hash("password")
+        return await pool.verify(pw_hash, "password"), await pool.verify(pw_hash, "wrong")
+
+    assert asyncio.run(run()) == ((True, False), (False, False))
+    assert hashing.hashing_latency.get(operation="hash") > 0
+    assert hashing.hashing_latency.get(operation="verify") > 0
+
+
+@pytest.mark.unit
+def test_pool_bounds_queue(pool: hashing.HashingPool):
+    busy = pool.submit(time.sleep, 0.2)
+    rejections = hashing.hashing_rejections.get()
+    with pytest.raises(HTTPException) as e:
+        pool.submit(time.sleep, 0)
+    assert e.value.status_code == 503
+    assert hashing.hashing_rejections.get() == rejections + 1
+
+    busy.result()
+    # the slot is freed by a callback that may run just after the result is set
+    deadline = time.monotonic() + 1
+    while hashing.hashing_pending.get() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.submit(time.sleep, 0).result()
+
+
+@pytest.mark.unit
+def test_verify_detects_outdated_parameters(pool: hashing.HashingPool):
+    pw_hash = argon2.PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1).hash("password")
+    assert asyncio.run(pool.verify(pw_hash, "password")) == (True, True)
+
+
+@pytest.mark.unit
+def test_hash_many_stays_within_queue(pool: hashing.HashingPool):
+    # the pool admits no queued hashes, so this fails if the batch queues any
+    pw_hashes = asyncio.run(pool.hash_many(["one", "two", "three"]))
+
+    assert len(pw_hashes) == 3
+    for pw_hash, password in zip(pw_hashes, ["one", "two", "three"]):
+        assert argon2.PasswordHasher().verify(pw_hash, password)
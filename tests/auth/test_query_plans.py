@@ -0,0 +1,38 @@
+from __future__ import annotations
+import sqlite3
+import typing
+
+import pytest
+
+from auth import services
+
+
+@pytest.mark.unit
+def test_services_avoid_full_scans(db_connection: sqlite3.Connection, full_scans: typing.Callable):
+    full_scans()
+    services.create_user(db_connection, "test@example.com", "password", "Test", "Person")
+    assert full_scans() == {}
+
+    services.find_user(db_connection, "test@example.com")
+    assert full_scans() == {}
+
+    services.find_identity(db_connection, "test@example.com")
+    assert full_scans() == {}
+
+    services.get_user_epoch(db_connection)
+    assert full_scans() == {}
+
+    services.update_password_hash(db_connection, 1, "old", "new")
+    assert full_scans() == {}
+
+    services.revoke_token(db_connection, "jti", 0)
+    assert full_scans() == {}
+
+    services.purge_revoked_tokens(db_connection, 0)
+    assert full_scans() == {}
+
+    services.find_existing_emails(db_connection, ["test@example.com"])
+    assert full_scans() == {}
+
+    services.insert_users(db_connection, [("other@example.com", "hash", "Other", "Person")])
+    assert full_scans() == {}
@@ -1,12 +1,16 @@
 from __future__ import annotations
+import sqlite3
+import time
 import typing
 
+import argon2
 from fastapi.testclient import TestClient
 import jwt
 import pytest
 
-from auth import services
-from config import JWT_KEY, JWT_ALGS, JWT_AUD
+from auth import hashing, scopes, services
+import database
+from config import JWT_KEY, JWT_ALGO, JWT_ALGS, JWT_AUD, JWT_ISS, PERMISSIONS_GROUPS
 
 
 @pytest.mark.integration
@@ -24,6 +28,88 @@ def test_create_user(test_client: TestClient):
     assert "password" not in data
 
 
+@pytest.mark.integration
+def test_create_user_hashes_without_connection(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                               real_database: str):
+    pool = hashing.get_pool()
+    hash_password = pool.hash
+    in_use = []
+
+    async def hash(password: str) -> str:
+        in_use.append(database.pool_in_use.get(pool="write"))
+        return await hash_password(password)
+
+    monkeypatch.setattr(pool, "hash", hash)
+    before = database.pool_in_use.get(pool="write")
+    response = test_client.post("/auth/users", json={
+        "email": "new@example.com",
+        "first_name": "Test",
+        "last_name": "Person",
+        "password": "password",
+    })
+    assert response.status_code == 200
+    assert in_use == [before]
+
+    connection = sqlite3.connect(real_database)
+    assert connection.execute("SELECT count(*) FROM user WHERE email = 'new@example.com'").fetchone() == (1,)
+
+
+@pytest.mark.integration
+def test_create_users(test_client: TestClient, db_connection: sqlite3.Connection, admin_access_token: str):
+    def user(email: str) -> dict:
+        return { "email": email, "first_name": "Test", "last_name": "Person", "password": email }
+
+    response = test_client.post("/auth/users/bulk", json={
+        "users": [user("one@example.com"), user("invalid"), user("two@example.com"), user("one@example.com"),
+                  user("admin@example.com")],
+    }, headers={ "Authorization": f"Bearer {admin_access_token}" })
+    assert response.status_code == 200
+
+    results = response.json()
+    assert [result["email"] for result in results] == [
+        "one@example.com", "invalid", "two@example.com", "one@example.com", "admin@example.com"]
+    assert [result["status"] for result in results] == ["created", "invalid", "created", "conflict", "conflict"]
+    assert results[0]["user"]["id"] == services.find_identity(db_connection, "one@example.com").id
+    assert "password" not in results[0]["user"]
+    assert results[1]["user"] is None
+
+    pw_hash = services.find_user(db_connection, "two@example.com").password
+    assert hashing.password_hasher().verify(pw_hash, "two@example.com")
+
+
+@pytest.mark.integration
+def test_create_users_hashes_without_connection(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                                real_database: str, admin_access_token: str):
+    pool = hashing.get_pool()
+    hash_many = pool.hash_many
+    in_use = []
+
+    async def hash(passwords: list[str]) -> list[str]:
+        in_use.append((database.pool_in_use.get(pool="read"), database.pool_in_use.get(pool="write")))
+        return await hash_many(passwords)
+
+    monkeypatch.setattr(pool, "hash_many", hash)
+    before = (database.pool_in_use.get(pool="read"), database.pool_in_use.get(pool="write"))
+    response = test_client.post("/auth/users/bulk", json={
+        "users": [{ "email": email, "first_name": "Test", "last_name": "Person", "password": "password" }
+                  for email in ["one@example.com", "test@example.com"]],
+    }, headers={ "Authorization": f"Bearer {admin_access_token}" })
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()] == ["created", "conflict"]
+    assert in_use == [before]
+
+    connection = sqlite3.connect(real_database)
+    assert connection.execute("SELECT count(*) FROM user WHERE email = 'one@example.com'").fetchone() == (1,)
+
+
+@pytest.mark.integration
+def test_create_users_requires_scope(test_client: TestClient, simple_access_token: str):
+    response = test_client.post("/auth/users/bulk", json={
+        "users": [{ "email": "one@example.com", "first_name": "Test", "last_name": "Person", "password": "pw" }],
+    }, headers={ "Authorization": f"Bearer {simple_access_token}" })
+    assert response.status_code == 403
+
+
 @pytest.mark.integration
 def test_login(test_client: TestClient, db_connection: sqlite3.Connection):
     services.create_user(db_connection, "test@example.com", "password", "Test", "Person")
@@ -46,14 +132,39 @@ def test_login(test_client: TestClient, db_connection: sqlite3.Connection):
 
     decoded_access = jwt.decode(access_token, JWT_KEY, audience=JWT_AUD, algorithms=JWT_ALGS)
     assert decoded_access["sub"] == "test@example.com"
+    assert decoded_access["grp"] == "common"
+    assert decoded_access["uid"] == services.find_identity(db_connection, "test@example.com").id
 
     decoded_refresh = jwt.decode(refresh_token, JWT_KEY, audience=JWT_AUD, algorithms=JWT_ALGS)
     assert decoded_refresh["sub"] == "test@example.com"
-    assert "refresh" in decoded_refresh["scope"].split(" ")
+    assert scopes.decode(decoded_refresh["scp"]) == {"refresh", *PERMISSIONS_GROUPS["common"].split(" ")}
+    assert scopes.decode(decoded_access["scp"]) == set(PERMISSIONS_GROUPS["common"].split(" "))
+    assert "jti" in decoded_refresh
 
 
 @pytest.mark.integration
-def test_refresh(test_client: TestClient, simple_refresh_token: str):
+def test_login_rehashes_password(test_client: TestClient, real_database: str):
+    # in the real database, so the rehash commits the way it does in rollback
+    # journal mode
+    connection = sqlite3.connect(real_database)
+    old_hash = argon2.PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1).hash("password")
+    services.insert_user(connection, "old@example.com", old_hash, "Test", "Person")
+    connection.commit()
+
+    response = test_client.post("/auth/login", json={
+        "email": "old@example.com",
+        "password": "password",
+    })
+    assert response.status_code == 200
+
+    new_hash = services.find_user(connection, "old@example.com").password
+    assert new_hash != old_hash
+    assert not hashing.password_hasher().check_needs_rehash(new_hash)
+    assert hashing.password_hasher().verify(new_hash, "password")
+
+
+@pytest.mark.integration
+def test_refresh(test_client: TestClient, simple_user: auth.schemas.User, simple_refresh_token: str):
     response = test_client.post("/auth/refresh", json={
         "refresh": simple_refresh_token,
     })
@@ -68,7 +179,88 @@ def test_refresh(test_client: TestClient, simple_refresh_token: str):
 
     decoded_refresh = jwt.decode(refresh_token, JWT_KEY, audience=JWT_AUD, algorithms=JWT_ALGS)
     assert decoded_refresh["sub"] == "test@example.com"
-    assert decoded_refresh["scope"] == "refresh"
+    # the fixture's token only had the refresh scope
+    assert decoded_refresh["scp"] == scopes.REFRESH
+    assert decoded_access["scp"] == 0
+    # claims the refresh token lacked are filled in
+    assert decoded_refresh["uid"] == simple_user.id
+    assert decoded_refresh["grp"] == simple_user.auth_group
+    assert decoded_refresh["jti"] != "simple-refresh-token"
+
+
+@pytest.mark.integration
+def test_refresh_rotates(test_client: TestClient, simple_refresh_token: str):
+    response = test_client.post("/auth/refresh", json={ "refresh": simple_refresh_token })
+    assert response.status_code == 200
+    rotated = response.json()["refresh"]
+
+    # the used token cannot be replayed, but its replacement works once
+    response = test_client.post("/auth/refresh", json={ "refresh": simple_refresh_token })
+    assert response.status_code == 401
+    response = test_client.post("/auth/refresh", json={ "refresh": rotated })
+    assert response.status_code == 200
+    response = test_client.post("/auth/refresh", json={ "refresh": rotated })
+    assert response.status_code == 401
+
+
+@pytest.mark.integration
+def test_refresh_revoked(test_client: TestClient, simple_refresh_token: str):
+    response = test_client.post("/auth/revoke", json={ "refresh": simple_refresh_token })
+    assert response.status_code == 204
+    response = test_client.post("/auth/revoke", json={ "refresh": simple_refresh_token })
+    assert response.status_code == 204
+
+    response = test_client.post("/auth/refresh", json={ "refresh": simple_refresh_token })
+    assert response.status_code == 401
+
+
+@pytest.mark.integration
+def test_refresh_token_is_not_bearer_token(test_client: TestClient, db_connection: sqlite3.Connection):
+    services.create_user(db_connection, "test@example.com", "password", "Test", "Person")
+    response = test_client.post("/auth/login", json={ "email": "test@example.com", "password": "password" })
+    tokens = response.json()
+
+    # it carries the user's scopes, but revoking it must cut the device off
+    response = test_client.get("/api/workouts", headers={ "Authorization": f"Bearer {tokens['refresh']}" })
+    assert response.status_code == 401
+    response = test_client.get("/api/workouts", headers={ "Authorization": f"Bearer {tokens['access']}" })
+    assert response.status_code == 200
+
+
+@pytest.mark.integration
+def test_refresh_without_jti(test_client: TestClient, simple_user: auth.schemas.User):
+    token = jwt.encode({
+        "iss": JWT_ISS,
+        "sub": simple_user.email,
+        "aud": JWT_AUD,
+        "exp": int(time.time()) + 60,
+        "scope": "refresh",
+    }, JWT_KEY, algorithm=JWT_ALGO)
+    # tokens issued before jti existed are still accepted, once
+    response = test_client.post("/auth/refresh", json={ "refresh": token })
+    assert response.status_code == 200
+    response = test_client.post("/auth/refresh", json={ "refresh": token })
+    assert response.status_code == 401
+
+
+@pytest.mark.integration
+def test_refresh_purges_expired_revocations(test_client: TestClient, db_connection: sqlite3.Connection,
+                                            simple_refresh_token: str):
+    services.revoke_token(db_connection, "expired", int(time.time()) - 1)
+    response = test_client.post("/auth/refresh", json={ "refresh": simple_refresh_token })
+    assert response.status_code == 200
+    assert db_connection.execute("SELECT jti FROM revoked_token").fetchall() == [("simple-refresh-token",)]
+
+
+@pytest.mark.integration
+def test_refresh_deleted_user(test_client: TestClient, db_connection: sqlite3.Connection,
+                              simple_user: auth.schemas.User, simple_refresh_token: str):
+    db_connection.execute("DELETE FROM user WHERE id = ?", (simple_user.id,))
+    response = test_client.post("/auth/refresh", json={
+        "refresh": simple_refresh_token,
+    })
+    assert response.status_code == 401
+
 
 if typing.TYPE_CHECKING:
-    import sqlite3
+    import auth.schemas
@@ -0,0 +1,38 @@
+import pytest
+
+import config
+from auth import scopes
+
+
+@pytest.mark.unit
+def test_encode_and_decode():
+    mask = scopes.encode(["read:lift", "write:set"])
+    assert scopes.decode(mask) == {"read:lift", "write:set"}
+    assert scopes.encode([]) == 0
+    with pytest.raises(ValueError):
+        scopes.encode(["read:nothing"])
+
+
+@pytest.mark.unit
+def test_groups_are_compiled():
+    for group, scope in config.PERMISSIONS_GROUPS.items():
+        assert scopes.decode(scopes.GROUPS[group]) == set(scope.split(" "))
+
+
+@pytest.mark.unit
+def test_from_claims():
+    assert scopes.from_claims({ "scp": scopes.encode(["read:lift"]) }) == scopes.encode(["read:lift"])
+    # tokens from before the scp claim, whose unknown scopes are dropped
+    assert scopes.from_claims({ "scope": "read:lift refresh read:nothing" }) == scopes.encode(
+        ["read:lift", "refresh"])
+    assert scopes.from_claims({}) == 0
+
+
+@pytest.mark.unit
+def test_positions_are_stable():
+    # tokens in circulation depend on these; new scopes go at the end
+    assert scopes.SCOPES[:15] == (
+        "read:lift", "write:lift", "delete:lift", "read:split", "write:split", "delete:split",
+        "read:workout", "write:workout", "delete:workout", "read:set", "write:set", "delete:set",
+        "read:metrics", "write:user", "refresh",
+    )
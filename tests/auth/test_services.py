@@ -54,3 +54,55 @@ def test_find_user(db_connection: sqlite3.Connection):
     assert user.first_name == "Test"
     assert user.last_name == "Person"
     assert user.password == "hash"
+
+
+@pytest.mark.unit
+def test_find_identity(db_connection: sqlite3.Connection):
+    assert services.find_identity(db_connection, "test@example.com") is None
+
+    db_connection.execute("INSERT INTO user(email, first_name, last_name, password, auth_group) VALUES "
+        "('test@example.com', 'Test', 'Person', 'hash', 'common')")
+    identity = services.find_identity(db_connection, "test@example.com")
+    assert identity
+    assert identity.email == "test@example.com"
+    assert identity.auth_group == "common"
+
+
+@pytest.mark.unit
+def test_user_epoch(db_connection: sqlite3.Connection):
+    db_connection.execute("INSERT INTO user(email, first_name, last_name, password, auth_group) VALUES "
+        "('test@example.com', 'Test', 'Person', 'hash', 'common')")
+    epoch = services.get_user_epoch(db_connection)
+
+    db_connection.execute("UPDATE user SET first_name = 'Other'")
+    assert services.get_user_epoch(db_connection) == epoch
+
+    db_connection.execute("UPDATE user SET auth_group = 'admin'")
+    assert services.get_user_epoch(db_connection) == epoch + 1
+
+    db_connection.execute("DELETE FROM user")
+    assert services.get_user_epoch(db_connection) == epoch + 2
+
+
+@pytest.mark.unit
+def test_update_password_hash(db_connection: sqlite3.Connection):
+    user = services.insert_user(db_connection, "test@example.com", "old", "Test", "Person")
+    assert not services.update_password_hash(db_connection, user.id, "other", "new")
+    assert services.update_password_hash(db_connection, user.id, "old", "new")
+    assert services.find_user(db_connection, "test@example.com").password == "new"
+
+
+@pytest.mark.unit
+def test_insert_users(db_connection: sqlite3.Connection):
+    services.insert_user(db_connection, "taken@example.com", "existing", "Taken", "Person")
+    assert services.find_existing_emails(db_connection, ["taken@example.com", "new@example.com"]) == {
+        "taken@example.com"}
+
+    created = services.insert_users(db_connection, [
+        ("new@example.com", "hash-1", "New", "Person"),
+        ("taken@example.com", "hash-2", "Other", "Person"),
+    ])
+    assert list(created) == ["new@example.com"]
+    assert created["new@example.com"].first_name == "New"
+    assert services.find_user(db_connection, "new@example.com").password == "hash-1"
+    assert services.find_user(db_connection, "taken@example.com").password == "existing"
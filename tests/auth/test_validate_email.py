@@ -0,0 +1,157 @@
+import random
+import re
+
+import pytest
+
+from auth import services
+from auth.exceptions import EmailValidationError
+
+
+def _reference_validate_email(email: str):
+    """
+    The character-by-character validator that the compiled one replaced,
+    kept verbatim as the reference for its decisions.
+    """
+    local_part_len = len(email.split("@")[0])
+    if local_part_len > 64:
+        raise EmailValidationError("Local part of e-mail exceeds 64 characters.")
+
+    is_quoted = False
+    is_local_part = True
+    is_escaped = False
+    last_was_dot = False
+    domain = ""
+
+    for character in email:
+        if is_local_part:
+            if character == '"':
+                if is_quoted and not is_escaped:
+                    is_quoted = False
+                elif is_escaped:
+                    is_escaped = False
+                else:
+                    is_quoted = True
+            elif character == '\\':
+                if is_escaped:
+                    is_escaped = False
+
+                is_escaped = True
+                last_was_dot = False
+                continue
+            elif re.match(r'^[a-zA-Z0-9!#\$%\&\'\*\+\-/\=\?\^_\`\{\|\}\~]$', character):
+                last_was_dot = False
+                is_escaped = False
+                continue
+            elif re.match(r'[\(\),:;<>\[\]]', character):
+                if not is_quoted:
+                    raise EmailValidationError("Character '%s' only allowed in quotes." % character)
+            elif character == '@':
+                if not is_quoted:
+                    is_local_part = False
+                    last_was_dot = False
+                    continue
+            elif re.match(r'^[\t ]$', character):
+                if not is_quoted:
+                    raise EmailValidationError("Whitespace only allowed in quotes." % character)
+            elif character == '.':
+                if last_was_dot and not is_quoted:
+                    raise EmailValidationError("Two dots may only occur next to each other within quotes.")
+        else:
+            if character == '@':
+                raise EmailValidationError("@ not allowed in the domain")
+            else:
+                domain += character
+
+    domain_parts = domain.split(".")
+    for domain_part in domain_parts:
+        if len(domain_part) == 0:
+            raise EmailValidationError("Domain should not have empty domain segments")
+        elif domain_part.startswith('-') or domain_part.endswith('-'):
+            raise EmailValidationError("Domain part should not start or end with '-'")
+
+    validation = re.match(r'^[a-zA-Z0-9\-]+(\.[a-zA-Z0-9\-]+)*$', domain)
+    if not validation:
+        raise EmailValidationError("Invalid domain '%s'" % domain)
+
+
+def _accepts(validate, email: str) -> bool:
+    try:
+        validate(email)
+    except EmailValidationError:
+        return False
+    except TypeError:
+        # the reference fails to format its message for unquoted whitespace
+        return False
+    return True
+
+
+_ALPHABET = (
+    list("abcxyzABZ0189") + list("!#$%&'*+-/=?^_`{|}~") + list('"\\@.') * 3 + list("()<>,:;[]")
+    + [" ", "\t", "\n", "\r", "é", "\u00a0", "ß"]
+)
+_SAMPLES = [
+    "email@example.com",
+    "firstname.lastname@example.com",
+    "\"email\"@example.com",
+    "much.\"more\\ unusual\"@example.com",
+    "very.unusual.\"@\".unusual.com@example.com",
+    r'"very.(),:;<>[]\".VERY.\"very@\\ \"very\".unusual"@strange.example.com',
+    "email@example-one.co.jp",
+]
+
+
+def _random_email(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.4:
+        # mutate a known address
+        email = list(rng.choice(_SAMPLES))
+        for _ in range(rng.randint(1, 4)):
+            position = rng.randrange(len(email) + 1)
+            operation = rng.random()
+            if operation < 0.4:
+                email.insert(position, rng.choice(_ALPHABET))
+            elif operation < 0.7 and position < len(email):
+                del email[position]
+            elif position < len(email):
+                email[position] = rng.choice(_ALPHABET)
+        return "".join(email)
+
+    local = "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 70 if kind < 0.5 else 12)))
+    labels = ["".join(rng.choice("ab0-\n.@") for _ in range(rng.randint(0, 5))) for _ in range(rng.randint(1, 3))]
+    return local + "@" + ".".join(labels) if kind < 0.9 else local
+
+
+@pytest.mark.unit
+def test_validate_email_matches_reference():
+    rng = random.Random(20240501)
+    accepted = 0
+    for _ in range(30000):
+        email = _random_email(rng)
+        expected = _accepts(_reference_validate_email, email)
+        assert _accepts(services.validate_email, email) == expected, repr(email)
+        accepted += expected
+
+    # make sure both decisions were exercised
+    assert 1000 < accepted < 29000
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("email", [
+    "a" * 64 + "@example.com",
+    "a" * 65 + "@example.com",
+    "a@example.com\n",
+    "a@example.com-\n",
+    "a@-example.com",
+    "a@example..com",
+    "a b@example.com",
+    '"a b"@example.com',
+    "a\\@example.com",
+    'a\\.\"@example.com',
+    "a.b..c@example.com",
+    "a@b@example.com",
+    "@example.com",
+    "a@",
+    "aé@example.com",
+])
+def test_validate_email_edge_cases(email: str):
+    assert _accepts(services.validate_email, email) == _accepts(_reference_validate_email, email)
@@ -3,14 +3,20 @@ from fastapi.testclient import TestClient
 import jwt
 import pytest
 
+import contextlib
+import importlib.util
+import pathlib
+import re
 import sqlite3
 import time
 
+import auth.admission
 import auth.schemas
 from main import app
 import config
+import database
 from config import JWT_ALGO, JWT_AUD, JWT_ISS, JWT_KEY, PERMISSIONS_GROUPS
-from dependencies import db_connection as db_conn_dep
+import dependencies
 
 
 def _create_tables(connection):
@@ -43,37 +49,147 @@ CREATE TABLE split_lift(
     UNIQUE(split_id, lift_id) ON CONFLICT ROLLBACK
 );
 CREATE TABLE workout(
-    at DATETIME NOT NULL,
-    slug VARCHAR PRIMARY KEY,
-    split_id INTEGER NOT NULL,
-    user_id INTEGER NOT NULL,
-    FOREIGN KEY (split_id) REFERENCES split(id) ON DELETE CASCADE,
-    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
-);
+    id INTEGER PRIMARY KEY,
+    at INTEGER NOT NULL,
+    slug TEXT UNIQUE NOT NULL,
+    split_id INTEGER NOT NULL REFERENCES split(id),
+    user_id INTEGER NOT NULL REFERENCES user(id)
+) STRICT;
 CREATE TABLE lift_set(
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    lift_slug VARCHAR NOT NULL,
-    workout_slug VARCHAR NOT NULL,
+    lift_id INTEGER NOT NULL REFERENCES lift(id) ON DELETE CASCADE,
+    workout_id INTEGER NOT NULL REFERENCES workout(id) ON DELETE CASCADE,
     reps INTEGER NOT NULL,
     weight REAL NOT NULL,
-    weight_unit VARCHAR NOT NULL,
-    FOREIGN KEY (lift_slug) REFERENCES lift(slug) ON DELETE CASCADE,
-    FOREIGN KEY (workout_slug) REFERENCES workout(slug) ON DELETE CASCADE
-);
+    weight_unit INTEGER NOT NULL CHECK (weight_unit IN (0, 1))
+) STRICT;
+CREATE INDEX workout_user_at_slug ON workout(user_id, at, slug);
+CREATE INDEX workout_split_id ON workout(split_id);
+CREATE INDEX lift_set_workout_lift ON lift_set(workout_id, lift_id);
+CREATE INDEX lift_set_lift_id ON lift_set(lift_id);
+CREATE INDEX split_lift_lift_id ON split_lift(lift_id);
+CREATE TABLE user_epoch(
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    epoch INTEGER NOT NULL
+) STRICT;
+INSERT INTO user_epoch (id, epoch) VALUES (0, 0);
+CREATE TRIGGER user_epoch_update AFTER UPDATE OF email, auth_group ON user
+BEGIN
+    UPDATE user_epoch SET epoch = epoch + 1 WHERE id = 0;
+END;
+CREATE TRIGGER user_epoch_delete AFTER DELETE ON user
+BEGIN
+    UPDATE user_epoch SET epoch = epoch + 1 WHERE id = 0;
+END;
+CREATE TABLE revoked_token(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT UNIQUE NOT NULL,
+    expires INTEGER NOT NULL
+) STRICT;
+CREATE INDEX revoked_token_expires ON revoked_token(expires);
 COMMIT;
 """)
 
 
 @pytest.fixture(scope="function", autouse=True)
-def db_connection():
-    connection = sqlite3.connect(":memory:", check_same_thread=False)
+def db_connection(monkeypatch: pytest.MonkeyPatch):
+    connection = sqlite3.connect(":memory:", check_same_thread=False, factory=database.Connection,
+                                 cached_statements=database.statement_cache_size())
     connection.execute("PRAGMA foreign_keys = 1")
 
     _create_tables(connection)
+    # user ids repeat between test databases
+    dependencies.clear_user_cache()
+    dependencies.token_cache.clear()
+    auth.admission.reset()
+
+    @contextlib.asynccontextmanager
+    async def checkout(*_, **__):
+        yield connection
 
-    app.dependency_overrides[db_conn_dep] = lambda: connection
+    # every connection a request checks out, through a dependency or not, is
+    # this one, and nothing is committed
+    monkeypatch.setattr(dependencies, "_checkout", checkout)
     yield connection
-    del app.dependency_overrides[db_conn_dep]
+
+
+MIGRATIONS = pathlib.Path(__file__).parent.parent / "migrations"
+_checkout = dependencies._checkout
+
+
+def _migrate(path: str):
+    connection = sqlite3.connect(path)
+    for migration in sorted(MIGRATIONS.glob("migration_*.py")):
+        spec = importlib.util.spec_from_file_location(migration.stem, migration)
+        assert spec is not None and spec.loader is not None
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.migrate(connection)
+    connection.close()
+
+
+@pytest.fixture
+def real_database(db_connection: sqlite3.Connection, monkeypatch: pytest.MonkeyPatch, tmp_path) -> str:
+    """
+    Serves requests from a migrated database file through the real
+    connection dependencies, i.e. the pools, units of work, busy retries and
+    deadlines, instead of the shared test connection. Yields the file's path.
+    The database has the users the access token fixtures are for; other rows
+    the test needs are inserted through a connection of its own.
+
+    Depends on ``db_connection`` so that it undoes that fixture's checkout.
+    """
+    path = str(tmp_path / "girya.db")
+    _migrate(path)
+    connection = sqlite3.connect(path)
+    users = [("test@example.com", "common", "simple"), ("admin@example.com", "admin", "admin")]
+    for email, auth_group, password in users:
+        connection.execute("""INSERT INTO user (email, first_name, last_name, password, auth_group)
+VALUES (?, "Test", "User", ?, ?)""", (email, argon2.PasswordHasher().hash(password), auth_group))
+    connection.commit()
+    connection.close()
+    monkeypatch.setattr(config, "DB_FILE", path)
+    monkeypatch.setattr(dependencies, "_checkout", _checkout)
+    database.close_pool()
+    yield path
+    database.close_pool()
+
+
+# tables that grow with usage; lifts and splits are small, admin-managed catalogs
+LARGE_TABLES = {"user", "workout", "lift_set", "revoked_token"}
+_FULL_SCAN = re.compile(r"^SCAN (\w+)")
+
+
+@pytest.fixture
+def full_scans(db_connection: sqlite3.Connection):
+    """
+    Records the statements run on the test connection. Calling the fixture
+    value returns those whose query plan scans a large table in full, mapped
+    to the offending plan steps, and starts a new recording.
+    """
+    statements: list[str] = []
+    db_connection.set_trace_callback(statements.append)
+
+    def collect() -> dict[str, list[str]]:
+        db_connection.set_trace_callback(None)
+        scans = {}
+        for statement in statements:
+            if not statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+                continue
+
+            # through a cursor, so the plans do not count as statement cache misses
+            plan = db_connection.cursor().execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+            details = [row[3] for row in plan
+                       if (match := _FULL_SCAN.match(row[3])) and match.group(1) in LARGE_TABLES]
+            if details:
+                scans[statement] = details
+
+        statements.clear()
+        db_connection.set_trace_callback(statements.append)
+        return scans
+
+    yield collect
+    db_connection.set_trace_callback(None)
 
 
 @pytest.fixture(scope="function")
@@ -134,6 +250,7 @@ def simple_refresh_token(simple_user: auth.schemas.User) -> str:
         "aud": JWT_AUD,
         "exp": int(time.time()) + (60 * 60),
         "scope": "refresh",
+        "jti": "simple-refresh-token",
     }, JWT_KEY, algorithm=JWT_ALGO)
 
 
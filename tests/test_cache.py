@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+import cache
+
+
+@pytest.mark.unit
+def test_cache_get_set():
+    users = cache.TTLCache("test", max_size=2, ttl=60)
+    assert users.get("a") is None
+    users.set("a", 1)
+    assert users.get("a") == 1
+
+    hits = cache.hits.get(cache="test")
+    misses = cache.misses.get(cache="test")
+    users.get("a")
+    users.get("b")
+    assert cache.hits.get(cache="test") == hits + 1
+    assert cache.misses.get(cache="test") == misses + 1
+
+
+@pytest.mark.unit
+def test_cache_evicts_least_recently_used():
+    users = cache.TTLCache("test", max_size=2, ttl=60)
+    users.set("a", 1)
+    users.set("b", 2)
+    users.get("a")
+    users.set("c", 3)
+    assert users.get("b") is None
+    assert users.get("a") == 1
+    assert users.get("c") == 3
+    assert len(users) == 2
+
+
+@pytest.mark.unit
+def test_cache_expires():
+    users = cache.TTLCache("test", max_size=2, ttl=60)
+    users.set("a", 1, expires=time.monotonic() - 1)
+    assert users.get("a") is None
+    assert len(users) == 0
+
+
+@pytest.mark.unit
+def test_cache_invalidate():
+    users = cache.TTLCache("test", max_size=2, ttl=60)
+    users.set("a", 1)
+    users.set("b", 2)
+    users.invalidate("a")
+    assert users.get("a") is None
+    users.clear()
+    assert users.get("b") is None
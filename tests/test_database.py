@@ -0,0 +1,420 @@
+import asyncio
+import contextvars
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import config
+from definitions import JournalMode
+import database
+
+
+def _memory_connection() -> sqlite3.Connection:
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+@pytest.fixture
+def pool():
+    pool = database.ConnectionPool(_memory_connection, size=2, timeout=0.05, name="test")
+    yield pool
+    pool.close()
+
+
+@pytest.mark.unit
+def test_pool_reuses_connections(pool: database.ConnectionPool):
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+
+
+@pytest.mark.unit
+def test_pool_is_bounded(pool: database.ConnectionPool):
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    assert pool.try_acquire() is None
+
+    timeouts = database.pool_timeouts.get(pool="test")
+    with pytest.raises(database.PoolTimeout):
+        pool.acquire()
+    assert database.pool_timeouts.get(pool="test") == timeouts + 1
+
+
+@pytest.mark.unit
+def test_pool_waits_for_release(pool: database.ConnectionPool):
+    first = pool.acquire()
+    pool.acquire()
+
+    timer = threading.Timer(0.01, pool.release, (first,))
+    timer.start()
+    assert pool.acquire(timeout=1) is first
+    timer.join()
+
+
+@pytest.mark.unit
+def test_pool_rolls_back_on_release(pool: database.ConnectionPool):
+    connection = pool.acquire()
+    connection.execute("CREATE TABLE item(id INTEGER PRIMARY KEY)")
+    connection.commit()
+    connection.execute("INSERT INTO item (id) VALUES (1)")
+    assert connection.in_transaction
+    pool.release(connection)
+
+    connection = pool.acquire()
+    assert not connection.in_transaction
+    assert connection.execute("SELECT id FROM item").fetchall() == []
+
+
+@pytest.mark.unit
+def test_pool_discard(pool: database.ConnectionPool):
+    connection = pool.acquire()
+    pool.release(connection, discard=True)
+    assert pool.acquire() is not connection
+
+
+@pytest.mark.unit
+def test_pool_discard_wakes_waiter(pool: database.ConnectionPool):
+    first = pool.acquire()
+    second = pool.acquire()
+
+    # the discarded connection leaves room to open another one
+    timer = threading.Timer(0.01, pool.release, (first,), {"discard": True})
+    timer.start()
+    connection = pool.acquire(timeout=1)
+    timer.join()
+    assert connection is not first
+    assert connection is not second
+
+
+@pytest.fixture
+def wal_mode(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    monkeypatch.setattr(config, "DB_JOURNAL_MODE", JournalMode.wal)
+    monkeypatch.setattr(config, "DB_FILE", str(tmp_path / "girya.db"))
+    database.close_pool()
+    yield
+    database.close_pool()
+
+
+@pytest.mark.usefixtures("wal_mode")
+@pytest.mark.unit
+def test_connect_wal():
+    writer = database.connect()
+    assert writer.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert writer.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert writer.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    writer.execute("CREATE TABLE item(id INTEGER PRIMARY KEY)")
+    writer.commit()
+
+    reader = database.connect(read_only=True)
+    assert reader.execute("PRAGMA query_only").fetchone()[0] == 1
+    with pytest.raises(sqlite3.OperationalError):
+        reader.execute("INSERT INTO item (id) VALUES (1)")
+
+    # readers are not blocked by an open write transaction
+    writer.execute("INSERT INTO item (id) VALUES (1)")
+    assert reader.execute("SELECT id FROM item").fetchall() == []
+    writer.commit()
+    assert reader.execute("SELECT id FROM item").fetchall() == [(1,)]
+
+
+@pytest.mark.usefixtures("wal_mode")
+@pytest.mark.unit
+def test_wal_pools_are_separate():
+    assert database.get_read_pool() is not database.get_pool()
+    assert database.get_pool().size == config.DB_WRITE_POOL_SIZE
+
+
+@pytest.mark.unit
+def test_rollback_journal_pool_is_shared(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "DB_JOURNAL_MODE", JournalMode.delete)
+    database.close_pool()
+    assert database.get_read_pool() is database.get_pool()
+    database.close_pool()
+
+
+@pytest.fixture
+def database_file(tmp_path) -> str:
+    path = str(tmp_path / "girya.db")
+    connection = database.connect(path)
+    connection.execute("CREATE TABLE item(id INTEGER PRIMARY KEY)")
+    connection.commit()
+    connection.close()
+    return path
+
+
+@pytest.mark.unit
+def test_unit_of_work_write_locks_on_first_write(database_file: str):
+    connection = database.connect(database_file)
+    other = database.connect(database_file)
+    other.execute("PRAGMA busy_timeout = 0")
+
+    unit_of_work = database.UnitOfWork(connection)
+    unit_of_work.begin()
+    connection.execute("SELECT id FROM item").fetchall()
+    assert not connection.in_transaction
+
+    connection.execute("INSERT INTO item (id) VALUES (1)")
+    assert connection.in_transaction
+    # the writer holds a RESERVED lock, so nobody else can start writing
+    with pytest.raises(sqlite3.OperationalError):
+        other.execute("INSERT INTO item (id) VALUES (2)")
+
+    connection.execute("INSERT INTO item (id) VALUES (3)")
+    commits = database.transactions.get(outcome="commit", kind="write")
+    unit_of_work.commit()
+    assert database.transactions.get(outcome="commit", kind="write") == commits + 1
+    assert other.execute("SELECT id FROM item").fetchall() == [(1,), (3,)]
+
+
+@pytest.mark.unit
+def test_unit_of_work_rollback(database_file: str):
+    connection = database.connect(database_file)
+    unit_of_work = database.UnitOfWork(connection)
+    unit_of_work.begin()
+    connection.execute("INSERT INTO item (id) VALUES (1)")
+    unit_of_work.rollback()
+    assert connection.execute("SELECT id FROM item").fetchall() == []
+
+
+@pytest.mark.unit
+def test_unit_of_work_read_snapshot(database_file: str):
+    connection = database.connect(database_file)
+    unit_of_work = database.UnitOfWork(connection, read_only=True)
+    unit_of_work.begin()
+    assert connection.in_transaction
+    assert connection.execute("SELECT id FROM item").fetchall() == []
+    unit_of_work.commit()
+    assert not connection.in_transaction
+
+
+@pytest.mark.unit
+def test_statement_registry():
+    first = database.statement("test_select_one", "SELECT 1")
+    assert database.statement("test_select_one", "SELECT 1") is first
+    assert first.name == "test_select_one"
+    with pytest.raises(ValueError):
+        database.statement("test_select_one", "SELECT 2")
+
+
+@pytest.mark.unit
+def test_statement_cache_metrics(database_file: str):
+    select = database.statement("test_select_items", "SELECT id FROM item")
+    connection = database.connect(database_file)
+    assert connection.execute("PRAGMA foreign_keys").fetchone() == (1,)
+
+    hits = database.statement_cache.get(statement=select.name, outcome="hit")
+    misses = database.statement_cache.get(statement=select.name, outcome="miss")
+    for _ in range(3):
+        connection.execute(select).fetchall()
+    assert database.statement_cache.get(statement=select.name, outcome="miss") == misses + 1
+    assert database.statement_cache.get(statement=select.name, outcome="hit") == hits + 2
+
+
+@pytest.mark.unit
+def test_statement_cache_evicts_least_recent(tmp_path):
+    connection = database.Connection(str(tmp_path / "cache.db"), cached_statements=2)
+    misses = database.statement_cache.get(statement="unregistered", outcome="miss")
+    for sql in ["SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3", "SELECT 2"]:
+        connection.execute(sql)
+    # SELECT 2 was the least recently used when SELECT 3 needed its slot
+    assert database.statement_cache.get(statement="unregistered", outcome="miss") == misses + 4
+
+
+@pytest.fixture
+def busy_retries(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "DB_BUSY_RETRIES", 3)
+    monkeypatch.setattr(config, "DB_BUSY_BACKOFF", 0.01)
+    monkeypatch.setattr(config, "DB_BUSY_BACKOFF_MAX", 0.05)
+
+
+def _insert(connection: sqlite3.Connection, item_id: int):
+    connection.execute("INSERT INTO item (id) VALUES (?)", (item_id,))
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("busy_retries")
+def test_retry_busy_waits_for_lock(monkeypatch: pytest.MonkeyPatch, database_file: str):
+    # plenty of retries, so the test does not depend on how the jitter falls
+    monkeypatch.setattr(config, "DB_BUSY_RETRIES", 100)
+    connection = database.connect(database_file)
+    connection.execute("PRAGMA busy_timeout = 0")
+    other = database.connect(database_file)
+    _insert(other, 1)
+
+    release = threading.Timer(0.02, other.commit)
+    retries = database.busy_retries.get(route="unknown")
+    release.start()
+    database.retry_busy(_insert, connection, 2)
+    release.join()
+    connection.commit()
+
+    assert database.busy_retries.get(route="unknown") > retries
+    assert connection.execute("SELECT id FROM item").fetchall() == [(1,), (2,)]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("busy_retries")
+def test_retry_busy_gives_up(database_file: str):
+    connection = database.connect(database_file)
+    connection.execute("PRAGMA busy_timeout = 0")
+    other = database.connect(database_file)
+    _insert(other, 1)
+
+    route = database.route.set("POST /test")
+    try:
+        with pytest.raises(sqlite3.OperationalError) as e:
+            database.retry_busy(_insert, connection, 2)
+    finally:
+        database.route.reset(route)
+
+    assert database.is_busy(e.value)
+    assert database.busy_retries.get(route="POST /test") == config.DB_BUSY_RETRIES
+    assert database.busy_failures.get(route="POST /test") == 1
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("busy_retries")
+def test_retry_busy_lock_wait_includes_busy_timeout(monkeypatch: pytest.MonkeyPatch, database_file: str):
+    monkeypatch.setattr(config, "DB_BUSY_RETRIES", 1)
+    connection = database.connect(database_file)
+    connection.execute("PRAGMA busy_timeout = 50")
+    other = database.connect(database_file)
+    _insert(other, 1)
+
+    route = database.route.set("POST /lock-wait")
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            database.retry_busy(_insert, connection, 2)
+    finally:
+        database.route.reset(route)
+
+    # both attempts waited out busy_timeout
+    sample, = (sample for sample in database.lock_wait.samples() if sample["labels"] == { "route": "POST /lock-wait" })
+    assert sample["max"] >= 0.1
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("busy_retries")
+def test_retry_busy_skips_open_writes(monkeypatch: pytest.MonkeyPatch, database_file: str):
+    monkeypatch.setattr(config, "DB_BUSY_RETRIES", 100)
+    connection = database.connect(database_file)
+    connection.execute("PRAGMA busy_timeout = 0")
+    _insert(connection, 1)
+    other = database.connect(database_file)
+    other.execute("PRAGMA busy_timeout = 0")
+    other.execute("BEGIN")
+    other.execute("SELECT id FROM item").fetchall()
+
+    # the commit cannot finish while the other connection is reading, but it
+    # is retried since nothing is lost by running it again
+    release = threading.Timer(0.02, other.rollback)
+    release.start()
+    database.retry_busy(connection.commit)
+    release.join()
+
+    _insert(connection, 2)
+    calls = []
+
+    def locked(connection: sqlite3.Connection):
+        calls.append(connection)
+        error = sqlite3.OperationalError("database is locked")
+        error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+        raise error
+
+    # a write already happened in this transaction, so it must not be replayed
+    with pytest.raises(sqlite3.OperationalError):
+        database.retry_busy(locked, connection)
+    assert calls == [connection]
+    connection.rollback()
+
+
+@pytest.mark.unit
+def test_deadline_aborts_statement(database_file: str):
+    connection = database.connect(database_file)
+    database.set_deadline(connection, 0.01)
+    with pytest.raises(sqlite3.OperationalError) as e:
+        connection.execute("""WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+SELECT count(*) FROM n""").fetchone()
+    assert database.is_interrupted(e.value)
+
+    database.set_deadline(connection, None)
+    assert connection.execute("SELECT count(*) FROM item").fetchone() == (0,)
+
+
+@pytest.mark.unit
+def test_run_deadline_is_per_call(monkeypatch: pytest.MonkeyPatch, database_file: str):
+    monkeypatch.setattr(config, "DB_DEADLINE", 0.05)
+    monkeypatch.setattr(config, "DB_DEADLINES", {})
+    connection = database.connect(database_file)
+
+    def count(connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT count(*) FROM item").fetchone()[0]
+
+    def endless(connection: sqlite3.Connection):
+        connection.execute("""WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+SELECT count(*) FROM n""").fetchone()
+
+    async def calls():
+        assert await database.run(count, connection) == 0
+        # time spent between calls does not count against the next one
+        await asyncio.sleep(0.1)
+        assert await database.run(count, connection) == 0
+        with pytest.raises(database.DeadlineExceeded):
+            await database.run(endless, connection)
+
+    asyncio.run(calls())
+    # no deadline is left behind for statements run outside database.run
+    time.sleep(0.1)
+    assert count(connection) == 0
+
+
+@pytest.mark.unit
+def test_route_deadline(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "DB_DEADLINE", 1)
+    monkeypatch.setattr(config, "DB_DEADLINES", {"GET /slow": 10})
+    assert database.route_deadline("GET /slow") == 10
+    assert database.route_deadline("GET /other") == 1
+
+
+@pytest.fixture
+def executor():
+    executor = database.Executor(threads=1, max_queued=1)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.unit
+def test_executor_bounds_queue(executor: database.Executor):
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    running = executor.submit(block)
+    started.wait(5)
+    queued = executor.submit(lambda: 42)
+
+    rejections = database.executor_rejections.get()
+    with pytest.raises(database.QueueFull):
+        executor.submit(lambda: 0)
+    assert database.executor_rejections.get() == rejections + 1
+
+    # calls that release resources are never rejected
+    unbounded = executor.submit(lambda: 1, bounded=False)
+
+    release.set()
+    running.result(5)
+    assert queued.result(5) == 42
+    assert unbounded.result(5) == 1
+    assert executor.submit(lambda: 2).result(5) == 2
+
+
+@pytest.mark.unit
+def test_executor_runs_in_callers_context(executor: database.Executor):
+    variable: contextvars.ContextVar[str] = contextvars.ContextVar("variable", default="unset")
+    variable.set("request")
+    assert asyncio.run(executor.run(variable.get)) == "request"
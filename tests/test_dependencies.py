@@ -0,0 +1,214 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+import typing
+
+import anyio
+from fastapi import HTTPException
+from starlette.requests import Request
+import jwt
+import pytest
+
+import auth.schemas
+import auth.scopes
+import config
+import database
+import dependencies
+
+
+def _token(expires_in: int, **claims) -> str:
+    return jwt.encode({
+        "iss": config.JWT_ISS,
+        "sub": "test@example.com",
+        "aud": config.JWT_AUD,
+        "exp": int(time.time()) + expires_in,
+        "scope": "read:lift read:split",
+        **claims,
+    }, config.JWT_KEY, algorithm=config.JWT_ALGO)
+
+
+@pytest.mark.unit
+def test_verify_token_is_cached(monkeypatch: pytest.MonkeyPatch):
+    token = _token(60)
+    verified = dependencies.verify_token(token)
+    assert verified.claims["sub"] == "test@example.com"
+    assert auth.scopes.decode(verified.scopes) == {"read:lift", "read:split"}
+
+    def decode(*args, **kwargs):
+        raise AssertionError("cached tokens are not decoded again")
+
+    monkeypatch.setattr(jwt, "decode", decode)
+    assert dependencies.verify_token(token) is verified
+
+
+@pytest.mark.unit
+def test_verify_token_rejects_expired():
+    with pytest.raises(HTTPException) as e:
+        dependencies.verify_token(_token(-1))
+    assert e.value.status_code == 401
+    with pytest.raises(HTTPException):
+        dependencies.verify_token(_token(60)[:-2])
+    assert len(dependencies.token_cache) == 0
+
+
+def _get_lifts(test_client: TestClient, token: str) -> int:
+    return test_client.get("/api/lifts", headers={ "Authorization": f"Bearer {token}" }).status_code
+
+
+@pytest.mark.integration
+def test_get_user_checks_encoded_scopes(test_client: TestClient, simple_user: auth.schemas.User):
+    claims = { "scope": None, "sub": simple_user.email }
+    assert _get_lifts(test_client, _token(60, **claims, scp=auth.scopes.encode(["read:lift"]))) == 200
+    assert _get_lifts(test_client, _token(60, **claims, scp=auth.scopes.encode(["read:split"]))) == 403
+    # a string scope is ignored when there is an encoded one
+    assert _get_lifts(test_client, _token(60, sub=simple_user.email, scope="read:lift", scp=0)) == 403
+
+
+@pytest.mark.integration
+def test_get_user_is_cached(test_client: TestClient, db_connection: sqlite3.Connection,
+                            simple_user: auth.schemas.User, simple_access_token: str):
+    assert _get_lifts(test_client, simple_access_token) == 200
+    assert dependencies.user_cache.get(simple_user.email) == auth.schemas.Identity(
+        email=simple_user.email, id=simple_user.id, auth_group=simple_user.auth_group)
+
+    statements: list[str] = []
+    db_connection.set_trace_callback(statements.append)
+    try:
+        assert _get_lifts(test_client, simple_access_token) == 200
+    finally:
+        db_connection.set_trace_callback(None)
+    assert not any("FROM user " in statement for statement in statements)
+
+
+@pytest.mark.integration
+def test_get_user_cache_invalidated(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                    db_connection: sqlite3.Connection, simple_user: auth.schemas.User,
+                                    simple_access_token: str):
+    monkeypatch.setattr(config, "USER_CACHE_EPOCH_INTERVAL", 0)
+    assert _get_lifts(test_client, simple_access_token) == 200
+
+    db_connection.execute("UPDATE user SET auth_group = 'admin' WHERE id = ?", (simple_user.id,))
+    assert _get_lifts(test_client, simple_access_token) == 200
+    assert dependencies.user_cache.get(simple_user.email).auth_group == "admin"
+
+    db_connection.execute("DELETE FROM user WHERE id = ?", (simple_user.id,))
+    assert _get_lifts(test_client, simple_access_token) == 401
+
+
+
+@pytest.mark.integration
+def test_get_user_stateless(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                            db_connection: sqlite3.Connection, simple_user: auth.schemas.User):
+    monkeypatch.setattr(config, "AUTH_STATELESS", True)
+    token = _token(60, uid=simple_user.id, grp=simple_user.auth_group)
+
+    statements: list[str] = []
+    db_connection.set_trace_callback(statements.append)
+    try:
+        assert _get_lifts(test_client, token) == 200
+    finally:
+        db_connection.set_trace_callback(None)
+    assert not any("FROM user " in statement for statement in statements)
+    assert len(dependencies.user_cache) == 0
+
+
+@pytest.mark.integration
+def test_get_user_stateless_without_claims(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                           simple_user: auth.schemas.User, simple_access_token: str):
+    monkeypatch.setattr(config, "AUTH_STATELESS", True)
+    # tokens issued before the claims existed are still resolved from the database
+    assert _get_lifts(test_client, simple_access_token) == 200
+    assert dependencies.user_cache.get(simple_user.email) is not None
+
+
+
+@pytest.mark.integration
+def test_get_user_checks_out_connection_when_needed(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                                    real_database: str):
+    def get_metrics(token: str) -> int:
+        return test_client.get("/metrics", headers={ "Authorization": f"Bearer {token}" }).status_code
+
+    monkeypatch.setattr(config, "USER_CACHE_EPOCH_INTERVAL", 60)
+    checkouts = database.pool_checkouts.get(pool="write")
+    token = _token(60, sub="admin@example.com", scope="read:metrics")
+    assert get_metrics(token) == 200
+    assert database.pool_checkouts.get(pool="write") == checkouts + 1
+    # the user is cached now
+    assert get_metrics(token) == 200
+    assert database.pool_checkouts.get(pool="write") == checkouts + 1
+
+    monkeypatch.setattr(config, "AUTH_STATELESS", True)
+    dependencies.clear_user_cache()
+    assert get_metrics(_token(60, sub="admin@example.com", scope="read:metrics", uid=2, grp="admin")) == 200
+    assert database.pool_checkouts.get(pool="write") == checkouts + 1
+
+
+@pytest.mark.integration
+def test_unit_of_work_commits(test_client: TestClient, real_database: str, admin_access_token: str):
+    commits = database.transactions.get(outcome="commit", kind="write")
+    response = test_client.post("/api/lifts", json={ "name": "Lift", "slug": "lift" }, headers={
+        "Authorization": f"Bearer {admin_access_token}",
+    })
+    assert response.status_code == 201
+    assert database.transactions.get(outcome="commit", kind="write") == commits + 1
+
+    connection = sqlite3.connect(real_database)
+    assert connection.execute("SELECT slug FROM lift").fetchall() == [("lift",)]
+
+
+@pytest.mark.integration
+def test_unit_of_work_commit_fails_request(monkeypatch: pytest.MonkeyPatch, test_client: TestClient,
+                                           real_database: str, admin_access_token: str):
+    monkeypatch.setattr(config, "DB_BUSY_TIMEOUT", 0.01)
+    monkeypatch.setattr(config, "DB_BUSY_RETRIES", 1)
+    monkeypatch.setattr(config, "DB_BUSY_BACKOFF", 0.01)
+    # in rollback journal mode, a reader keeps the commit from taking the
+    # exclusive lock it needs
+    reader = sqlite3.connect(real_database)
+    reader.execute("BEGIN")
+    reader.execute("SELECT * FROM lift").fetchall()
+    try:
+        response = test_client.post("/api/lifts", json={ "name": "Lift", "slug": "lift" }, headers={
+            "Authorization": f"Bearer {admin_access_token}",
+        })
+    finally:
+        reader.rollback()
+
+    # the client is told, rather than the write getting lost after a 201
+    assert response.status_code == 503
+    assert reader.execute("SELECT slug FROM lift").fetchall() == []
+
+
+
+@pytest.mark.integration
+def test_unit_of_work_settles_when_cancelled(real_database: str):
+    executor = database.get_executor()
+    in_use = database.pool_in_use.get(pool="write")
+    request = Request({ "type": "http", "method": "POST", "path": "/api/lifts", "headers": [], "query_string": b"" })
+
+    # the commit has to wait for a database thread, until after the request
+    # is cancelled
+    gate = threading.Event()
+    busy = [executor.submit(gate.wait, bounded=False) for _ in range(executor.threads)]
+    threading.Timer(0.2, gate.set).start()
+
+    async def cancelled():
+        with anyio.move_on_after(0.1):
+            async with dependencies.write_connection(request) as connection:
+                connection.execute("INSERT INTO lift (name, slug) VALUES ('Lift', 'lift')")
+
+    anyio.run(cancelled)
+    for future in busy:
+        future.result()
+
+    assert database.pool_in_use.get(pool="write") == in_use
+    connection = sqlite3.connect(real_database, timeout=0)
+    assert connection.execute("SELECT slug FROM lift").fetchall() == [("lift",)]
+    # nothing holds the write lock
+    connection.execute("BEGIN IMMEDIATE")
+    connection.rollback()
+
+
+if typing.TYPE_CHECKING:
+    from fastapi.testclient import TestClient
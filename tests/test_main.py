@@ -0,0 +1,21 @@
+from __future__ import annotations
+import typing
+
+import pytest
+
+
+@pytest.mark.integration
+def test_read_metrics(test_client: TestClient, admin_access_token: str):
+    response = test_client.get("/metrics", headers={ "Authorization": f"Bearer {admin_access_token}" })
+    assert response.status_code == 200
+    assert "db_pool_checkouts" in response.json()
+
+
+@pytest.mark.integration
+def test_read_metrics_forbidden(test_client: TestClient, simple_access_token: str):
+    response = test_client.get("/metrics", headers={ "Authorization": f"Bearer {simple_access_token}" })
+    assert response.status_code == 403
+
+
+if typing.TYPE_CHECKING:
+    from fastapi.testclient import TestClient